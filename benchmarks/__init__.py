@@ -0,0 +1 @@
+"""Benchmarks for tap-tableau-server."""
@@ -0,0 +1,187 @@
+"""Micro-benchmarks of `LocalWorkbookExtractor` over a synthetic corpus.
+
+Generates synthetic workbooks, loads them with the chosen extraction engine
+and times each extractor stage in isolation: `extract_workbook`,
+`extract_datasource`, `extract_connection`, `extract_relation` and
+`extract_table_references`. Results are saved as JSON, and can be compared
+with an earlier run (e.g. from another commit) with `--compare`.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.extractor --workbooks 50 --custom-sql-size 10 \\
+        --output extractor.json --compare extractor-main.json
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import sqlfluff
+
+from tap_tableau_server.local_workbook import LocalWorkbook, load_workbook
+from tap_tableau_server.local_workbook_extractor import LocalWorkbookExtractor
+from tap_tableau_server.tests.synthetic_workbook import (
+    synthetic_workbook_xml, make_workbook_item
+)
+
+STAGES = [
+    'extract_workbook', 'extract_datasource', 'extract_connection',
+    'extract_relation', 'extract_table_references'
+]
+
+
+class StageTimer:
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def __call__(self, stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.samples[stage].append(time.perf_counter() - start)
+        return result
+
+    def summary(self):
+        summary = {}
+        for stage in STAGES:
+            samples = sorted(self.samples.get(stage, []))
+            if not samples:
+                continue
+            summary[stage] = {
+                'calls': len(samples),
+                'total_s': round(sum(samples), 6),
+                'mean_us': round(statistics.mean(samples) * 1e6, 2),
+                'p50_us': round(samples[len(samples) // 2] * 1e6, 2),
+                'p95_us': round(samples[int(len(samples) * 0.95)] * 1e6, 2),
+                'max_us': round(samples[-1] * 1e6, 2),
+            }
+        return summary
+
+
+def build_corpus(args, directory):
+    paths = []
+    for i in range(args.workbooks):
+        path = os.path.join(directory, f"Workbook{i}.twb")
+        with open(path, 'w') as f:
+            f.write(synthetic_workbook_xml(
+                datasources=args.datasources,
+                named_connections=args.named_connections,
+                join_depth=args.join_depth,
+                custom_sql_size=args.custom_sql_size,
+                custom_sql_every=args.custom_sql_every,
+                worksheets=args.worksheets
+            ))
+        paths.append(path)
+    return paths
+
+
+def run_once(wbx, workbooks, timer):
+    """ Walk every workbook through the extractor, as the stream tree does.
+    """
+    for lwb in workbooks:
+        record, datasources = timer('extract_workbook', wbx.extract_workbook, lwb)
+        for datasource in datasources:
+            ds_record, connections = timer(
+                'extract_datasource', wbx.extract_datasource,
+                workbook_id=record['id'], updated_at=record['updated_at'],
+                datasource=datasource
+            )
+            for connection in connections:
+                for conn_record, relation in timer(
+                    'extract_connection', wbx.extract_connection,
+                    workbook_id=record['id'], datasource_id=ds_record['id'],
+                    updated_at=record['updated_at'], connection=connection
+                ) or []:
+                    relations = timer(
+                        'extract_relation', wbx.extract_relation,
+                        workbook_id=record['id'], datasource_id=ds_record['id'],
+                        updated_at=record['updated_at'], relation=relation
+                    )
+                    for rel_record in relations:
+                        timer(
+                            'extract_table_references',
+                            wbx.extract_table_references, rel_record
+                        )
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """ Print the change in mean time per call of each stage.
+    """
+    print(f"Compared with {baseline.get('commit')} ({baseline.get('timestamp')}):",
+          file=sys.stderr)
+    for stage, stats in report['stages'].items():
+        before = baseline.get('stages', {}).get(stage)
+        if not before:
+            continue
+        ratio = stats['mean_us'] / before['mean_us'] if before['mean_us'] else float('nan')
+        print(
+            f"  {stage:<26} {before['mean_us']:>10.1f}us -> {stats['mean_us']:>10.1f}us"
+            f"  ({ratio:.2f}x)",
+            file=sys.stderr
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workbooks', type=int, default=20)
+    parser.add_argument('--datasources', type=int, default=4)
+    parser.add_argument('--named-connections', type=int, default=2)
+    parser.add_argument('--join-depth', type=int, default=3)
+    parser.add_argument('--custom-sql-size', type=int, default=5)
+    parser.add_argument('--custom-sql-every', type=int, default=2)
+    parser.add_argument('--worksheets', type=int, default=5)
+    parser.add_argument('--engine', choices=['documentapi', 'streaming'],
+                        default='streaming')
+    parser.add_argument('--table-reference-parser', default='sqlfluff_only')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="Write the results to this JSON file.")
+    parser.add_argument('--compare', help="A previous results file to compare with.")
+    args = parser.parse_args(argv)
+
+    timer = StageTimer()
+    # No SQL cache, so every run measures the parser itself
+    wbx = LocalWorkbookExtractor(table_reference_parser=args.table_reference_parser)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = build_corpus(args, directory)
+        workbooks = [
+            LocalWorkbook(make_workbook_item(f"wb-{i}"), load_workbook(path, args.engine))
+            for i, path in enumerate(paths)
+        ]
+        for _ in range(args.repeat):
+            run_once(wbx, workbooks, timer)
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'sqlfluff': sqlfluff.__version__,
+        'parameters': vars(args),
+        'stages': timer.summary(),
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
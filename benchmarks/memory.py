@@ -0,0 +1,96 @@
+"""Memory use of the extraction path over a long synthetic run.
+
+Parses synthetic workbooks one after another with the chosen extraction
+engine, compacts them as the client does, and walks each through the
+extractor as the stream tree does. Resident memory and Python heap usage
+(via tracemalloc) are sampled as the run goes on, and should stay flat once
+caches are warm.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.memory --workbooks 10000 --engine documentapi
+"""
+
+import os
+import gc
+import json
+import argparse
+import resource
+import tempfile
+import tracemalloc
+
+from tap_tableau_server.local_workbook import LocalWorkbook, load_workbook
+from tap_tableau_server.local_workbook_extractor import LocalWorkbookExtractor
+from tap_tableau_server.tests.synthetic_workbook import (
+    synthetic_workbook_xml, make_workbook_item
+)
+
+
+def rss_bytes():
+    """ Current resident set size (peak, where /proc is not available).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workbooks', type=int, default=10000)
+    parser.add_argument('--distinct-workbooks', type=int, default=50,
+                        help="Number of different synthetic workbooks to cycle through.")
+    parser.add_argument('--datasources', type=int, default=4)
+    parser.add_argument('--custom-sql-size', type=int, default=5)
+    parser.add_argument('--engine', choices=['documentapi', 'streaming'],
+                        default='documentapi')
+    parser.add_argument('--table-reference-parser', default='fast')
+    parser.add_argument('--samples', type=int, default=20)
+    parser.add_argument('--no-tracemalloc', action='store_true',
+                        help="Only sample RSS, without tracemalloc's overhead.")
+    args = parser.parse_args(argv)
+
+    wbx = LocalWorkbookExtractor(table_reference_parser=args.table_reference_parser)
+    sample_every = max(1, args.workbooks // args.samples)
+    samples = []
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i in range(args.distinct_workbooks):
+            path = os.path.join(directory, f"Workbook{i}.twb")
+            with open(path, 'w') as f:
+                f.write(synthetic_workbook_xml(
+                    datasources=args.datasources + i % 3,
+                    custom_sql_size=args.custom_sql_size
+                ))
+            paths.append(path)
+        for i in range(args.workbooks):
+            lwb = LocalWorkbook(
+                make_workbook_item(f"wb-{i}"),
+                load_workbook(paths[i % len(paths)], args.engine)
+            ).compact()
+            wbx.extract_all(lwb)
+            del lwb
+            if (i + 1) % sample_every == 0:
+                gc.collect()
+                sample = {'workbooks': i + 1, 'rss_mb': round(rss_bytes() / 2 ** 20, 2)}
+                if tracemalloc.is_tracing():
+                    current, peak = tracemalloc.get_traced_memory()
+                    sample['heap_mb'] = round(current / 2 ** 20, 2)
+                    sample['heap_peak_mb'] = round(peak / 2 ** 20, 2)
+                samples.append(sample)
+    # Growth after the first sample, once caches are warm
+    report = {
+        'parameters': vars(args),
+        'samples': samples,
+        'rss_growth_mb': round(samples[-1]['rss_mb'] - samples[0]['rss_mb'], 2),
+    }
+    if 'heap_mb' in samples[0]:
+        report['heap_growth_mb'] = round(samples[-1]['heap_mb'] - samples[0]['heap_mb'], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
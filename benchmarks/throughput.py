@@ -0,0 +1,230 @@
+"""End-to-end throughput benchmark against a stub Tableau Server.
+
+Starts the stub REST server (from the test suite) in a subprocess, serving
+synthetic workbooks, runs the full `TapTableauServer` stream tree against it
+and reports workbooks/sec, records/sec, peak RSS and time per stage.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.throughput --workbooks 500 --latency 0.05 \\
+        --set max_concurrent_downloads=8 --set extraction_engine=streaming
+"""
+
+import io
+import sys
+import json
+import time
+import argparse
+import resource
+import multiprocessing
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from tap_tableau_server.tap import TapTableauServer
+from tap_tableau_server.tests.stub_server import StubTableauServer, StubWorkbook
+from tap_tableau_server.tests.synthetic_workbook import (
+    synthetic_workbook_xml, synthetic_twbx_bytes
+)
+
+START = datetime(2021, 1, 1, tzinfo=timezone.utc)
+# Number of distinct synthetic workbooks the corpus cycles through
+VARIANTS = 8
+
+
+def build_corpus(args):
+    variants = []
+    for v in range(VARIANTS):
+        xml = synthetic_workbook_xml(
+            datasources=max(1, args.datasources + v % 3 - 1),
+            named_connections=args.named_connections,
+            join_depth=args.join_depth,
+            custom_sql_size=args.custom_sql_size,
+            worksheets=args.worksheets
+        )
+        if args.format == 'twbx':
+            variants.append(
+                (synthetic_twbx_bytes(xml, name=f"Variant{v}",
+                                      extract_bytes=args.extract_bytes), 'twbx')
+            )
+        else:
+            variants.append((xml.encode('utf-8'), 'twb'))
+    return [
+        StubWorkbook(
+            id=f"00000000-0000-0000-0000-{i:012d}", name=f"Workbook{i}",
+            updated_at=START + timedelta(minutes=i),
+            content=variants[i % VARIANTS][0],
+            filename=f"Workbook{i}.{variants[i % VARIANTS][1]}"
+        )
+        for i in range(args.workbooks)
+    ]
+
+
+def serve(conn, args):
+    """ Subprocess entrypoint: serve the corpus until told to stop.
+    """
+    with StubTableauServer(
+        build_corpus(args), latency=args.latency, error_rate=args.error_rate,
+        list_error_rate=args.list_error_rate, retry_after=args.retry_after,
+        seed=args.seed
+    ) as stub:
+        conn.send(stub.url)
+        conn.recv()
+        conn.send(stub.requests)
+
+
+class RecordCounter(io.TextIOBase):
+    """ Stands in for stdout, counting Singer RECORD messages per stream.
+    """
+
+    def __init__(self):
+        self.records = defaultdict(int)
+        self._buffer = ''
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split('\n')
+        for line in lines:
+            if '"RECORD"' in line[:40]:
+                self.records[json.loads(line)['stream']] += 1
+        return len(text)
+
+
+def timed_generator(func, stage, timings):
+    """ Wrap a generator function, adding the time spent producing each item
+    (excluding time spent by the consumer) to `timings[stage]`.
+    """
+    def wrapper(*args, **kwargs):
+        generator = func(*args, **kwargs)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                timings[stage] += time.perf_counter() - start
+                return
+            timings[stage] += time.perf_counter() - start
+            yield item
+    return wrapper
+
+
+def timed(func, stage, timings):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[stage] += time.perf_counter() - start
+    return wrapper
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in KiB on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def run(args):
+    parent_conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(child_conn, args), daemon=True)
+    server.start()
+    try:
+        url = parent_conn.recv()
+        config = {'host': url, 'username': 'benchmark', 'password': 'benchmark'}
+        config.update(args.config)
+        tap = TapTableauServer(config=config)
+        timings = defaultdict(float)
+        # Time spent in each stream's own get_records (excluding its children)
+        for name, stream in tap.streams.items():
+            stream.get_records = timed_generator(
+                stream.get_records, f"stream:{name}", timings
+            )
+        client = tap.client
+        client.get_workbooks_page = timed(client.get_workbooks_page, 'list_pages', timings)
+        if hasattr(client, 'get_local_workbook'):
+            # Summed across download threads, so may exceed wall time
+            client.get_local_workbook = timed(
+                client.get_local_workbook, 'download_and_parse (worker total)', timings
+            )
+        counter = RecordCounter()
+        stdout = sys.stdout
+        start = time.perf_counter()
+        sys.stdout = counter
+        try:
+            tap.sync_all()
+        finally:
+            sys.stdout = stdout
+        elapsed = time.perf_counter() - start
+        parent_conn.send('stop')
+        requests = parent_conn.recv()
+    finally:
+        server.join(timeout=10)
+        if server.is_alive():
+            server.terminate()
+    workbooks = counter.records.get('workbook', 0)
+    total_records = sum(counter.records.values())
+    return {
+        'workbooks': workbooks,
+        'records': dict(counter.records),
+        'elapsed_s': round(elapsed, 3),
+        'workbooks_per_s': round(workbooks / elapsed, 2),
+        'records_per_s': round(total_records / elapsed, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'stages_s': {stage: round(t, 3) for stage, t in sorted(timings.items())},
+        'failed_workbooks': len(client.failed_workbooks),
+        'server_requests': requests,
+        'corpus': {
+            'workbooks': args.workbooks, 'format': args.format,
+            'datasources': args.datasources,
+            'named_connections': args.named_connections,
+            'join_depth': args.join_depth, 'custom_sql_size': args.custom_sql_size,
+            'worksheets': args.worksheets, 'latency': args.latency,
+            'error_rate': args.error_rate
+        },
+        'config': args.config,
+    }
+
+
+def parse_setting(value):
+    key, _, raw = value.partition('=')
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workbooks', type=int, default=200)
+    parser.add_argument('--format', choices=['twb', 'twbx'], default='twbx')
+    parser.add_argument('--datasources', type=int, default=3)
+    parser.add_argument('--named-connections', type=int, default=2)
+    parser.add_argument('--join-depth', type=int, default=2)
+    parser.add_argument('--custom-sql-size', type=int, default=3)
+    parser.add_argument('--worksheets', type=int, default=20)
+    parser.add_argument('--extract-bytes', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Seconds added to every stub server response.")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Fraction of downloads that fail with a 503.")
+    parser.add_argument('--list-error-rate', type=float, default=0.0,
+                        help="Fraction of listings that fail with a 503.")
+    parser.add_argument('--retry-after', type=float, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--set', dest='config', action='append', default=[],
+                        type=parse_setting, metavar='KEY=VALUE',
+                        help="Tap config setting (JSON values), may be repeated.")
+    parser.add_argument('--output', help="Also write the report to this JSON file.")
+    args = parser.parse_args(argv)
+    args.config = dict(args.config)
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+"""An asyncio implementation of the Tableau Server client, built on aiohttp.
+
+All requests share one connection pool and one event loop, which runs in a
+background thread, so hundreds of listings and downloads can be in flight
+without holding a thread each. Downloads are held in memory and read with
+the streaming engine. Only the .twb XML is kept from .twbx downloads.
+"""
+
+import time
+import asyncio
+import logging
+import tempfile
+import threading
+from collections import deque
+import xml.etree.ElementTree as ET
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import tableauserverclient as tsc
+from tableauserverclient.server.request_factory import RequestFactory
+from tableauserverclient.server.endpoint.exceptions import ServerResponseError
+
+from .client import BaseTableauServerClient, download_exceptions
+from .compact_workbook import compact_workbook
+from .download import (
+    CHUNK_SIZE, ContentCopier, UnsupportedArchiveError, check_download_size
+)
+from .local_workbook import LocalWorkbook
+from .metrics import metrics
+from .session import (
+    DEFAULT_SESSION_MAX_AGE, NAMESPACE, check_status, is_unauthorized
+)
+from .streaming_workbook import parse_workbook
+from .throttling import (
+    RETRYABLE_EXCEPTIONS, THROTTLE_STATUSES, RetryPolicy, Throttle, ThrottledError,
+    parse_retry_after
+)
+
+
+logger = logging.getLogger('tap_tableau_server.async_client')
+# Errors of aiohttp requests, retried like those of `requests`
+AIOHTTP_RETRYABLE_EXCEPTIONS = (
+    (aiohttp.ClientError, asyncio.TimeoutError) if aiohttp is not None else ()
+)
+
+
+class AsyncTableauServerClient(BaseTableauServerClient):
+    """ A Tableau Server REST API client built on asyncio and aiohttp.
+
+    Up to `max_concurrent_downloads` Workbooks are downloaded at once over a
+    pool of at most `max_connections` connections. Workbooks are yielded in
+    listing order, as with `TableauServerClient`.
+    """
+
+    def __init__(
+        self, host, username, password, site_id=None,
+        max_concurrent_downloads=100, max_connections=100,
+        download_spill_bytes=64 * 1024 * 1024, max_download_bytes=None,
+        api_version='3.2',
+        max_age=DEFAULT_SESSION_MAX_AGE, workbook_cache=None,
+        workbook_cache_warm_dir=None, throttle=None,
+        extraction_backend='download', metadata_batch_size=100,
+        metadata_download_fallback=False
+    ):
+        if aiohttp is None:
+            raise ImportError(
+                "client_backend 'async' requires aiohttp. "
+                "Install tap-tableau-server with the 'async' extra."
+            )
+        if throttle is None:
+            throttle = Throttle(policy=RetryPolicy(
+                retry_on=RETRYABLE_EXCEPTIONS + AIOHTTP_RETRYABLE_EXCEPTIONS
+            ))
+        super().__init__(
+            throttle=throttle, workbook_cache=workbook_cache,
+            workbook_cache_warm_dir=workbook_cache_warm_dir,
+            extraction_backend=extraction_backend,
+            metadata_batch_size=metadata_batch_size,
+            metadata_download_fallback=metadata_download_fallback
+        )
+        self.request_exceptions = download_exceptions + AIOHTTP_RETRYABLE_EXCEPTIONS
+        self._host = host.rstrip('/')
+        self._username = username
+        self._password = password
+        self._site_id = site_id or ''
+        self._max_concurrent_downloads = max(1, max_concurrent_downloads or 1)
+        self._max_connections = max(1, max_connections or 1)
+        self._download_spill_bytes = download_spill_bytes
+        self._max_download_bytes = max_download_bytes
+        self._api_version = api_version
+        self._max_age = max_age
+        # Session state, only touched from the event loop
+        self._http = None
+        self._auth_lock = None
+        self._auth_token = None
+        self._site_luid = None
+        self._signed_in_at = None
+        self._generation = 0
+        # Run the event loop in a background thread
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name='tableau-async-client', daemon=True
+        )
+        self._thread.start()
+        self._run(self._start())
+
+    @property
+    def authentication(self):
+        return tsc.TableauAuth(
+            self._username, self._password,
+            site_id=self._site_id
+        )
+
+    @property
+    def base_url(self):
+        return f"{self._host}/api/{self._api_version}"
+
+    def _run(self, coro):
+        """ Run a coroutine on the event loop, blocking until it is done.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _start(self):
+        self._http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self._max_connections)
+        )
+        self._auth_lock = asyncio.Lock()
+
+    async def _sign_in(self):
+        url = f"{self.base_url}/auth/signin"
+        body = RequestFactory.Auth.signin_req(self.authentication)
+        async with self._http.post(
+            url, data=body, headers={'Content-Type': 'application/xml'}
+        ) as response:
+            content = await response.read()
+            check_status(response.status, content)
+        parsed = ET.fromstring(content)
+        self._auth_token = parsed.find('t:credentials', NAMESPACE).get('token')
+        self._site_luid = parsed.find('.//t:site', NAMESPACE).get('id')
+        self._signed_in_at = time.monotonic()
+        self._generation += 1
+        logger.info(f"Signed in to {self._host} (session {self._generation}).")
+
+    async def _current(self):
+        async with self._auth_lock:
+            if (
+                self._auth_token is None
+                or (time.monotonic() - self._signed_in_at) >= self._max_age
+            ):
+                await self._sign_in()
+            return self._auth_token, self._generation
+
+    async def _refresh(self, generation):
+        async with self._auth_lock:
+            # Another request may already have signed in again
+            if generation == self._generation:
+                await self._sign_in()
+
+    async def _get(self, path, read):
+        """ GET `path` (relative to the signed-in site), returning
+        `await read(response)`.
+        """
+        return await self._request('GET', read, path=path)
+
+    async def _request(self, method, read, path=None, url=None, **kwargs):
+        """ Send a request to `url`, or to `path` relative to the signed-in
+        site, returning `await read(response)`.
+
+        If the server rejects the session token, sign in again and retry once.
+        """
+        for attempt in range(2):
+            token, generation = await self._current()
+            request_url = url or f"{self.base_url}/sites/{self._site_luid}/{path}"
+            async with self._http.request(
+                method, request_url, headers={'x-tableau-auth': token}, **kwargs
+            ) as response:
+                if response.status < 400:
+                    return await read(response)
+                content = await response.read()
+                if response.status in THROTTLE_STATUSES:
+                    raise ThrottledError(
+                        response.status,
+                        parse_retry_after(response.headers.get('Retry-After'))
+                    )
+            try:
+                check_status(response.status, content)
+            except ServerResponseError as e:
+                if attempt or not is_unauthorized(e):
+                    raise
+                logger.info("Session token rejected. Signing in again.")
+                await self._refresh(generation)
+
+    async def _get_workbooks_page(self, req_option):
+        async def read(response):
+            return await response.read()
+
+        content = await self._get(req_option.apply_query_params('workbooks'), read)
+        return (
+            tsc.WorkbookItem.from_response(content, NAMESPACE),
+            tsc.PaginationItem.from_response(content, NAMESPACE)
+        )
+
+    def get_workbooks_page(self, req_option):
+        return self._run(
+            self.throttle.acall(self._get_workbooks_page, req_option)
+        )
+
+    async def _get_projects_page(self, req_option):
+        async def read(response):
+            return await response.read()
+
+        content = await self._get(req_option.apply_query_params('projects'), read)
+        return (
+            tsc.ProjectItem.from_response(content, NAMESPACE),
+            tsc.PaginationItem.from_response(content, NAMESPACE)
+        )
+
+    def get_projects_page(self, req_option):
+        return self._run(
+            self.throttle.acall(self._get_projects_page, req_option)
+        )
+
+    async def _get_workbook_item(self, workbook_id):
+        async def read(response):
+            return await response.read()
+
+        content = await self._get(f"workbooks/{workbook_id}", read)
+        return tsc.WorkbookItem.from_response(content, NAMESPACE)[0]
+
+    def get_workbook_item(self, workbook_id):
+        return self._run(
+            self.throttle.acall(self._get_workbook_item, workbook_id)
+        )
+
+    async def _query_metadata(self, query, variables):
+        async def read(response):
+            return await response.json(content_type=None)
+
+        return await self._request(
+            'POST', read, url=f"{self._host}/api/metadata/graphql",
+            json={'query': query, 'variables': variables or {}}
+        )
+
+    def query_metadata(self, query, variables=None):
+        return self._run(
+            self.throttle.acall(self._query_metadata, query, variables)
+        )
+
+    async def _download_workbook(self, workbook_item, twb_only=True):
+        async def read(response):
+            check_download_size(
+                response.content_length or 0, workbook_item.id, self._max_download_bytes
+            )
+            disposition = response.content_disposition
+            filename = (disposition and disposition.filename) or workbook_item.id
+            buffer = tempfile.SpooledTemporaryFile(max_size=self._download_spill_bytes)
+            copier = ContentCopier(
+                buffer, workbook_item.id, max_bytes=self._max_download_bytes,
+                twb_only=twb_only
+            )
+            try:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    if copier.write(chunk):
+                        # The rest of the archive is not needed
+                        response.close()
+                        break
+                copier.close()
+            except BaseException:
+                buffer.close()
+                raise
+            metrics.observe('download_bytes', copier.transferred, workbook_item.id)
+            buffer.seek(0)
+            return filename, buffer
+
+        def parse(buffer, filename):
+            with metrics.timer('parse_seconds', workbook_item.id):
+                return parse_workbook(buffer, filename=filename)
+
+        with metrics.timer('download_seconds', workbook_item.id):
+            try:
+                filename, buffer = await self._get(
+                    f"workbooks/{workbook_item.id}/content?includeExtract=False", read
+                )
+            except UnsupportedArchiveError as e:
+                if not twb_only:
+                    raise
+                logger.warning(f"Downloading all of Workbook {workbook_item.id}: {e}")
+                return await self._download_workbook(workbook_item, twb_only=False)
+        with buffer:
+            # Parse off the event loop, so other transfers carry on meanwhile
+            return await self._loop.run_in_executor(None, parse, buffer, filename)
+
+    async def _get_local_workbook(self, workbook_item):
+        lwb = await self._loop.run_in_executor(
+            None, self.get_cached_workbook, workbook_item
+        )
+        if lwb is not None:
+            logger.info(f"Workbook {workbook_item.id} unchanged, using cached copy.")
+            return lwb
+        try:
+            workbook = await self.throttle.acall(
+                self._download_workbook, workbook_item
+            )
+        except self.request_exceptions as e:
+            self.record_failed_workbook(workbook_item, e)
+            return None
+        if self.workbook_cache is not None:
+            await self._loop.run_in_executor(
+                None, self.workbook_cache.put,
+                workbook_item.id, workbook_item.updated_at, compact_workbook(workbook)
+            )
+        return LocalWorkbook(workbook_item, workbook, on_disk=False)
+
+    def iterate_server_workbooks(self, workbook_items):
+        """ Download Workbooks concurrently on the event loop.
+
+        At most `max_concurrent_downloads` Workbooks are in flight (downloading
+        or waiting to be consumed) at any one time, and they are yielded in the
+        order of `workbook_items`.
+        """
+        pending = deque()
+        try:
+            for wbi in workbook_items:
+                pending.append(asyncio.run_coroutine_threadsafe(
+                    self._get_local_workbook(wbi), self._loop
+                ))
+                while len(pending) >= self._max_concurrent_downloads:
+                    lwb = pending.popleft().result()
+                    if lwb is not None:
+                        yield lwb
+            while pending:
+                lwb = pending.popleft().result()
+                if lwb is not None:
+                    yield lwb
+        except GeneratorExit:
+            logger.warning("Generator exited early. Not all Workbooks were fetched.")
+            return
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def _close(self):
+        if self._auth_token is not None:
+            try:
+                async with self._http.post(
+                    f"{self.base_url}/auth/signout",
+                    headers={'x-tableau-auth': self._auth_token}
+                ) as response:
+                    check_status(response.status, await response.read())
+                logger.info(f"Signed out of {self._host}.")
+            except Exception as e:
+                logger.warning(f"Failed to sign out of {self._host}: {e}")
+            self._auth_token = None
+        await self._http.close()
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        try:
+            self._run(self._close())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import zlib
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from .workbook_ids import encode_ids, decode_ids
+
+
+logger = logging.getLogger('tap_tableau_server.cache')
+# Marks a cache miss, as a cached definition may itself be None
+_MISSING = object()
+
+
+class LRUCache:
+    """ A bounded, thread-safe, in-process least-recently-used cache.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+                return self._data[key]
+            except KeyError:
+                return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class SqliteCache:
+    """ A persistent key/value cache stored in a SQLite database.
+
+    Values are bytes. Once the total size of stored values exceeds
+    `max_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path, table='cache', max_bytes=100 * 1024 * 1024):
+        self.path = path
+        self.table = table
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed_at REAL)"
+            )
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_accessed_at "
+                f"ON {table} (accessed_at)"
+            )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            with self._conn:
+                self._conn.execute(
+                    f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?",
+                    (time.time(), key)
+                )
+            return row[0]
+
+    def put(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} "
+                "(key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time())
+            )
+            self._evict()
+
+    def _evict(self):
+        (total,) = self._conn.execute(
+            f"SELECT COALESCE(SUM(size), 0) FROM {self.table}"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            f"SELECT key, size FROM {self.table} ORDER BY accessed_at ASC"
+        )
+        evict = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evict.append((key,))
+            total -= size
+        self._conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", evict)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TableReferenceCache:
+    """ Memoizes table references parsed from custom SQL.
+
+    Entries are keyed by a hash of the (cleaned) SQL text and dialect, and
+    held in an in-process LRU. If `cache_dir` is given, entries are also
+    persisted to a SQLite database there, so they survive between runs.
+    """
+
+    # Bump when the meaning of cached entries changes
+    FORMAT_VERSION = 2
+
+    def __init__(self, maxsize=4096, cache_dir=None, max_bytes=None, version=''):
+        self.version = version
+        self.memory = LRUCache(maxsize=maxsize)
+        self.store = None
+        if cache_dir:
+            self.store = SqliteCache(
+                os.path.join(cache_dir, 'table_references.sqlite'),
+                table='table_references',
+                max_bytes=max_bytes or 100 * 1024 * 1024
+            )
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, sql, dialect):
+        return hashlib.sha256(
+            f"{self.FORMAT_VERSION}\0{self.version}\0{dialect}\0{sql}".encode('utf-8')
+        ).hexdigest()
+
+    def peek(self, sql, dialect):
+        """ Like `get`, without counting a hit or miss.
+        """
+        key = self.key(sql, dialect)
+        refs = self.memory.get(key)
+        if refs is None and self.store is not None:
+            value = self.store.get(key)
+            if value is not None:
+                refs = json.loads(value)
+                self.memory.put(key, refs)
+        return refs
+
+    def get(self, sql, dialect):
+        refs = self.peek(sql, dialect)
+        if refs is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return refs
+
+    def put(self, sql, dialect, refs, persist=True):
+        key = self.key(sql, dialect)
+        self.memory.put(key, refs)
+        if persist and self.store is not None:
+            self.store.put(key, json.dumps(refs).encode('utf-8'))
+
+    def get_or_parse(self, sql, dialect, parse):
+        """ Return cached table references for `sql`, calling
+        `parse(sql, dialect)` and caching the result on a miss.
+
+        `parse` returns None for SQL it fails to parse, which is cached as no
+        table references for this run only, so a later run parses it again.
+        """
+        refs = self.get(sql, dialect)
+        if refs is None:
+            refs = parse(sql, dialect)
+            self.put(sql, dialect, refs or [], persist=refs is not None)
+            refs = refs or []
+        return refs
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return (self.hits / lookups) if lookups else 0.0
+
+    def log_stats(self):
+        logger.info(
+            f"Table reference cache: {self.hits} hits, {self.misses} misses "
+            f"({self.hit_rate:.1%} hit rate)."
+        )
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+
+class DefinitionCache:
+    """ An in-process cache of extracted definitions (connections, relations
+    and custom SQL), content-addressed by their normalized attributes, so
+    that definitions copied between Workbooks are extracted once per run.
+
+    Lookups and distinct definitions are counted per kind of definition, to
+    report how much of the run was deduplicated.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.memory = LRUCache(maxsize=maxsize)
+        self.lookups = {}
+        self.misses = {}
+        self._lock = threading.Lock()
+
+    def get_or_extract(self, kind, normalized, extract):
+        """ Return the cached definition of `kind` whose normalized
+        attributes are `normalized` (a hashable tuple), calling `extract()`
+        on a miss.
+        """
+        key = (kind, normalized)
+        value = self.memory.get(key, _MISSING)
+        with self._lock:
+            self.lookups[kind] = self.lookups.get(kind, 0) + 1
+            if value is _MISSING:
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+        if value is _MISSING:
+            value = extract()
+            self.memory.put(key, value)
+        return value
+
+    def dedup_ratio(self, kind):
+        """ Fraction of lookups of `kind` served from the cache.
+        """
+        lookups = self.lookups.get(kind, 0)
+        return (1 - self.misses.get(kind, 0) / lookups) if lookups else 0.0
+
+    def log_stats(self):
+        for kind in sorted(self.lookups):
+            logger.info(
+                f"Deduplicated {kind} definitions: {self.lookups[kind]} lookups, "
+                f"{self.misses.get(kind, 0)} distinct "
+                f"({self.dedup_ratio(kind):.1%} deduplicated)."
+            )
+
+
+class WorkbookCache:
+    """ A persistent cache of parsed Workbooks, keyed by Workbook id and
+    `updated_at`, so unchanged Workbooks need not be downloaded again.
+
+    Workbooks are stored as pickled CompactWorkbooks in a SQLite database in
+    `cache_dir`, evicting the least recently used once over `max_bytes`.
+    """
+
+    # Bump when the CompactWorkbook classes change
+    FORMAT_VERSION = 1
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.store = SqliteCache(
+            os.path.join(cache_dir, 'workbooks.sqlite'),
+            table='workbooks',
+            max_bytes=max_bytes or 1024 * 1024 * 1024
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, workbook_id, updated_at):
+        return f"{self.FORMAT_VERSION}:{workbook_id}:{updated_at.isoformat()}"
+
+    def get(self, workbook_id, updated_at):
+        value = self.store.get(self.key(workbook_id, updated_at))
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(zlib.decompress(value))
+
+    def put(self, workbook_id, updated_at, workbook):
+        self.store.put(
+            self.key(workbook_id, updated_at),
+            zlib.compress(pickle.dumps(workbook, protocol=pickle.HIGHEST_PROTOCOL))
+        )
+
+    def log_stats(self):
+        logger.info(
+            f"Workbook cache: {self.hits} hits, {self.misses} misses."
+        )
+
+    def close(self):
+        self.store.close()
+
+
+class WorkbookIdsCache:
+    """ A persistent cache of each site's Workbook IDs, keyed by site and
+    the digest of the IDs, so that only the digest need be kept in state.
+
+    ID sets are stored as fingerprints in a SQLite database in `cache_dir`,
+    evicting the least recently used once over `max_bytes`.
+    """
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.store = SqliteCache(
+            os.path.join(cache_dir, 'workbook_ids.sqlite'),
+            table='workbook_ids',
+            max_bytes=max_bytes or 100 * 1024 * 1024
+        )
+
+    def get(self, site_id, digest):
+        """ The IDs whose digest is `digest`, or None if they are not cached.
+        """
+        value = self.store.get(f"{site_id}:{digest}")
+        return decode_ids(value.decode('ascii')) if value is not None else None
+
+    def put(self, site_id, digest, ids):
+        self.store.put(f"{site_id}:{digest}", encode_ids(ids).encode('ascii'))
+
+    def close(self):
+        self.store.close()
@@ -1,54 +1,120 @@
+import os
+import re
 import abc
 import pytz
 import logging
 import tempfile
+import itertools
+from contextlib import closing
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dateutil.parser import parse
-from typing import Union, List, Iterable
+from typing import Union, Iterable, Collection
 
+import requests
 import tableauserverclient as tsc
 from tableauserverclient.server.endpoint.exceptions import (
     ServerResponseError, InternalServerError
 )
 
-from .utils import retry
-from .local_workbook import LocalWorkbook
+from .download import DownloadTooLargeError
+from .metrics import metrics
+from .metadata import EXTRACTION_BACKENDS, MetadataError, MetadataWorkbookSource
+from .session import TableauServerSession, check_status, is_not_found
+from .throttling import Throttle, ThrottledError
+from .compact_workbook import compact_workbook
+from .local_workbook import (
+    LocalWorkbook, EXTRACTION_ENGINES, DOWNLOAD_MODES, load_workbook
+)
 
 
 logger = logging.getLogger('tap_tableau_server.client')
 tsc_exceptions = (ServerResponseError, InternalServerError)
+# Errors that skip a Workbook (once retries are exhausted) rather than the sync
+download_exceptions = tsc_exceptions + (
+    ThrottledError, DownloadTooLargeError, requests.RequestException
+)
+# Largest page size accepted by the Tableau REST API
+MAX_PAGE_SIZE = 1000
+# Characters that cannot appear in a REST API filter value
+UNFILTERABLE_CHARS_RE = re.compile(r'[,:&#?%+]')
+# Stands in for the WorkbookItem of a Workbook that could not be looked up
+UnknownWorkbookItem = namedtuple(
+    'UnknownWorkbookItem', ['id', 'name', 'updated_at', 'project_id']
+)
 
 
 class BaseTableauServerClient(metaclass=abc.ABCMeta):
     """ Abstract base class for clients.
+
+    Subclasses list WorkbookItems, download their Workbooks and send
+    Metadata API queries; paging options, the Workbook cache and the sync
+    entrypoints are shared.
+
+    With `extraction_backend` 'metadata', Workbooks are built from batches of
+    `metadata_batch_size` Metadata API results instead of being downloaded,
+    unless the Metadata API has no complete details of them and
+    `metadata_download_fallback` is set.
     """
 
-    def list_all_workbook_ids(self):
+    # Errors of a request that has exhausted its retries
+    request_exceptions = download_exceptions
+
+    def __init__(
+        self, throttle=None, workbook_cache=None, workbook_cache_warm_dir=None,
+        extraction_backend='download', metadata_batch_size=100,
+        metadata_download_fallback=False
+    ):
+        self.throttle = throttle or Throttle()
+        self.workbook_cache = workbook_cache
+        self._workbook_cache_warm_dir = workbook_cache_warm_dir
+        self.failed_workbooks = []
+        if extraction_backend not in EXTRACTION_BACKENDS:
+            raise ValueError(
+                f"Unknown extraction_backend '{extraction_backend}'. "
+                f"Expected one of {EXTRACTION_BACKENDS}."
+            )
+        self.metadata = None
+        if extraction_backend == 'metadata':
+            self.metadata = MetadataWorkbookSource(self.query_metadata)
+        self._metadata_batch_size = max(1, metadata_batch_size or 1)
+        self._metadata_download_fallback = metadata_download_fallback
+
+    @abc.abstractmethod
+    def get_workbooks_page(self, req_option):
+        """ Return one page of `(WorkbookItems, PaginationItem)`.
+        """
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def get_projects_page(self, req_option):
+        """ Return one page of `(ProjectItems, PaginationItem)`.
+        """
+        raise NotImplementedError()
 
-class TableauServerClient(BaseTableauServerClient):
-    """ A wrapper around the `tableauserverclient` library.
-    """
+    @abc.abstractmethod
+    def get_workbook_item(self, workbook_id) -> tsc.WorkbookItem:
+        """ Return the WorkbookItem of one Workbook.
+        """
+        raise NotImplementedError()
 
-    def __init__(self, host, username, password, site_id=None):
-        self._host = host
-        self._username = username
-        self._password = password
-        self._site_id = site_id or ''
+    @abc.abstractmethod
+    def query_metadata(self, query, variables=None):
+        """ Send a GraphQL query to the Metadata API, returning the parsed
+        JSON response.
+        """
+        raise NotImplementedError()
 
-    @property
-    def authentication(self):
-        return tsc.TableauAuth(
-            self._username, self._password,
-            site_id=self._site_id
-        )
+    @abc.abstractmethod
+    def iterate_server_workbooks(
+        self, workbook_items: Iterable[tsc.WorkbookItem]
+    ) -> Iterable[LocalWorkbook]:
+        raise NotImplementedError()
 
-    @property
-    def server(self):
-        server = tsc.Server(self._host)
-        server.version = '3.2'
-        return server
+    @abc.abstractmethod
+    def close(self):
+        raise NotImplementedError()
 
     def format_checkpoint_datetime(self, dt):
         return (
@@ -58,28 +124,8 @@ class TableauServerClient(BaseTableauServerClient):
             .replace('+00:00', 'Z')
         )
 
-    def list_all_workbook_ids(self):
-        # Get all WorkbookItem id's, sorted by UpdatedAt
-        req_option = tsc.RequestOptions()
-        req_option.sort.add(
-            tsc.Sort(
-                tsc.RequestOptions.Field.UpdatedAt,
-                tsc.RequestOptions.Direction.Asc
-            )
-        )
-        workbook_ids = []
-        server = self.server
-        with server.auth.sign_in(self.authentication):
-            workbook_ids = [
-                wb.id for wb in tsc.Pager(server.workbooks, req_option)
-            ]
-        return workbook_ids
-
-    def list_workbook_ids(
-        self, checkpoint:Union[datetime, str] = None,
-        limit: int = None
-    ) -> List[str]:
-        # Create client filter object
+    def _workbook_request_options(self, checkpoint=None, project_name=None):
+        # Create client filter object, sorted by UpdatedAt
         req_option = tsc.RequestOptions()
         req_option.sort.add(
             tsc.Sort(
@@ -101,56 +147,440 @@ class TableauServerClient(BaseTableauServerClient):
                     cp
                 )
             )
-            # Get filtered id's
-            server = self.server
-            with server.auth.sign_in(self.authentication):
-                workbook_ids = [
-                    wb.id for wb in tsc.Pager(server.workbooks, req_option)
-                ]
+        # Names that would break the (unescaped) filter expression are matched
+        # by project ID alone, after listing
+        if project_name and not UNFILTERABLE_CHARS_RE.search(project_name):
+            req_option.filter.add(
+                tsc.Filter(
+                    tsc.RequestOptions.Field.ProjectName,
+                    tsc.RequestOptions.Operator.Equals,
+                    project_name
+                )
+            )
+        return req_option
+
+    @staticmethod
+    def _paginate(get_page, req_option):
+        """ Lazily yield each page of items of a paged listing.
+        """
+        page_number = 1
+        while True:
+            req_option.page_number(page_number)
+            items, pagination = get_page(req_option)
+            yield items
+            if (
+                not items
+                or pagination.total_available is None
+                or page_number * req_option.pagesize >= pagination.total_available
+            ):
+                return
+            page_number += 1
+
+    def list_workbooks(
+        self, checkpoint: Union[datetime, str] = None,
+        limit: int = None, project_id: str = None, project_name: str = None,
+        skip_ids: Collection[str] = None
+    ) -> Iterable[tsc.WorkbookItem]:
+        """ Lazily list WorkbookItems updated since `checkpoint`, sorted by
+        UpdatedAt, optionally only those in one project.
+
+        Pages are only requested as the caller consumes them, and no further
+        pages are requested once `limit` WorkbookItems have been yielded. This
+        lets downloads of the first page start before later pages are listed.
+
+        `skip_ids` are Workbooks already synced at the checkpoint itself
+        (which the UpdatedAt filter includes). They are skipped unless they
+        have been updated since.
+        """
+        req_option = self._workbook_request_options(checkpoint, project_name)
+        if skip_ids and checkpoint:
+            skip_ids = set(skip_ids)
+            skip_until = (
+                checkpoint if isinstance(checkpoint, datetime) else parse(checkpoint)
+            )
+            if skip_until.tzinfo is None:
+                skip_until = skip_until.replace(tzinfo=pytz.utc)
         else:
-            # Get all workbook id's
-            workbook_ids = self.list_all_workbook_ids()
+            skip_ids = None
+        if limit:
+            req_option.page_size(min(limit, MAX_PAGE_SIZE))
+
+        def get_page(req_option):
+            with metrics.timer('list_page_seconds'):
+                workbooks, pagination = self.get_workbooks_page(req_option)
+            metrics.incr('list_pages')
+            metrics.incr('workbooks_listed', len(workbooks))
+            return workbooks, pagination
+
+        count = 0
+        for workbooks in self._paginate(get_page, req_option):
+            for wbi in workbooks:
+                # Project names are not unique (nested projects), IDs are
+                if project_id and wbi.project_id != project_id:
+                    continue
+                if skip_ids and wbi.id in skip_ids and wbi.updated_at <= skip_until:
+                    metrics.incr('workbooks_skipped_at_checkpoint')
+                    continue
+                yield wbi
+                count += 1
+                if limit and count >= limit:
+                    return
 
-        # Return, with optional applied limit
+    def list_projects(self) -> Iterable[tsc.ProjectItem]:
+        req_option = tsc.RequestOptions(pagesize=MAX_PAGE_SIZE)
+        for projects in self._paginate(self.get_projects_page, req_option):
+            for project in projects:
+                yield project
+
+    def list_all_workbook_ids(self):
+        # Get all WorkbookItem id's, sorted by UpdatedAt
+        return [wb.id for wb in self.list_workbooks()]
+
+    def list_workbook_ids(
+        self, checkpoint: Union[datetime, str] = None,
+        limit: int = None
+    ) -> Iterable[str]:
+        for wb in self.list_workbooks(checkpoint=checkpoint, limit=limit):
+            yield wb.id
+
+    def _load_warm_workbook(self, workbook_item):
+        """ Read a previously downloaded Workbook from
+        `<workbook_cache_warm_dir>/<workbook id>/`, if it is at least as new
+        as the WorkbookItem.
+        """
+        lwb_dir = os.path.join(self._workbook_cache_warm_dir, workbook_item.id)
+        if not os.path.isdir(lwb_dir):
+            return None
+        try:
+            filepath = LocalWorkbook.discover_workbook_file(lwb_dir)
+        except ValueError as e:
+            logger.warning(f"Skipping warm Workbook dir: {e}")
+            return None
+        modified_at = datetime.fromtimestamp(os.path.getmtime(filepath), tz=pytz.utc)
+        if workbook_item.updated_at and modified_at < workbook_item.updated_at:
+            return None
+        logger.info(f"Loading Workbook {workbook_item.id} from {filepath}")
+        return compact_workbook(load_workbook(filepath, engine='streaming'))
+
+    def get_cached_workbook(self, workbook_item):
+        """ Return a LocalWorkbook from the Workbook cache (or its warm dir),
+        or None if this version of the Workbook has not been seen before.
+        """
+        if self.workbook_cache is None:
+            return None
+        workbook = self.workbook_cache.get(workbook_item.id, workbook_item.updated_at)
+        if workbook is None and self._workbook_cache_warm_dir:
+            workbook = self._load_warm_workbook(workbook_item)
+            if workbook is not None:
+                self.workbook_cache.put(
+                    workbook_item.id, workbook_item.updated_at, workbook
+                )
+        if workbook is None:
+            return None
+        metrics.incr('workbook_cache_hits')
+        return LocalWorkbook(workbook_item, workbook, on_disk=False)
+
+    def record_failed_workbook(self, workbook_item, error):
+        logger.warning(f"Failed to fetch Workbook {workbook_item.id}: {error}")
+        metrics.incr('failed_workbooks')
+        self.failed_workbooks.append((workbook_item, error))
+
+    def log_summary(self):
+        """ Log every Workbook that could not be fetched.
+        """
+        if self.failed_workbooks:
+            logger.warning(
+                f"{len(self.failed_workbooks)} Workbooks could not be fetched "
+                "and were skipped:\n" + "\n".join(
+                    f"  {wbi.id} ({wbi.name}, updated {wbi.updated_at}): "
+                    f"{type(error).__name__}: {error}"
+                    for wbi, error in self.failed_workbooks
+                )
+            )
+
+    def get_workbooks(
+        self, checkpoint, limit=None, project_id=None, project_name=None,
+        skip_ids=None
+    ):
+        # Get filtered list of workbook ids
+        if checkpoint:
+            logger.info(f"Received checkpoint: {checkpoint}")
+        if skip_ids:
+            logger.info(
+                f"Received {len(skip_ids)} Workbooks already synced at checkpoint"
+            )
         if limit:
-            return workbook_ids[:limit]
+            logger.info(f"Received limit: {limit}")
+        if project_id:
+            logger.info(f"Received project: {project_name} ({project_id})")
+        filtered_workbooks = self.list_workbooks(
+            checkpoint=checkpoint, limit=limit,
+            project_id=project_id, project_name=project_name, skip_ids=skip_ids
+        )
+        if self.metadata is not None:
+            workbooks = self.iterate_metadata_workbooks(filtered_workbooks)
+        else:
+            workbooks = self.iterate_server_workbooks(filtered_workbooks)
+        for lwb in workbooks:
+            logger.info(f"Fetched Workbook with ID: {lwb.id}")
+            yield lwb
+
+    def get_workbooks_by_id(
+        self, workbook_ids: Iterable[str], project_id: str = None
+    ) -> Iterable[LocalWorkbook]:
+        """ Fetch Workbooks by ID, such as those that could not be fetched in
+        a previous run.
+
+        Workbooks that no longer exist are left out. Workbooks that cannot be
+        looked up or downloaded are recorded in `failed_workbooks`, as
+        belonging to `project_id` if they cannot be looked up.
+        """
+        def workbook_items():
+            for workbook_id in workbook_ids:
+                try:
+                    yield self.get_workbook_item(workbook_id)
+                except self.request_exceptions as e:
+                    if is_not_found(e):
+                        logger.info(f"Workbook {workbook_id} no longer exists.")
+                        continue
+                    self.record_failed_workbook(
+                        UnknownWorkbookItem(workbook_id, None, None, project_id), e
+                    )
+
+        if self.metadata is not None:
+            workbooks = self.iterate_metadata_workbooks(workbook_items())
         else:
-            return workbook_ids
-
-    @retry(exceptions=tsc_exceptions, logger=logger, finally_raise=False)
-    def get_local_workbook(self, wb_id, base_folder):
-        server = self.server
-        with server.auth.sign_in(self.authentication):
-            return LocalWorkbook.from_tableau_server(
-                server=server, workbook_id=wb_id,
-                base_folder=base_folder,
-                download_workbook=True
+            workbooks = self.iterate_server_workbooks(workbook_items())
+        for lwb in workbooks:
+            logger.info(f"Fetched Workbook with ID: {lwb.id}")
+            yield lwb
+
+    def iterate_metadata_workbooks(
+        self, workbook_items: Iterable[tsc.WorkbookItem]
+    ) -> Iterable[LocalWorkbook]:
+        """ Build Workbooks from the Metadata API, a batch at a time.
+
+        Workbooks the Metadata API has no complete details of, or whole
+        batches whose query fails, are downloaded with
+        `iterate_server_workbooks` if `metadata_download_fallback` is set, and
+        otherwise recorded in `failed_workbooks`, to be retried by a later
+        run. Downloaded Workbooks keep the 'download' `id_scheme`, as their
+        record IDs follow the names in the Workbook file rather than the
+        Metadata API's. Workbooks are yielded in the order of `workbook_items`.
+        """
+        workbook_items = iter(workbook_items)
+        while True:
+            batch = list(itertools.islice(workbook_items, self._metadata_batch_size))
+            if not batch:
+                return
+            try:
+                with metrics.timer('metadata_query_seconds'):
+                    workbooks = self.metadata.get_workbooks(batch)
+                error = MetadataError("The Metadata API has not indexed the Workbook.")
+            except (MetadataError, ValueError) + self.request_exceptions as e:
+                logger.warning(
+                    f"Metadata API query of {len(batch)} Workbooks failed: {e}"
+                )
+                workbooks, error = {}, e
+            metrics.incr('metadata_workbooks', len(workbooks))
+            missing = [wbi for wbi in batch if wbi.id not in workbooks]
+            if not self._metadata_download_fallback:
+                for wbi in missing:
+                    self.record_failed_workbook(wbi, error)
+                missing = []
+            metrics.incr('metadata_fallbacks', len(missing))
+            with closing(self.iterate_server_workbooks(missing)) as downloaded:
+                # Failed downloads are not yielded, so match by ID
+                lwb = next(downloaded, None)
+                for wbi in batch:
+                    if wbi.id in workbooks:
+                        yield LocalWorkbook(
+                            wbi, workbooks[wbi.id], on_disk=False, id_scheme='metadata'
+                        )
+                    elif lwb is not None and lwb.id == wbi.id:
+                        yield lwb
+                        lwb = next(downloaded, None)
+
+
+class TableauServerClient(BaseTableauServerClient):
+    """ A wrapper around the `tableauserverclient` library.
+    """
+
+    def __init__(
+        self, host, username, password, site_id=None,
+        max_concurrent_downloads=1, extraction_engine='documentapi',
+        download_mode='disk', download_spill_bytes=64 * 1024 * 1024,
+        max_download_bytes=None, workbook_cache=None, workbook_cache_warm_dir=None,
+        throttle=None, extraction_backend='download', metadata_batch_size=100,
+        metadata_download_fallback=False
+    ):
+        super().__init__(
+            throttle=throttle, workbook_cache=workbook_cache,
+            workbook_cache_warm_dir=workbook_cache_warm_dir,
+            extraction_backend=extraction_backend,
+            metadata_batch_size=metadata_batch_size,
+            metadata_download_fallback=metadata_download_fallback
+        )
+        self._host = host
+        self._username = username
+        self._password = password
+        self._site_id = site_id or ''
+        self._max_concurrent_downloads = max(1, max_concurrent_downloads or 1)
+        if extraction_engine not in EXTRACTION_ENGINES:
+            raise ValueError(
+                f"Unknown extraction_engine '{extraction_engine}'. "
+                f"Expected one of {EXTRACTION_ENGINES}."
+            )
+        self._extraction_engine = extraction_engine
+        if download_mode not in DOWNLOAD_MODES:
+            raise ValueError(
+                f"Unknown download_mode '{download_mode}'. "
+                f"Expected one of {DOWNLOAD_MODES}."
+            )
+        if download_mode == 'memory' and extraction_engine != 'streaming':
+            raise ValueError(
+                "download_mode 'memory' requires extraction_engine 'streaming'."
             )
+        self._download_mode = download_mode
+        self._download_spill_bytes = download_spill_bytes
+        self._max_download_bytes = max_download_bytes
+        self.session = TableauServerSession(
+            host=host, authentication=self.authentication,
+            pool_size=max(10, self._max_concurrent_downloads),
+            throttle=self.throttle
+        )
+
+    @property
+    def authentication(self):
+        return tsc.TableauAuth(
+            self._username, self._password,
+            site_id=self._site_id
+        )
+
+    @property
+    def server(self):
+        return self.session.server
+
+    def close(self):
+        self.session.close()
+
+    def get_workbooks_page(self, req_option):
+        return self.session.call(
+            lambda server: server.workbooks.get(req_option)
+        )
+
+    def get_projects_page(self, req_option):
+        return self.session.call(
+            lambda server: server.projects.get(req_option)
+        )
+
+    def get_workbook_item(self, workbook_id):
+        return self.session.call(
+            lambda server: server.workbooks.get_by_id(workbook_id)
+        )
+
+    def query_metadata(self, query, variables=None):
+        # tsc's own metadata endpoint needs API version 3.5, the session
+        # signs in with 3.2, so post to the (unversioned) endpoint directly
+        def post(server):
+            response = server.session.post(
+                f"{server.server_address}/api/metadata/graphql",
+                json={'query': query, 'variables': variables or {}},
+                headers={'x-tableau-auth': server.auth_token}
+            )
+            check_status(response.status_code, response.content)
+            return response.json()
+
+        return self.session.call(post)
+
+    def get_local_workbook(self, workbook_item, base_folder):
+        lwb = self.get_cached_workbook(workbook_item)
+        if lwb is not None:
+            logger.info(f"Workbook {workbook_item.id} unchanged, using cached copy.")
+            return lwb
+        try:
+            lwb = self.session.call(
+                lambda server: LocalWorkbook.from_workbook_item(
+                    server=server, workbook_item=workbook_item,
+                    base_folder=base_folder,
+                    download_workbook=True,
+                    engine=self._extraction_engine,
+                    download_mode=self._download_mode,
+                    spill_bytes=self._download_spill_bytes,
+                    max_download_bytes=self._max_download_bytes
+                )
+            )
+        except download_exceptions as e:
+            self.record_failed_workbook(workbook_item, e)
+            return None
+        if lwb is None:
+            return None
+        # Free the parsed document before the Workbook waits to be consumed
+        lwb.compact()
+        if self.workbook_cache is not None and lwb.wb is not None:
+            self.workbook_cache.put(workbook_item.id, workbook_item.updated_at, lwb.wb)
+        return lwb
 
     def iterate_server_workbooks(
-        self, workbook_ids: List[str]
+        self, workbook_items: Iterable[tsc.WorkbookItem]
     ) -> Iterable[LocalWorkbook]:
-        for wb_id in workbook_ids:
+        """ Download Workbooks using a bounded pool of worker threads.
+
+        At most `max_concurrent_downloads` Workbooks are in flight (downloading,
+        on disk or being processed by the caller) at any one time. Workbooks
+        are yielded in the order of `workbook_items`, whatever order their
+        downloads complete in, so that replication bookmarks stay correct.
+        """
+        base_folder = tempfile.gettempdir()
+        workbook_items = iter(workbook_items)
+        pending = deque()
+        lwb = None
+        with ThreadPoolExecutor(
+            max_workers=self._max_concurrent_downloads
+        ) as executor:
+
+            def submit_next():
+                wbi = next(workbook_items, None)
+                if wbi is not None:
+                    pending.append(
+                        executor.submit(self.get_local_workbook, wbi, base_folder)
+                    )
+
             try:
-                lwb = self.get_local_workbook(wb_id, tempfile.gettempdir())
-                if lwb is not None:
-                    if lwb.wb is not None:
-                        yield lwb
+                for _ in range(self._max_concurrent_downloads):
+                    submit_next()
+                while pending:
+                    lwb = pending.popleft().result()
+                    if lwb is not None:
+                        if lwb.wb is not None:
+                            yield lwb
                         lwb.delete_file()
+                    lwb = None
+                    # Only start the next download once this one is cleaned up
+                    submit_next()
             except GeneratorExit:
-                logger.warn("Generator exited early. Not all Workbooks were fetched.")
-                lwb.delete_file()
+                logger.warning(
+                    "Generator exited early. Not all Workbooks were fetched."
+                )
+                if lwb is not None:
+                    lwb.delete_file()
                 return
+            finally:
+                self._discard_pending(pending)
 
-    def get_workbooks(self, checkpoint, limit=None):
-        # Get filtered list of workbook ids
-        if checkpoint:
-            logger.info(f"Received checkpoint: {checkpoint}")
-        if limit:
-            logger.info(f"Received limit: {limit}")
-        filtered_workbook_ids = self.list_workbook_ids(
-            checkpoint=checkpoint, limit=limit
-        )
-        for lwb in self.iterate_server_workbooks(filtered_workbook_ids):
-            logger.info(f"Fetched Workbook with ID: {lwb.id}")
-            yield lwb
+    @staticmethod
+    def _discard_pending(pending):
+        """ Cancel queued downloads and delete any files already downloaded.
+        """
+        for future in pending:
+            future.cancel()
+        for future in pending:
+            if future.cancelled():
+                continue
+            try:
+                lwb = future.result()
+            except Exception:
+                continue
+            if lwb is not None:
+                lwb.delete_file()
+        pending.clear()
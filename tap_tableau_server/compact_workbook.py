@@ -0,0 +1,131 @@
+"""Compact, `__slots__`-based stand-ins for tableaudocumentapi objects.
+
+These hold only the attributes `LocalWorkbookExtractor` reads, so they can
+be passed through the stream tree in place of the parsed XML document.
+"""
+
+# XML attribute names of <connection> elements, and their Python names
+CONNECTION_XML_ATTRS = {
+    'class': 'class_',
+    'dbname': 'dbname',
+    'server': 'server',
+    'username': 'username',
+    'authentication': 'authentication',
+    'port': 'port',
+    'channel': 'channel',
+    'dataserver-permissions': 'dataserver_permissions',
+    'directory': 'directory',
+    'server-oauth': 'server_oauth',
+    'workgroup-auth-mode': 'workgroup_auth_mode',
+    'query-band-spec': 'query_band',
+    'one-time-sql': 'initial_sql',
+}
+
+
+class CompactWorkbook:
+    __slots__ = (
+        'filename', 'source_platform', 'source_build', 'worksheets', 'datasources'
+    )
+
+    def __init__(
+        self, filename=None, source_platform=None, source_build=None,
+        worksheets=None, datasources=None
+    ):
+        self.filename = filename
+        self.source_platform = source_platform
+        self.source_build = source_build
+        self.worksheets = worksheets if worksheets is not None else []
+        self.datasources = datasources if datasources is not None else {}
+
+
+class CompactDatasource:
+    __slots__ = ('name', 'caption', 'version', 'connections')
+
+    def __init__(self, name=None, caption=None, version=None, connections=None):
+        self.name = name
+        self.caption = caption
+        self.version = version
+        self.connections = connections if connections is not None else []
+
+
+class CompactConnection:
+    __slots__ = tuple(CONNECTION_XML_ATTRS.values()) + (
+        'name', 'caption', 'named_connections', 'relation'
+    )
+
+    def __init__(self, named_connections=None, relation=None, **attrs):
+        for attr in self.__slots__:
+            setattr(self, attr, attrs.get(attr))
+        self.named_connections = named_connections or {}
+        self.relation = relation or []
+
+
+class CompactRelation:
+    __slots__ = ('type', 'name', 'connection', 'table', 'text', 'relation')
+
+    def __init__(
+        self, type=None, name=None, connection=None, table=None, text=None,
+        relation=None
+    ):
+        self.type = type
+        self.name = name
+        self.connection = connection
+        self.table = table
+        self.text = text
+        self.relation = relation or []
+
+
+def compact_relation(relation):
+    return CompactRelation(
+        type=getattr(relation, 'type', None),
+        name=getattr(relation, 'name', None),
+        connection=getattr(relation, 'connection', None),
+        table=getattr(relation, 'table', None),
+        text=getattr(relation, 'text', None),
+        relation=[
+            compact_relation(r) for r in (getattr(relation, 'relation', None) or [])
+        ]
+    )
+
+
+def compact_connection(connection):
+    named_connections = getattr(connection, 'named_connections', None) or {}
+    return CompactConnection(
+        named_connections={
+            name: compact_connection(nc) for name, nc in named_connections.items()
+        },
+        relation=[
+            compact_relation(r) for r in (getattr(connection, 'relation', None) or [])
+        ],
+        **{
+            attr: getattr(connection, attr, None)
+            for attr in CompactConnection.__slots__
+            if attr not in ('named_connections', 'relation')
+        }
+    )
+
+
+def compact_datasource(datasource):
+    return CompactDatasource(
+        name=getattr(datasource, 'name', None),
+        caption=getattr(datasource, 'caption', None),
+        version=getattr(datasource, 'version', None),
+        connections=[compact_connection(c) for c in (datasource.connections or [])]
+    )
+
+
+def compact_workbook(workbook):
+    """ Convert a tableaudocumentapi Workbook into a CompactWorkbook.
+    """
+    if isinstance(workbook, CompactWorkbook):
+        return workbook
+    return CompactWorkbook(
+        filename=getattr(workbook, 'filename', None),
+        source_platform=getattr(workbook, 'source_platform', None),
+        source_build=getattr(workbook, 'source_build', None),
+        worksheets=list(getattr(workbook, 'worksheets', None) or []),
+        datasources={
+            name: compact_datasource(ds)
+            for name, ds in workbook.datasources.items()
+        }
+    )
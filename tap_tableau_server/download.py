@@ -0,0 +1,403 @@
+"""Download Workbook content from Tableau Server without temp directories.
+
+Downloads leave out extracts unless asked for them, can be capped at a
+maximum size, and by default keep only the .twb XML: .twbx archives are
+unpacked as they arrive, and the transfer is abandoned as soon as the .twb
+has been read.
+"""
+
+import os
+import zlib
+import struct
+import logging
+import tempfile
+import zipfile
+from contextlib import closing
+from email.message import Message
+
+from tableauserverclient.filesys_helpers import to_filename
+
+from .metrics import metrics
+from .session import check_status
+
+logger = logging.getLogger('tap_tableau_server.download')
+# Size of chunks read from the HTTP response
+CHUNK_SIZE = 1024 * 1024
+
+# Zip local file headers, as laid out in the .ZIP File Format Specification
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+DATA_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+ZIP64_EXTRA_ID = 0x0001
+FLAG_ENCRYPTED = 0x0001
+FLAG_DATA_DESCRIPTOR = 0x0008
+FLAG_UTF8 = 0x0800
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+
+class DownloadTooLargeError(Exception):
+    """ A Workbook download is larger than the maximum download size.
+    """
+
+    def __init__(self, workbook_id, max_bytes):
+        super().__init__(
+            f"Workbook {workbook_id} is larger than the maximum download size "
+            f"of {max_bytes} bytes."
+        )
+        self.workbook_id = workbook_id
+        self.max_bytes = max_bytes
+
+
+class UnsupportedArchiveError(ValueError):
+    """ A .twbx archive uses a zip feature `TwbStreamReader` cannot read as
+    it arrives.
+    """
+
+
+def check_download_size(size, workbook_id, max_bytes=None):
+    """ Raise DownloadTooLargeError if `size` is over `max_bytes`.
+    """
+    if max_bytes and size > max_bytes:
+        raise DownloadTooLargeError(workbook_id, max_bytes)
+
+
+def content_disposition_filename(response, default=None):
+    """ The filename given by a response's Content-Disposition header.
+    """
+    message = Message()
+    message['content-disposition'] = response.headers.get('Content-Disposition', '')
+    return message.get_filename() or default
+
+
+def twb_filename(filename):
+    """ The name the .twb read out of a download named `filename` is saved as.
+    """
+    return os.path.splitext(filename)[0] + '.twb'
+
+
+class _Entry:
+    __slots__ = (
+        'name', 'is_twb', 'method', 'crc', 'remaining', 'has_descriptor',
+        'zip64', 'inflater', 'inflated', 'written_crc'
+    )
+
+    def __init__(self, name, is_twb, method, crc, size, has_descriptor, zip64):
+        self.name = name
+        self.is_twb = is_twb
+        self.method = method
+        self.crc = crc
+        self.remaining = size
+        self.has_descriptor = has_descriptor
+        self.zip64 = zip64
+        self.inflater = zlib.decompressobj(-15) if method == ZIP_DEFLATED else None
+        self.inflated = False
+        self.written_crc = 0
+
+
+def _zip64_sizes(extra):
+    """ `(uncompressed, compressed)` sizes from a local header's Zip64 extra
+    field, or None.
+    """
+    offset = 0
+    while offset + 4 <= len(extra):
+        block_id, size = struct.unpack_from('<HH', extra, offset)
+        if block_id == ZIP64_EXTRA_ID and size >= 16:
+            return struct.unpack_from('<QQ', extra, offset + 4)
+        offset += 4 + size
+    return None
+
+
+class TwbStreamReader:
+    """ Reads the .twb XML out of a Workbook download as it arrives, writing
+    it to `output`.
+
+    Plain .twb content is copied as is. For .twbx (zip) content, local file
+    headers are parsed as they arrive: entries before the .twb are skipped
+    without being decompressed where their size is known, and the .twb is
+    inflated into `output`. `feed` returns True once the .twb is complete,
+    so the rest of the download can be abandoned.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.is_archive = None
+        self.twb_name = None
+        self._buffer = bytearray()
+        self._entry = None
+        self._done = False
+
+    def feed(self, data) -> bool:
+        """ Read the next chunk of the download, returning True once no more
+        is needed.
+        """
+        if self._done:
+            return True
+        if self.is_archive is None:
+            self._buffer += data
+            if len(self._buffer) < len(LOCAL_HEADER_SIGNATURE):
+                return False
+            self.is_archive = self._buffer.startswith(LOCAL_HEADER_SIGNATURE)
+            data, self._buffer = bytes(self._buffer), bytearray()
+        if not self.is_archive:
+            self.output.write(data)
+            return False
+        self._buffer += data
+        while not self._done and self._step():
+            pass
+        return self._done
+
+    def close(self):
+        """ Check that the .twb was read whole, once the download has ended.
+        """
+        if self.is_archive is None:
+            # Shorter than a zip signature, so not an archive
+            self.output.write(bytes(self._buffer))
+        elif self.is_archive and not self._done:
+            raise zipfile.BadZipFile("Workbook archive ended before its .twb was read.")
+
+    def _step(self):
+        if self._entry is None:
+            return self._read_header()
+        if self._entry.inflated:
+            return self._read_descriptor()
+        return self._read_data()
+
+    def _read_header(self):
+        buffer = self._buffer
+        if len(buffer) < len(LOCAL_HEADER_SIGNATURE):
+            return False
+        if not buffer.startswith(LOCAL_HEADER_SIGNATURE):
+            # The central directory follows the last entry
+            raise ValueError("No .twb file found in workbook archive.")
+        if len(buffer) < LOCAL_HEADER.size:
+            return False
+        (
+            _, _, flags, method, _, _, crc, compressed_size, _, name_length,
+            extra_length
+        ) = LOCAL_HEADER.unpack_from(buffer)
+        end = LOCAL_HEADER.size + name_length + extra_length
+        if len(buffer) < end:
+            return False
+        name = bytes(buffer[LOCAL_HEADER.size:LOCAL_HEADER.size + name_length]).decode(
+            'utf-8' if flags & FLAG_UTF8 else 'cp437'
+        )
+        zip64_sizes = _zip64_sizes(bytes(buffer[LOCAL_HEADER.size + name_length:end]))
+        del buffer[:end]
+        if zip64_sizes is not None and compressed_size == 0xFFFFFFFF:
+            compressed_size = zip64_sizes[1]
+        is_twb = name.endswith('.twb') and '/' not in name
+        has_descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+        if flags & FLAG_ENCRYPTED:
+            raise UnsupportedArchiveError(f"{name} is encrypted.")
+        if has_descriptor and method != ZIP_DEFLATED:
+            # Without a size, only a deflate stream's own end marks the end
+            raise UnsupportedArchiveError(f"{name} has no size in its local header.")
+        if is_twb and method not in (ZIP_STORED, ZIP_DEFLATED):
+            raise UnsupportedArchiveError(f"{name} uses compression method {method}.")
+        self._entry = _Entry(
+            name, is_twb, method, crc, compressed_size, has_descriptor,
+            zip64_sizes is not None
+        )
+        return True
+
+    def _write(self, entry, data):
+        if entry.inflater is not None:
+            data = entry.inflater.decompress(data)
+        if entry.is_twb and data:
+            self.output.write(data)
+            entry.written_crc = zlib.crc32(data, entry.written_crc)
+
+    def _read_data(self):
+        entry, buffer = self._entry, self._buffer
+        if entry.has_descriptor:
+            # Inflate to find where the entry ends
+            self._write(entry, bytes(buffer))
+            buffer.clear()
+            if not entry.inflater.eof:
+                return False
+            buffer += entry.inflater.unused_data
+            entry.inflated = True
+            return True
+        take = min(len(buffer), entry.remaining)
+        if entry.is_twb:
+            self._write(entry, bytes(buffer[:take]))
+        del buffer[:take]
+        entry.remaining -= take
+        if entry.remaining:
+            return False
+        self._finish_entry(entry.crc)
+        return True
+
+    def _read_descriptor(self):
+        buffer = self._buffer
+        if len(buffer) < len(DATA_DESCRIPTOR_SIGNATURE):
+            return False
+        # The descriptor's signature is optional
+        start = 4 if buffer.startswith(DATA_DESCRIPTOR_SIGNATURE) else 0
+        size = start + 4 + (16 if self._entry.zip64 else 8)
+        if len(buffer) < size:
+            return False
+        (crc,) = struct.unpack_from('<I', buffer, start)
+        del buffer[:size]
+        self._finish_entry(crc)
+        return True
+
+    def _finish_entry(self, crc):
+        entry, self._entry = self._entry, None
+        if not entry.is_twb:
+            return
+        if entry.written_crc != crc:
+            raise zipfile.BadZipFile(
+                f"Bad CRC-32 for {entry.name} in workbook archive."
+            )
+        self.twb_name = entry.name
+        self._done = True
+
+
+class ContentCopier:
+    """ Copies the chunks of a download into `output` as they arrive,
+    keeping only the .twb if `twb_only`.
+
+    `write` raises DownloadTooLargeError as soon as more than `max_bytes`
+    have been transferred, and returns True once the .twb is complete, so
+    the rest of the download can be abandoned.
+    """
+
+    def __init__(self, output, workbook_id, max_bytes=None, twb_only=True):
+        self.output = output
+        self.workbook_id = workbook_id
+        self.max_bytes = max_bytes
+        self.reader = TwbStreamReader(output) if twb_only else None
+        self.transferred = 0
+
+    def write(self, chunk) -> bool:
+        self.transferred += len(chunk)
+        check_download_size(self.transferred, self.workbook_id, self.max_bytes)
+        if self.reader is None:
+            self.output.write(chunk)
+            return False
+        return self.reader.feed(chunk)
+
+    def close(self):
+        """ Check the content was read whole, once the download has ended.
+        """
+        if self.reader is not None:
+            self.reader.close()
+
+
+def copy_content(chunks, output, workbook_id, max_bytes=None, twb_only=True):
+    """ Copy a download's `chunks` into `output` with a ContentCopier,
+    stopping once no more is needed. Returns the number of bytes transferred.
+    """
+    copier = ContentCopier(output, workbook_id, max_bytes=max_bytes, twb_only=twb_only)
+    for chunk in chunks:
+        if copier.write(chunk):
+            break
+    copier.close()
+    return copier.transferred
+
+
+def _download(
+    server, workbook_id, open_output, include_extract=False, max_bytes=None,
+    twb_only=True
+):
+    """ Stream a Workbook's content into the file object returned by
+    `open_output(filename)`, returning `(filename, output)`.
+    """
+    url = f"{server.workbooks.baseurl}/{workbook_id}/content"
+    if not include_extract:
+        url += "?includeExtract=False"
+    response = server.session.get(
+        url, stream=True, headers={'x-tableau-auth': server.auth_token},
+        **server.http_options
+    )
+    with closing(response):
+        if not response.ok:
+            # Raises tableauserverclient's ServerResponseError/InternalServerError
+            check_status(response.status_code, response.content)
+        check_download_size(
+            int(response.headers.get('Content-Length') or 0), workbook_id, max_bytes
+        )
+        filename = content_disposition_filename(response, default=workbook_id)
+        output = open_output(filename)
+        try:
+            transferred = copy_content(
+                response.iter_content(CHUNK_SIZE), output, workbook_id,
+                max_bytes=max_bytes, twb_only=twb_only
+            )
+        except BaseException:
+            output.close()
+            raise
+    metrics.observe('download_bytes', transferred, workbook_id)
+    return filename, output
+
+
+def download_workbook_to_buffer(
+    server, workbook_id, include_extract=False, spill_bytes=64 * 1024 * 1024,
+    max_bytes=None, twb_only=True
+):
+    """ Stream a Workbook's content into a memory buffer.
+
+    The buffer only spills to a (self-deleting) temporary file if the
+    download is larger than `spill_bytes`. Returns `(filename, buffer)`,
+    with the buffer positioned at the start of the content. With `twb_only`
+    the buffer holds just the .twb XML, even for .twbx downloads.
+    """
+    def open_output(filename):
+        return tempfile.SpooledTemporaryFile(max_size=spill_bytes)
+
+    try:
+        filename, buffer = _download(
+            server, workbook_id, open_output, include_extract=include_extract,
+            max_bytes=max_bytes, twb_only=twb_only
+        )
+    except UnsupportedArchiveError as e:
+        if not twb_only:
+            raise
+        logger.warning(f"Downloading all of Workbook {workbook_id}: {e}")
+        return download_workbook_to_buffer(
+            server, workbook_id, include_extract=include_extract,
+            spill_bytes=spill_bytes, max_bytes=max_bytes, twb_only=False
+        )
+    buffer.seek(0)
+    return filename, buffer
+
+
+def download_workbook_to_file(
+    server, workbook_id, directory, include_extract=False, max_bytes=None,
+    twb_only=True
+):
+    """ Stream a Workbook's content into a file in `directory`, returning
+    its path. With `twb_only`, only the .twb XML is written, even for .twbx
+    downloads. Partly written files are removed if the download fails.
+    """
+    paths = []
+
+    def open_output(filename):
+        filename = to_filename(os.path.basename(filename))
+        paths.append(os.path.join(
+            directory, twb_filename(filename) if twb_only else filename
+        ))
+        return open(paths[-1], 'wb')
+
+    try:
+        _, output = _download(
+            server, workbook_id, open_output, include_extract=include_extract,
+            max_bytes=max_bytes, twb_only=twb_only
+        )
+    except BaseException as e:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if twb_only and isinstance(e, UnsupportedArchiveError):
+            logger.warning(f"Downloading all of Workbook {workbook_id}: {e}")
+            return download_workbook_to_file(
+                server, workbook_id, directory, include_extract=include_extract,
+                max_bytes=max_bytes, twb_only=False
+            )
+        raise
+    output.close()
+    return os.path.abspath(paths[-1])
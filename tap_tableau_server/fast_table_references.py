@@ -0,0 +1,286 @@
+"""A lightweight, tokenizer-based table reference extractor.
+
+Handles the common `SELECT ... FROM a JOIN b` shapes of Custom SQL (including
+CTEs, subqueries and set operations) without a full grammar parse. Anything
+it does not understand confidently makes it give up and return None, so the
+caller can fall back to SQLFluff.
+"""
+
+import re
+from typing import List, Optional
+
+
+TOKEN_RE = re.compile(
+    r"(?P<ws>\s+)"
+    r"|(?P<comment>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<string>'(?:[^']|'')*')"
+    r"|(?P<quoted>\"(?:[^\"]|\"\")*\")"
+    r"|(?P<word>[A-Za-z_][A-Za-z0-9_$]*)"
+    r"|(?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)"
+    r"|(?P<punct>[.,();])"
+    r"|(?P<other>.)",
+    re.DOTALL
+)
+# Characters that signal quoting or syntax we don't handle
+UNSUPPORTED_CHARS = {'`', '[', ']', '{', '}', "'", '"'}
+RESERVED_WORDS = {
+    'ALL', 'AND', 'ANY', 'AS', 'ASC', 'BETWEEN', 'BY', 'CASE', 'CAST',
+    'CROSS', 'CURRENT', 'DELETE', 'DESC', 'DISTINCT', 'ELSE', 'END', 'EXCEPT',
+    'EXISTS', 'FALSE', 'FETCH', 'FOR', 'FROM', 'FULL', 'GROUP', 'HAVING',
+    'ILIKE', 'IN', 'INNER', 'INSERT', 'INTERSECT', 'INTERVAL', 'INTO', 'IS',
+    'JOIN', 'LATERAL', 'LEFT', 'LIKE', 'LIMIT', 'MERGE', 'MINUS', 'NATURAL',
+    'NOT', 'NULL', 'OFFSET', 'ON', 'OR', 'ORDER', 'OUTER', 'OVER', 'PARTITION',
+    'PIVOT', 'QUALIFY', 'RECURSIVE', 'RIGHT', 'ROWS', 'SAMPLE', 'SELECT',
+    'SET', 'SOME', 'TABLE', 'TABLESAMPLE', 'THEN', 'TOP', 'TRUE', 'UNION',
+    'UNNEST', 'UNPIVOT', 'UPDATE', 'USING', 'VALUES', 'WHEN', 'WHERE',
+    'WINDOW', 'WITH'
+}
+# Keywords that may legally follow a table reference (and optional alias)
+TABLE_FOLLOW_WORDS = {
+    'WHERE', 'GROUP', 'ORDER', 'HAVING', 'LIMIT', 'OFFSET', 'FETCH', 'UNION',
+    'INTERSECT', 'EXCEPT', 'MINUS', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL',
+    'CROSS', 'NATURAL', 'ON', 'USING', 'QUALIFY', 'WINDOW'
+}
+# Keywords that end a FROM clause at the current nesting level
+FROM_END_WORDS = {
+    'WHERE', 'GROUP', 'ORDER', 'HAVING', 'LIMIT', 'OFFSET', 'FETCH', 'UNION',
+    'INTERSECT', 'EXCEPT', 'MINUS', 'QUALIFY', 'WINDOW', 'SELECT'
+}
+QUERY_START_WORDS = {'SELECT', 'WITH'}
+
+
+class Unsupported(Exception):
+    """ Raised when the SQL is outside what the fast path handles.
+    """
+
+
+class Token:
+    __slots__ = ('kind', 'value', 'start', 'end')
+
+    def __init__(self, kind, value, start, end):
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+
+    @property
+    def keyword(self):
+        return self.value.upper() if self.kind == 'word' else None
+
+    def is_identifier(self):
+        return (
+            (self.kind == 'word' and self.value.upper() not in RESERVED_WORDS)
+            or self.kind == 'quoted'
+        )
+
+
+def tokenize(sql):
+    tokens = []
+    for m in TOKEN_RE.finditer(sql):
+        kind = m.lastgroup
+        if kind in ('ws', 'comment'):
+            continue
+        if kind == 'other' and m.group() in UNSUPPORTED_CHARS:
+            raise Unsupported(f"Unsupported character {m.group()!r}")
+        tokens.append(Token(kind, m.group(), m.start(), m.end()))
+    return tokens
+
+
+class _Scanner:
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.tokens = tokenize(sql)
+        self.pos = 0
+        self.table_refs = []
+        self.cte_refs = set()
+        # One entry per open parenthesis: 'query', 'cte' or 'other'
+        self.parens = []
+        # Whether a FROM clause is open, per nesting level
+        self.in_from = [False]
+
+    def peek(self, offset=0):
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else None
+
+    def peek_keyword(self, offset=0):
+        token = self.peek(offset)
+        return token.keyword if token is not None else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise Unsupported("Unexpected end of SQL")
+        self.pos += 1
+        return token
+
+    def expect(self, value):
+        token = self.next()
+        if token.value.upper() != value:
+            raise Unsupported(f"Expected {value}, found {token.value!r}")
+
+    def skip_parens(self):
+        self.expect('(')
+        depth = 1
+        while depth:
+            token = self.next()
+            if token.value == '(':
+                depth += 1
+            elif token.value == ')':
+                depth -= 1
+
+    def open_paren(self, kind):
+        self.expect('(')
+        self.parens.append(kind)
+        self.in_from.append(False)
+
+    def cte_header(self):
+        """ Parse `name [(columns)] AS (`, leaving the CTE body open.
+        """
+        if self.peek_keyword() == 'RECURSIVE':
+            self.pos += 1
+        name = self.next()
+        if not name.is_identifier():
+            raise Unsupported(f"Unexpected CTE name {name.value!r}")
+        self.cte_refs.add(name.value)
+        if self.peek() is not None and self.peek().value == '(':
+            self.skip_parens()
+        self.expect('AS')
+        if self.peek_keyword(1) not in QUERY_START_WORDS:
+            raise Unsupported("CTE body is not a query")
+        self.open_paren('cte')
+
+    def table_item(self):
+        """ Parse one FROM/JOIN item: a subquery, or a table reference with
+        an optional alias.
+        """
+        token = self.peek()
+        if token is not None and token.value == '(':
+            if self.peek_keyword(1) not in QUERY_START_WORDS:
+                raise Unsupported("Parenthesised join or table expression")
+            self.open_paren('query')
+            return
+        self.table_refs.append(self.table_name())
+        self.alias()
+        following = self.peek()
+        if following is not None and not (
+            following.value in (',', ')', ';')
+            or following.keyword in TABLE_FOLLOW_WORDS
+        ):
+            raise Unsupported(f"Unexpected {following.value!r} after table reference")
+
+    def table_name(self):
+        """ Parse a (possibly qualified) table name, returning its text.
+        """
+        parts = [self.next()]
+        while self.peek() is not None and self.peek().value == '.':
+            parts.append(self.next())
+            parts.append(self.next())
+        for i, part in enumerate(parts):
+            if (i % 2 == 0) and not part.is_identifier():
+                raise Unsupported(f"Unexpected table name {part.value!r}")
+            if i and part.start != parts[i - 1].end:
+                raise Unsupported("Whitespace inside table reference")
+        following = self.peek()
+        if following is not None and following.value in ('(', '.'):
+            raise Unsupported("Table function or malformed reference")
+        return self.sql[parts[0].start:parts[-1].end]
+
+    def alias(self):
+        """ Skip an optional `[AS] alias`.
+        """
+        if self.peek_keyword() == 'AS':
+            self.pos += 1
+            if not self.next().is_identifier():
+                raise Unsupported("Unexpected alias")
+        elif self.peek() is not None and self.peek().is_identifier():
+            self.pos += 1
+
+    def semicolon(self, token, previous):
+        if self.pos != len(self.tokens) - 1:
+            raise Unsupported("Multiple statements")
+        self.pos += 1
+
+    def open_any_paren(self, token, previous):
+        if self.peek_keyword(1) in QUERY_START_WORDS:
+            self.open_paren('query')
+        else:
+            self.open_paren('other')
+
+    def close_paren(self, token, previous):
+        if not self.parens:
+            raise Unsupported("Unbalanced parentheses")
+        self.pos += 1
+        kind = self.parens.pop()
+        self.in_from.pop()
+        if kind == 'cte' and self.peek() is not None and self.peek().value == ',':
+            self.pos += 1
+            self.cte_header()
+
+    def comma(self, token, previous):
+        self.pos += 1
+        if self.in_from[-1]:
+            self.table_item()
+
+    def with_clause(self, token, previous):
+        self.pos += 1
+        self.cte_header()
+
+    def from_clause(self, token, previous):
+        if self.parens and self.parens[-1] == 'other':
+            raise Unsupported(f"{token.keyword} inside an expression")
+        if previous is not None and previous.keyword == 'DISTINCT':
+            raise Unsupported("IS DISTINCT FROM")
+        self.pos += 1
+        self.in_from[-1] = True
+        self.table_item()
+
+    def unsupported_keyword(self, token, previous):
+        raise Unsupported(f"Unsupported keyword {token.keyword}")
+
+    def other(self, token, previous):
+        if token.keyword in FROM_END_WORDS:
+            self.in_from[-1] = False
+        self.pos += 1
+
+    # Handlers of the tokens that open, close or split clauses, by punctuation
+    # or keyword; any other token is handled by `other`
+    HANDLERS = {
+        ';': semicolon,
+        '(': open_any_paren,
+        ')': close_paren,
+        ',': comma,
+        'WITH': with_clause,
+        'FROM': from_clause,
+        'JOIN': from_clause,
+        **dict.fromkeys(
+            ('INTO', 'LATERAL', 'UNNEST', 'VALUES', 'PIVOT', 'UNPIVOT'),
+            unsupported_keyword
+        ),
+    }
+
+    def scan(self):
+        if self.peek_keyword() not in QUERY_START_WORDS:
+            raise Unsupported("Not a query")
+        previous = None
+        while self.peek() is not None:
+            token = self.peek()
+            handler = self.HANDLERS.get(
+                token.keyword if token.kind == 'word' else token.value, _Scanner.other
+            )
+            handler(self, token, previous)
+            previous = token
+        if self.parens:
+            raise Unsupported("Unbalanced parentheses")
+        return [ref for ref in self.table_refs if ref not in self.cte_refs]
+
+
+def extract_table_references_fast(sql) -> Optional[List[str]]:
+    """ Return sorted, lower-cased table references in `sql`, or None if the
+    SQL is not a shape the fast path can handle confidently.
+    """
+    try:
+        refs = _Scanner(sql).scan()
+    except Unsupported:
+        return None
+    return sorted({ref.lower() for ref in refs})
@@ -7,6 +7,10 @@ import tableauserverclient as TSC
 from tableaudocumentapi import Workbook, Datasource
 
 from .utils import json_serial
+from .metrics import metrics
+from .compact_workbook import compact_workbook
+from .download import download_workbook_to_buffer, download_workbook_to_file
+from .streaming_workbook import parse_workbook
 
 
 WORKBOOKITEM_EXTRACT_ATTRS = [
@@ -15,16 +19,44 @@ WORKBOOKITEM_EXTRACT_ATTRS = [
     'content_url', 'webpage_url', 'owner_id'
 ]
 WORKBOOK_FILE_EXTRACT_ATTRS = ['filename']
+# Ways of reading a downloaded Workbook file
+EXTRACTION_ENGINES = ['documentapi', 'streaming']
+# Where downloaded Workbook files are held
+DOWNLOAD_MODES = ['disk', 'memory']
+
+
+def load_workbook(filepath, engine='documentapi'):
+    """ Read a Workbook file with the given extraction engine: the full
+    tableaudocumentapi DOM, or the incremental, compact streaming parser.
+    """
+    if engine == 'streaming':
+        return parse_workbook(filepath)
+    return Workbook(filepath)
 
 
 class LocalWorkbook:
     """ Container class for tableauserverclient.WorkbookItem
     and tableaudocumentapi.Workbook objects.
+
+    `id_scheme` is the extraction backend the Workbook was built by, which
+    its Datasources', Connections' and Relations' record IDs follow.
     """
 
-    def __init__(self, workbook_item, workbook=None):
+    def __init__(
+        self, workbook_item, workbook=None, on_disk=True, id_scheme='download'
+    ):
         self.wbi = workbook_item
         self.wb = workbook
+        self.on_disk = on_disk
+        self.id_scheme = id_scheme
+
+    def compact(self):
+        """ Replace the parsed Workbook document with a CompactWorkbook of
+        just what is extracted, so the document can be freed.
+        """
+        if self.wb is not None:
+            self.wb = compact_workbook(self.wb)
+        return self
 
     def __getattr__(self, name):
         try:
@@ -55,43 +87,92 @@ class LocalWorkbook:
     def from_tableau_server(
         cls, server, workbook_id, base_folder=None,
         download_workbook=False, download_with_extract=False,
-        keep_backup=False
+        keep_backup=False, engine='documentapi', download_mode='disk',
+        spill_bytes=64 * 1024 * 1024, max_download_bytes=None
     ):
         """ Create a LocalWorkbook by fetching a WorkbookItem and downloading
         a Workbook from Tableau Server.
         """
         workbook_item = server.workbooks.get_by_id(workbook_id)
         if workbook_item:
-            workbook = None
-            workbook_filepath = None
-            if download_workbook:
-                base_filepath = cls._generate_filepath(workbook_item.id, base_folder)
-                cls._make_dir(base_filepath)
-                workbook_filepath = server.workbooks.download(
-                    workbook_id=workbook_id, filepath=base_filepath, no_extract=(~download_with_extract)
-                )
-                try:
-                    workbook = Workbook(workbook_filepath)
-                except AttributeError:
-                    pass
-                if (workbook is not None) and keep_backup:
-                    workbook.save_as(workbook.filename + '.backup')
-            return cls(workbook_item=workbook_item, workbook=workbook)
+            return cls.from_workbook_item(
+                server=server, workbook_item=workbook_item,
+                base_folder=base_folder, download_workbook=download_workbook,
+                download_with_extract=download_with_extract,
+                keep_backup=keep_backup, engine=engine,
+                download_mode=download_mode, spill_bytes=spill_bytes,
+                max_download_bytes=max_download_bytes
+            )
 
     @classmethod
-    def from_local_workbook_dir(cls, server, lwb_dir):
-        workbook_item_id = os.path.basename(lwb_dir)
-        # Discover Workbook File
+    def from_workbook_item(
+        cls, server, workbook_item, base_folder=None,
+        download_workbook=False, download_with_extract=False,
+        keep_backup=False, engine='documentapi', download_mode='disk',
+        spill_bytes=64 * 1024 * 1024, max_download_bytes=None
+    ):
+        """ Create a LocalWorkbook from an already fetched WorkbookItem,
+        optionally downloading its Workbook from Tableau Server.
+
+        With `download_mode='memory'` the download is held in a memory buffer
+        (spilling to a temporary file above `spill_bytes`) and read with the
+        streaming engine, so nothing is left on disk to clean up.
+
+        Unless `download_with_extract`, only the .twb XML is kept (and read)
+        from .twbx downloads. Downloads over `max_download_bytes` are
+        abandoned with a DownloadTooLargeError.
+        """
+        workbook = None
+        workbook_filepath = None
+        if download_workbook and download_mode == 'memory':
+            with metrics.timer('download_seconds', workbook_item.id):
+                filename, buffer = download_workbook_to_buffer(
+                    server, workbook_item.id, include_extract=download_with_extract,
+                    spill_bytes=spill_bytes, max_bytes=max_download_bytes,
+                    twb_only=not download_with_extract
+                )
+            with buffer, metrics.timer('parse_seconds', workbook_item.id):
+                workbook = parse_workbook(buffer, filename=filename)
+            return cls(workbook_item=workbook_item, workbook=workbook, on_disk=False)
+        if download_workbook:
+            base_filepath = cls._generate_filepath(workbook_item.id, base_folder)
+            cls._make_dir(base_filepath)
+            with metrics.timer('download_seconds', workbook_item.id):
+                workbook_filepath = download_workbook_to_file(
+                    server, workbook_item.id, base_filepath,
+                    include_extract=download_with_extract,
+                    max_bytes=max_download_bytes,
+                    twb_only=not download_with_extract
+                )
+            try:
+                with metrics.timer('parse_seconds', workbook_item.id):
+                    workbook = load_workbook(workbook_filepath, engine=engine)
+            except AttributeError:
+                pass
+            if (workbook is not None) and keep_backup and (engine == 'documentapi'):
+                workbook.save_as(workbook.filename + '.backup')
+        return cls(workbook_item=workbook_item, workbook=workbook)
+
+    @staticmethod
+    def discover_workbook_file(lwb_dir):
+        """ The single .twb or .twbx file in a local Workbook dir.
+        """
         files = []
         for file in os.listdir(lwb_dir):
             if file.endswith(('.twb', '.twbx')):
                 files.append(os.path.join(lwb_dir, file))
         if len(files) == 1:
-            workbook_filepath = files[0]
+            return files[0]
         elif len(files) == 0:
             raise ValueError(f'No .twb or .twbx files found in local workbook dir {lwb_dir}')
         else:
             raise ValueError(f'Multiple .twb or .twbx files found in local workbook dir {lwb_dir}')
+
+    @classmethod
+    def from_local_workbook_dir(cls, server, lwb_dir):
+        workbook_item_id = os.path.basename(lwb_dir)
+        # Discover Workbook File
+        workbook_filepath = cls.discover_workbook_file(lwb_dir)
         # Fetch WorkbookItem
         workbook_item = server.workbooks.get_by_id(workbook_item_id)
         if workbook_item:
@@ -153,8 +234,15 @@ class LocalWorkbook:
             )
 
     def delete_file(self):
-        if self.wb:
+        if self.wb and self.on_disk:
             try:
                 os.remove(self.wb.filename)
             except OSError:
                 pass
+            # Remove the per-Workbook download folder, if now empty
+            folder = os.path.dirname(self.wb.filename)
+            if os.path.basename(folder) == getattr(self.wbi, 'id', None):
+                try:
+                    os.rmdir(folder)
+                except OSError:
+                    pass
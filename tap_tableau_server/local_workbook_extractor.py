@@ -1,9 +1,17 @@
+import time
 import logging
 import sqlfluff
+import functools
+import threading
 import collections
 from datetime import datetime, date
 
+from sqlfluff.core import Linter
+
+from tap_tableau_server.sql_parser_pool import SQLParserPool
+from tap_tableau_server.fast_table_references import extract_table_references_fast
 from tap_tableau_server.local_workbook import LocalWorkbook
+from tap_tableau_server.metrics import metrics
 
 logging.getLogger("sqlfluff").setLevel(logging.WARNING)
 logger = logging.getLogger('tap_tableau_server.local_workbook_extractor')
@@ -26,15 +34,53 @@ CONNECTION_ATTRS = (
 )
 # Relation
 RELATION_ATTRS = ['type', 'name', 'connection', 'table', 'text']
+# Table Reference parsers
+TABLE_REFERENCE_PARSERS = ['fast', 'fast_with_fallback', 'sqlfluff_only']
+
+
+# Tableau connection classes, and the SQLFluff dialect that best parses their SQL
+TABLEAU_CLASS_DIALECTS = {
+    'snowflake': 'snowflake',
+    'bigquery': 'bigquery',
+    'redshift': 'postgres',
+    'postgres': 'postgres',
+    'greenplum': 'postgres',
+    'vertica': 'postgres',
+    'mysql': 'mysql',
+    'memsql': 'mysql',
+    'sqlserver': 'tsql',
+    'azure_sqldb': 'tsql',
+    'azure_sql_dw': 'tsql',
+    'teradata': 'teradata',
+    'exasol': 'exasol',
+    'oracle': 'oracle',
+    'spark': 'sparksql',
+    'databricks': 'sparksql',
+    'hive': 'hive',
+}
+
+
+def build_dialect_table():
+    """ Map Tableau connection classes to the SQLFluff dialects available in
+    the installed version of SQLFluff.
+    """
+    available = {dialect.label for dialect in sqlfluff.dialects()}
+    table = {label: label for label in available}
+    table.update({
+        conn_class: dialect
+        for conn_class, dialect in TABLEAU_CLASS_DIALECTS.items()
+        if dialect in available
+    })
+    return table
+
+
+DIALECTS = build_dialect_table()
 
 
 def infer_dialect(relation):
-    supported_dialects = [dialect.label for dialect in sqlfluff.dialects()]
     conn = relation.get('connection')
     if isinstance(conn, str) and conn:
-        dialect = conn.split('.')[0].lower()
-        if dialect in supported_dialects:
-            return dialect
+        return DIALECTS.get(conn.split('.')[0].lower(), 'ansi')
     return "ansi"
 
 
@@ -44,19 +90,173 @@ def clean_tableau_sql(sql):
     return sql
 
 
+class DialectStats:
+    """ Per-dialect counts of SQLFluff parses, failures and parse time.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, dialect, elapsed, failed):
+        with self._lock:
+            parses, failures, seconds = self.stats.get(dialect, (0, 0, 0.0))
+            self.stats[dialect] = (
+                parses + 1, failures + int(failed), seconds + elapsed
+            )
+
+    def merge(self, stats):
+        for dialect, (parses, failures, seconds) in stats.items():
+            with self._lock:
+                p, f, s = self.stats.get(dialect, (0, 0, 0.0))
+                self.stats[dialect] = (p + parses, f + failures, s + seconds)
+
+    def drain(self):
+        with self._lock:
+            stats, self.stats = self.stats, {}
+        return stats
+
+    def log(self):
+        for dialect, (parses, failures, seconds) in sorted(self.stats.items()):
+            logger.info(
+                f"SQL dialect {dialect}: {parses} parses, {failures} failures, "
+                f"{(seconds / parses) * 1000:.1f}ms mean parse time."
+            )
+
+
+dialect_stats = DialectStats()
+_linters = {}
+_linters_lock = threading.Lock()
+
+
+def get_linter(dialect):
+    """ Return this process's SQLFluff Linter for `dialect`, creating it
+    (and loading the dialect's grammar) on first use.
+    """
+    with _linters_lock:
+        linter = _linters.get(dialect)
+        if linter is None:
+            linter = _linters[dialect] = Linter(dialect=dialect)
+        return linter
+
+
+def sqlfluff_table_references(query, dialect):
+    start = time.perf_counter()
+    try:
+        parsed = get_linter(dialect).parse_string(query)
+        # If we encounter any parsing errors, raise the first one we find.
+        if parsed.violations:
+            raise parsed.violations[0]
+    except sqlfluff.core.SQLBaseError as e:
+        dialect_stats.record(dialect, time.perf_counter() - start, failed=True)
+        logger.error(f"Falied to parse table refs: {e}")
+        return None
+    dialect_stats.record(dialect, time.perf_counter() - start, failed=False)
+    return sorted({ref.lower() for ref in parsed.tree.get_table_references()})
+
+
+def parse_table_references(query, dialect, parser='sqlfluff_only'):
+    """ Parse SQL, returning sorted, lower-cased table references, or None if
+    it could not be parsed.
+
+    Each table is referenced once, however many times the SQL reads it, so
+    that the table reference records of a Relation have distinct IDs.
+
+    `parser` is one of TABLE_REFERENCE_PARSERS: the fast tokenizer only, the
+    fast tokenizer falling back to SQLFluff for SQL it can't handle, or
+    SQLFluff only.
+    """
+    if parser != 'sqlfluff_only':
+        refs = extract_table_references_fast(query)
+        if refs is not None or parser == 'fast':
+            return refs
+    return sqlfluff_table_references(query, dialect)
+
+
+def parse_table_references_in_worker(query, dialect, parser='sqlfluff_only'):
+    """ SQLParserPool entry point, also returning the worker's dialect stats.
+    """
+    # Only report the stats of this statement
+    dialect_stats.drain()
+    refs = parse_table_references(query, dialect, parser=parser)
+    return refs, dialect_stats.drain()
+
+
 ExtractionResult = collections.namedtuple(
         'ExtractionResult',
         'workbooks, datasources, connections, relations, table_references'
 )
 
 
+def normalize(obj, attrs):
+    return tuple(getattr(obj, k, None) for k in attrs)
+
+
+def normalize_relations(relations):
+    return tuple(
+        (normalize(r, RELATION_ATTRS), normalize_relations(r.relation or []))
+        for r in relations
+    )
+
+
+def normalize_connection(connection):
+    named_connections = getattr(connection, 'named_connections', None) or {}
+    return (
+        normalize(connection, CONNECTION_ATTRS),
+        tuple(normalize(nc, CONNECTION_ATTRS) for nc in named_connections.values())
+    )
+
+
 class LocalWorkbookExtractor:
     """Class for extracting details from a LocalWorkbook.
+
+    With a `definition_cache`, Connections and Relations are extracted once
+    per distinct definition, and their records rebuilt for every Datasource
+    that shares it.
     """
 
-    def __init__(self, relation_types_include=[], relation_types_exclude=[]):
+    def __init__(
+        self, relation_types_include=[], relation_types_exclude=[],
+        sql_cache=None, table_reference_parser='sqlfluff_only',
+        sql_parse_processes=0, sql_parse_timeout=60, definition_cache=None
+    ):
+        if table_reference_parser not in TABLE_REFERENCE_PARSERS:
+            raise ValueError(
+                f"Unknown table_reference_parser '{table_reference_parser}'. "
+                f"Expected one of {TABLE_REFERENCE_PARSERS}."
+            )
         self.include = relation_types_include
         self.exclude = relation_types_exclude
+        self.parse = functools.partial(
+            parse_table_references, parser=table_reference_parser
+        )
+        self.sql_parser_pool = None
+        if sql_parse_processes:
+            self.sql_parser_pool = SQLParserPool(
+                parse=functools.partial(
+                    parse_table_references_in_worker,
+                    parser=table_reference_parser
+                ),
+                processes=sql_parse_processes,
+                timeout=sql_parse_timeout
+            )
+        # Pooled results for the custom SQL of the Workbook being extracted
+        self._prefetched = {}
+        self.sql_cache = sql_cache
+        self.definition_cache = definition_cache
+
+    def log_stats(self):
+        if self.definition_cache is not None:
+            self.definition_cache.log_stats()
+        if self.sql_cache is not None:
+            self.sql_cache.log_stats()
+        dialect_stats.log()
+
+    def close(self):
+        if self.sql_parser_pool is not None:
+            self.sql_parser_pool.close()
+        if self.sql_cache is not None:
+            self.sql_cache.close()
 
     def _build_dict(self, obj, attrs):
         this = {}
@@ -90,18 +290,27 @@ class LocalWorkbookExtractor:
                     )
         return found_relations
 
-    def _extract_relation(self, wb_id, ds_id, updated_at, relation):
+    def _deduplicate(self, kind, normalized, extract):
+        """ Return `extract()`, or the definition cache's copy of it for
+        definitions whose `normalized()` attributes match.
+        """
+        if self.definition_cache is None:
+            return extract()
+        return self.definition_cache.get_or_extract(kind, normalized(), extract)
+
+    def _extract_relation(self, wb_id, ds_id, updated_at, attrs):
+        # `attrs` are already JSON friendly
         rel = {
             'wb_id': wb_id,
             'ds_id': ds_id,
-            **self._build_dict(relation, RELATION_ATTRS)
+            **attrs
         }
         conn_name = rel['connection'] or 'sqlproxy'
         conn_id = f"{ds_id}:{conn_name}"
         rel['conn_id'] = conn_id
         rel['id'] = f"{conn_id}:{rel['name']}"
-        rel['updated_at'] = updated_at
-        return self.jsonify_dict(rel)
+        rel['updated_at'] = self._make_json_friendly(updated_at)
+        return rel
 
     def jsonify_dict(self, adict):
         return {
@@ -124,7 +333,58 @@ class LocalWorkbookExtractor:
             **workbook.to_dict()['workbook_item'],
             **self._build_dict(workbook.wb, WORKBOOK_ATTRS)
         })
-        return (record, workbook.wb.datasources.values() or [])
+        datasources = workbook.wb.datasources.values() or []
+        if self.sql_parser_pool is not None:
+            self._prefetched = self.prefetch_table_references(datasources)
+        return (record, datasources)
+
+    def _iterate_custom_sql(self, datasources):
+        for datasource in datasources:
+            for connection in (datasource.connections or []):
+                relation = getattr(connection, 'relation') or []
+                for rel in self._flatten_relation(relation):
+                    if rel.type == 'text' and rel.text:
+                        dialect = infer_dialect(
+                            {'connection': getattr(rel, 'connection', None)}
+                        )
+                        yield (clean_tableau_sql(rel.text), dialect)
+
+    def prefetch_table_references(self, datasources):
+        """ Parse all uncached custom SQL in `datasources` as one batch in the
+        SQL parser pool.
+
+        Returns the table references of each `(query, dialect)`, or None for
+        statements that timed out or failed to parse, for
+        `extract_table_references` to use (and cache) instead of parsing them
+        again.
+        """
+        # Keyed by statement, to parse each once, in order of appearance
+        statements = {}
+        for query, dialect in self._iterate_custom_sql(datasources):
+            if (query, dialect) not in statements and (
+                self.sql_cache is None or self.sql_cache.peek(query, dialect) is None
+            ):
+                statements[(query, dialect)] = None
+        statements = list(statements)
+        if not statements:
+            return {}
+        prefetched = {}
+        results = self.sql_parser_pool.parse_many(statements)
+        for statement, result in zip(statements, results):
+            refs = None
+            if result is not None:
+                refs, worker_stats = result
+                dialect_stats.merge(worker_stats)
+            prefetched[statement] = refs
+        return prefetched
+
+    def _parse(self, query, dialect):
+        """ Table references of `query` as prefetched by the SQL parser pool,
+        or else parsed in-process; None if it fails to parse.
+        """
+        if (query, dialect) in self._prefetched:
+            return self._prefetched[(query, dialect)]
+        return self.parse(query, dialect)
 
     def extract_datasource(
         self, workbook_id, updated_at, datasource
@@ -140,6 +400,21 @@ class LocalWorkbookExtractor:
         })
         return (record, datasource.connections or [])
 
+    def _connection_definitions(self, connection):
+        """ `(name, attributes)` of each Connection record of a Connection.
+        """
+        if connection.class_ == 'sqlproxy':
+            attrs = self._build_dict(connection, CONNECTION_ATTRS)
+            return [('sqlproxy', self.jsonify_dict(attrs))]
+        elif connection.class_ == 'federated':
+            definitions = []
+            if connection.named_connections:
+                for nc in connection.named_connections.values():
+                    attrs = self._build_dict(nc, CONNECTION_ATTRS)
+                    definitions.append((attrs['name'], self.jsonify_dict(attrs)))
+            return definitions
+        return None
+
     def extract_connection(
         self, workbook_id, datasource_id, updated_at, connection
     ):
@@ -147,51 +422,96 @@ class LocalWorkbookExtractor:
         """
         # Get Child Relation
         relation = getattr(connection, 'relation') or []
+        definitions = self._deduplicate(
+            'connection', lambda: normalize_connection(connection),
+            lambda: self._connection_definitions(connection)
+        )
+        if definitions is None:
+            return None
         # Extract Connections
-        if connection.class_ == 'sqlproxy':
+        records = []
+        for name, attrs in definitions:
             conn = {
                 'wb_id': workbook_id,
                 'ds_id': datasource_id,
-                **self._build_dict(connection, CONNECTION_ATTRS)
+                **attrs
             }
-            conn['id'] = f"{datasource_id}:sqlproxy"
-            conn['updated_at'] = updated_at
-            return [(self.jsonify_dict(conn), relation)]
-        elif connection.class_ == 'federated':
-            named_connections = []
-            if connection.named_connections:
-                for nc in connection.named_connections.values():
-                    this_nc = {
-                        'wb_id': workbook_id,
-                        'ds_id': datasource_id,
-                        **self._build_dict(nc, CONNECTION_ATTRS)
-                    }
-                    this_nc['id'] = f"{datasource_id}:{this_nc['name']}"
-                    this_nc['updated_at'] = updated_at
-                    named_connections.append((self.jsonify_dict(this_nc), relation))
-            return named_connections
+            conn['id'] = f"{datasource_id}:{name}"
+            conn['updated_at'] = self._make_json_friendly(updated_at)
+            records.append((conn, relation))
+        return records
 
-    def extract_relation(
-        self, workbook_id, datasource_id, updated_at, relation
-    ):
+    def _flatten_relation(self, relation):
         for rel in relation:
             if rel.relation:
-                flat_relations = self._recurse_relations(
+                return self._recurse_relations(
                     rel.relation, relation_types_include=self.include,
                     relation_types_exclude=self.exclude
                 )
-                return [
-                    self._extract_relation(
-                        workbook_id, datasource_id, updated_at, r
-                    )
-                    for r in flat_relations
-                ]
             else:
-                return [
-                    self._extract_relation(
-                        workbook_id, datasource_id, updated_at, rel
+                return [rel]
+        return []
+
+    def extract_relation(
+        self, workbook_id, datasource_id, updated_at, relation
+    ):
+        definitions = self._deduplicate(
+            'relation', lambda: normalize_relations(relation),
+            lambda: [
+                self.jsonify_dict(self._build_dict(r, RELATION_ATTRS))
+                for r in self._flatten_relation(relation)
+            ]
+        )
+        records = [
+            self._extract_relation(
+                workbook_id, datasource_id, updated_at, attrs
+            )
+            for attrs in definitions
+        ]
+        metrics.add('relations', workbook_id, len(records))
+        return records
+
+    def _table_references(self, query, dialect):
+        if self.sql_cache is not None:
+            return self.sql_cache.get_or_parse(query, dialect, self._parse)
+        if self.definition_cache is not None:
+            return self.definition_cache.get_or_extract(
+                'custom SQL', (query, dialect),
+                lambda: self._parse(query, dialect) or []
+            )
+        return self._parse(query, dialect) or []
+
+    def extract_all(self, workbook: LocalWorkbook) -> ExtractionResult:
+        """ Extract all records from a LocalWorkbook, walking its Datasources,
+        Connections and Relations in the same order as the stream tree.
+        """
+        result = ExtractionResult([], [], [], [], [])
+        record, datasources = self.extract_workbook(workbook)
+        result.workbooks.append(record)
+        for datasource in datasources:
+            ds_record, connections = self.extract_datasource(
+                workbook_id=record['id'], updated_at=record['updated_at'],
+                datasource=datasource
+            )
+            result.datasources.append(ds_record)
+            for connection in connections:
+                for conn_record, relation in (
+                    self.extract_connection(
+                        workbook_id=record['id'], datasource_id=ds_record['id'],
+                        updated_at=record['updated_at'], connection=connection
+                    ) or []
+                ):
+                    result.connections.append(conn_record)
+                    relations = self.extract_relation(
+                        workbook_id=record['id'], datasource_id=ds_record['id'],
+                        updated_at=record['updated_at'], relation=relation
                     )
-                ]
+                    result.relations.extend(relations)
+                    for rel_record in relations:
+                        result.table_references.extend(
+                            self.extract_table_references(rel_record)
+                        )
+        return result
 
     def extract_table_references(self, relation):
         table_refs = []
@@ -199,23 +519,18 @@ class LocalWorkbookExtractor:
             if relation['text']:
                 dialect = infer_dialect(relation)
                 query = clean_tableau_sql(relation['text'])
-                # Parse SQL using SQLFluff
-                try:
-                    parsed = sqlfluff.parse(query)
-                    external_tables = parsed.tree.get_table_references()
-                    for ref in external_tables:
-                        table_refs.append(
-                            self.jsonify_dict({
-                                'wb_id': relation['wb_id'],
-                                'ds_id': relation['ds_id'],
-                                'conn_id': relation['conn_id'],
-                                'rel_id': relation['id'],
-                                'id': f"{relation['wb_id']}:{relation['ds_id']}:{relation['conn_id']}:{relation['id']}:{ref.lower()}",
-                                'ref': ref.lower(),
-                                'updated_at': relation['updated_at']
-                            })
-                        )
-                except sqlfluff.core.SQLBaseError as e:
-                    logger.error(f"Falied to parse table refs: {e}")
-                    pass
+                with metrics.timer('sql_parse_seconds', workbook_id=relation['wb_id']):
+                    refs = self._table_references(query, dialect)
+                for ref in refs:
+                    table_refs.append(
+                        self.jsonify_dict({
+                            'wb_id': relation['wb_id'],
+                            'ds_id': relation['ds_id'],
+                            'conn_id': relation['conn_id'],
+                            'rel_id': relation['id'],
+                            'id': f"{relation['wb_id']}:{relation['ds_id']}:{relation['conn_id']}:{relation['id']}:{ref}",
+                            'ref': ref,
+                            'updated_at': relation['updated_at']
+                        })
+                    )
         return table_refs
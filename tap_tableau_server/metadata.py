@@ -0,0 +1,218 @@
+"""Datasource details from the Tableau Metadata API (GraphQL).
+
+Rather than downloading and parsing each Workbook, the Metadata API is asked
+for the embedded Datasources of a batch of Workbooks at once, and each
+Workbook is rebuilt as a CompactWorkbook that `LocalWorkbookExtractor` reads
+like a downloaded one:
+
+- each embedded Datasource becomes a Datasource, named by its Metadata API name
+- its upstream databases become the named connections of a federated
+  Connection, named `<connectionType>.<database id>`
+- its custom SQL queries become 'text' Relations, and the upstream tables
+  they do not account for become 'table' Relations
+
+Workbooks the Metadata API has not (fully) indexed are left out of the
+result, for the caller to retry later or download instead. The record IDs of
+downloaded Workbooks follow the names in the Workbook file, which the
+Metadata API does not expose, so records carry the `id_scheme` they follow.
+"""
+
+import logging
+from typing import Callable, Dict, Iterable, List
+
+import tableauserverclient as tsc
+
+from .compact_workbook import (
+    CompactWorkbook, CompactDatasource, CompactConnection, CompactRelation
+)
+
+
+logger = logging.getLogger('tap_tableau_server.metadata')
+EXTRACTION_BACKENDS = ['download', 'metadata']
+# Page size for site-wide connections, the Metadata API's default maximum
+METADATA_PAGE_SIZE = 1000
+
+WORKBOOKS_QUERY = """
+query workbooks($luids: [String]) {
+  workbooks(filter: {luidWithin: $luids}) {
+    luid
+    sheets { name }
+    embeddedDatasources {
+      id
+      name
+      upstreamDatabases {
+        id
+        name
+        connectionType
+        ... on DatabaseServer { hostName port }
+      }
+      upstreamTables { id name fullName database { id connectionType } }
+    }
+  }
+}
+"""
+
+CUSTOM_SQL_QUERY = """
+query customSQLTables($first: Int, $afterToken: String) {
+  customSQLTablesConnection(first: $first, after: $afterToken) {
+    nodes {
+      id
+      name
+      query
+      database { id connectionType }
+      tables { id }
+      downstreamDatasources { id }
+    }
+    pageInfo { hasNextPage endCursor }
+  }
+}
+"""
+
+
+class MetadataError(Exception):
+    """ The Metadata API answered with errors.
+    """
+
+
+def connection_name(database):
+    """ Name of the named connection of an upstream database.
+    """
+    if not database:
+        return None
+    return f"{database.get('connectionType')}.{database.get('id')}"
+
+
+def build_datasource(name, datasource, custom_sql_tables):
+    """ Build a CompactDatasource from an embedded Datasource, or return None
+    if the Metadata API has not indexed its upstream databases.
+    """
+    databases = datasource.get('upstreamDatabases')
+    if not databases:
+        return None
+    named_connections = {}
+    for database in databases:
+        nc_name = connection_name(database)
+        port = database.get('port')
+        named_connections[nc_name] = CompactConnection(
+            name=nc_name,
+            caption=database.get('name'),
+            class_=database.get('connectionType'),
+            dbname=database.get('name'),
+            server=database.get('hostName'),
+            port=str(port) if port else None
+        )
+    # Tables read by custom SQL are already accounted for by its query
+    sql_table_ids = {
+        table['id']
+        for cst in custom_sql_tables
+        for table in (cst.get('tables') or [])
+    }
+    relations = [
+        CompactRelation(
+            type='text', name=cst.get('name'),
+            connection=connection_name(cst.get('database')), text=cst.get('query')
+        )
+        for cst in custom_sql_tables
+    ] + [
+        CompactRelation(
+            type='table', name=table.get('name'),
+            connection=connection_name(table.get('database')),
+            table=table.get('fullName')
+        )
+        for table in (datasource.get('upstreamTables') or [])
+        if table['id'] not in sql_table_ids
+    ]
+    if len(relations) > 1:
+        relations = [CompactRelation(type='join', relation=relations)]
+    return CompactDatasource(
+        name=name, caption=datasource.get('name'),
+        connections=[CompactConnection(
+            class_='federated', named_connections=named_connections,
+            relation=relations
+        )]
+    )
+
+
+def build_workbook(workbook, custom_sql_by_datasource):
+    """ Build a CompactWorkbook from a Metadata API Workbook, or return None
+    if any of its Datasources is incomplete.
+    """
+    datasources = {}
+    for datasource in workbook.get('embeddedDatasources') or []:
+        name = datasource.get('name')
+        # Datasource names are only unique within a Workbook's XML
+        if name in datasources:
+            name = f"{name}:{datasource['id']}"
+        compact = build_datasource(
+            name, datasource, custom_sql_by_datasource.get(datasource['id'], [])
+        )
+        if compact is None:
+            return None
+        datasources[name] = compact
+    return CompactWorkbook(
+        worksheets=[sheet['name'] for sheet in workbook.get('sheets') or []],
+        datasources=datasources
+    )
+
+
+class MetadataWorkbookSource:
+    """ Builds CompactWorkbooks for WorkbookItems from the Metadata API.
+
+    `query(query, variables)` sends one GraphQL query and returns the parsed
+    JSON response. Custom SQL tables are listed once per source, page by
+    page, as the Metadata API cannot filter them by Workbook.
+    """
+
+    def __init__(
+        self, query: Callable[[str, dict], dict], page_size=METADATA_PAGE_SIZE
+    ):
+        self.query = query
+        self.page_size = page_size
+        self._custom_sql_by_datasource = None
+
+    def _data(self, query, variables):
+        result = self.query(query, variables)
+        if result.get('errors'):
+            raise MetadataError(
+                "; ".join(error.get('message', '') for error in result['errors'])
+            )
+        return result['data']
+
+    @property
+    def custom_sql_by_datasource(self) -> Dict[str, List[dict]]:
+        """ Custom SQL tables of the site, by downstream Datasource ID.
+        """
+        if self._custom_sql_by_datasource is None:
+            by_datasource = {}
+            after = None
+            while True:
+                page = self._data(
+                    CUSTOM_SQL_QUERY, {'first': self.page_size, 'afterToken': after}
+                )['customSQLTablesConnection']
+                for cst in page['nodes']:
+                    for datasource in cst.get('downstreamDatasources') or []:
+                        by_datasource.setdefault(datasource['id'], []).append(cst)
+                if not page['pageInfo']['hasNextPage']:
+                    break
+                after = page['pageInfo']['endCursor']
+            logger.info(
+                f"Listed custom SQL of {len(by_datasource)} Datasources "
+                "from the Metadata API."
+            )
+            self._custom_sql_by_datasource = by_datasource
+        return self._custom_sql_by_datasource
+
+    def get_workbooks(
+        self, workbook_items: Iterable[tsc.WorkbookItem]
+    ) -> Dict[str, CompactWorkbook]:
+        """ CompactWorkbooks by Workbook ID, for those of `workbook_items` the
+        Metadata API has complete details of.
+        """
+        luids = [wbi.id for wbi in workbook_items]
+        data = self._data(WORKBOOKS_QUERY, {'luids': luids})
+        workbooks = {}
+        for workbook in data['workbooks']:
+            compact = build_workbook(workbook, self.custom_sql_by_datasource)
+            if compact is not None:
+                workbooks[workbook['luid']] = compact
+        return workbooks
@@ -0,0 +1,274 @@
+"""Per-stage timing and volume metrics for the sync.
+
+Counters and histograms are collected in the process-wide `metrics`
+registry as the client and extractor run. At the end of the sync they are
+logged as Singer `METRIC:` lines, optionally written to a Prometheus textfile,
+and the slowest Workbooks of each stage are logged by ID.
+"""
+
+import os
+import json
+import time
+import heapq
+import bisect
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+logger = logging.getLogger('tap_tableau_server.metrics')
+
+PREFIX = 'tap_tableau_server'
+SECONDS_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300
+)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(11))
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# Workbooks whose running totals are kept, as their observations arrive close
+# together (while the Workbook is downloaded and extracted)
+OPEN_WORKBOOKS = 1024
+
+
+def buckets_for(name):
+    if name.endswith('_seconds'):
+        return SECONDS_BUCKETS
+    if name.endswith('_bytes'):
+        return BYTES_BUCKETS
+    return COUNT_BUCKETS
+
+
+class Histogram:
+    """ Cumulative-bucket histogram, as used by Prometheus.
+    """
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+
+class WorkbookTotals:
+    """ Per-Workbook totals of one metric, in memory bounded by the size of
+    the slow log rather than by the number of Workbooks.
+
+    Running totals are kept for the `open_workbooks` most recently updated
+    Workbooks only. Older totals are final, and are folded into `histogram`.
+    The `n` highest totals are kept in a min-heap.
+    """
+
+    __slots__ = ('n', 'open_workbooks', 'running', 'histogram', 'top')
+
+    def __init__(self, n, buckets, open_workbooks=OPEN_WORKBOOKS):
+        self.n = n
+        self.open_workbooks = open_workbooks
+        self.running = OrderedDict()
+        self.histogram = Histogram(buckets)
+        # (total, workbook_id) of the Workbooks with the highest totals
+        self.top = []
+
+    def __len__(self):
+        """ The number of Workbooks with a total.
+        """
+        return self.histogram.count + len(self.running)
+
+    def add(self, workbook_id, value):
+        total = self.running.pop(workbook_id, 0) + value
+        self.running[workbook_id] = total
+        if len(self.running) > self.open_workbooks:
+            _, final = self.running.popitem(last=False)
+            self.histogram.observe(final)
+        self._update_top(workbook_id, total)
+
+    def _update_top(self, workbook_id, total):
+        for i, (_, top_id) in enumerate(self.top):
+            if top_id == workbook_id:
+                # Totals only grow, so the Workbook stays in the top n
+                self.top[i] = (total, workbook_id)
+                heapq.heapify(self.top)
+                return
+        if len(self.top) < self.n:
+            heapq.heappush(self.top, (total, workbook_id))
+        elif total > self.top[0][0]:
+            heapq.heapreplace(self.top, (total, workbook_id))
+
+    def largest(self):
+        """ `(workbook_id, total)` of the Workbooks with the highest totals.
+        """
+        return [
+            (workbook_id, total)
+            for total, workbook_id in sorted(self.top, reverse=True)
+        ]
+
+    def totals_histogram(self):
+        """ A histogram of every Workbook's total.
+        """
+        histogram = Histogram(self.histogram.buckets)
+        histogram.counts = list(self.histogram.counts)
+        histogram.count = self.histogram.count
+        histogram.sum = self.histogram.sum
+        histogram.max = self.histogram.max
+        for total in self.running.values():
+            histogram.observe(total)
+        return histogram
+
+
+class Metrics:
+    """ A thread-safe registry of counters and histograms.
+
+    Observations made with a `workbook_id` are also summed per Workbook, so
+    the `slow_log_size` Workbooks with the highest totals of each metric can
+    be reported.
+    """
+
+    def __init__(self, slow_log_size=10):
+        self.slow_log_size = slow_log_size
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.per_workbook = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def _add_to_workbook(self, name, workbook_id, value):
+        totals = self.per_workbook.get(name)
+        if totals is None:
+            totals = self.per_workbook[name] = WorkbookTotals(
+                self.slow_log_size, buckets_for(name)
+            )
+        totals.add(workbook_id, value)
+
+    def observe(self, name, value, workbook_id=None):
+        """ Record one observation (e.g. the duration of one request).
+        """
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets_for(name))
+            histogram.observe(value)
+            if workbook_id is not None:
+                self._add_to_workbook(name, workbook_id, value)
+
+    def add(self, name, workbook_id, value):
+        """ Add to a per-Workbook total (e.g. relations per Workbook), which is
+        reported as a histogram over Workbooks.
+        """
+        with self._lock:
+            self._add_to_workbook(name, workbook_id, value)
+
+    @contextmanager
+    def timer(self, name, workbook_id=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, workbook_id)
+
+    def per_workbook_histograms(self):
+        """ Histograms of per-Workbook totals, for metrics only recorded with `add`.
+        """
+        with self._lock:
+            return {
+                name: totals.totals_histogram()
+                for name, totals in self.per_workbook.items()
+                if name not in self.histograms
+            }
+
+    def slowest(self, name, n=None):
+        """ The `n` (at most `slow_log_size`) Workbooks with the highest
+        totals of a metric.
+        """
+        with self._lock:
+            totals = self.per_workbook.get(name)
+            largest = totals.largest() if totals is not None else []
+        return largest[:n or self.slow_log_size]
+
+    def all_histograms(self):
+        with self._lock:
+            histograms = dict(self.histograms)
+        histograms.update(self.per_workbook_histograms())
+        return histograms
+
+    def log(self):
+        """ Log every metric as a Singer METRIC line, then the slowest
+        Workbooks of each per-Workbook metric.
+        """
+        with self._lock:
+            counters = dict(self.counters)
+        for name, value in sorted(counters.items()):
+            logger.info("METRIC: " + json.dumps({
+                'type': 'counter', 'metric': name, 'value': value, 'tags': {}
+            }))
+        for name, histogram in sorted(self.all_histograms().items()):
+            logger.info("METRIC: " + json.dumps({
+                'type': 'timer' if name.endswith('_seconds') else 'counter',
+                'metric': name,
+                'value': round(histogram.sum, 6),
+                'tags': {
+                    'count': histogram.count,
+                    'mean': round(histogram.mean, 6),
+                    'max': round(histogram.max, 6)
+                }
+            }))
+        for name in sorted(self.per_workbook):
+            slowest = self.slowest(name)
+            if slowest:
+                logger.info(
+                    f"Top {len(slowest)} Workbooks by {name}: " + ", ".join(
+                        f"{workbook_id} ({value:.3g})" for workbook_id, value in slowest
+                    )
+                )
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            counters = dict(self.counters)
+        for name, value in sorted(counters.items()):
+            metric = f"{PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, histogram in sorted(self.all_histograms().items()):
+            metric = f"{PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for le, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{metric}_sum {histogram.sum}")
+            lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """ Atomically write metrics in the Prometheus textfile format.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+        logger.info(f"Wrote metrics to {path}")
+
+
+metrics = Metrics()
@@ -0,0 +1,160 @@
+"""Built-in profiling of syncs.
+
+Profiles the work each stream does in its own `get_records` (not the SDK's
+record handling around it) with one cProfile profiler per stream, and samples
+the syncing thread's stack to build a flamegraph-compatible collapsed-stack
+file. Profiling can be limited to every Nth Workbook (with everything its
+child streams do for it) to keep the overhead low in production runs.
+"""
+
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from collections import Counter
+
+
+logger = logging.getLogger('tap_tableau_server.profiling')
+
+# Stream whose records decide which Workbooks are profiled
+WORKBOOK_STREAM = 'workbook'
+
+
+def frame_label(frame):
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class StackSampler(threading.Thread):
+    """ Samples one thread's stack every `interval` seconds while a stream is
+    being profiled, counting collapsed stacks rooted at the stream's name.
+    """
+
+    def __init__(self, interval=0.005):
+        super().__init__(name='tap-profile-sampler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.target = None
+        # Code object of the frame stacks are collapsed below
+        self.root_code = None
+        self._stop_event = threading.Event()
+
+    def sample(self, thread_id, stream_name):
+        self.target = (thread_id, stream_name)
+
+    def pause(self):
+        self.target = None
+
+    def take_sample(self):
+        """ Count the target thread's current stack, if a stream is being
+        profiled.
+        """
+        target = self.target
+        if target is None:
+            return
+        thread_id, stream_name = target
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None and frame.f_code is not self.root_code:
+            stack.append(frame_label(frame))
+            frame = frame.f_back
+        stack.append(stream_name)
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.take_sample()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class SyncProfiler:
+    """ Profiles every stream's `get_records` and writes, to `output_dir`:
+
+    - `<stream>.prof`: cProfile stats (for `pstats`, snakeviz, etc.)
+    - `<stream>.txt`: the top functions by cumulative time
+    - `stacks.collapsed`: sampled stacks, for flamegraph.pl or speedscope
+
+    Only every `every_n_workbooks`th Workbook is profiled. Time in each
+    stream's `get_records` is measured with `clock`.
+    """
+
+    def __init__(
+        self, output_dir, every_n_workbooks=1, sample_interval=0.005,
+        clock=time.perf_counter
+    ):
+        self.output_dir = output_dir
+        self.clock = clock
+        self.every_n_workbooks = max(1, every_n_workbooks or 1)
+        self.profiles = {}
+        self.seconds = Counter()
+        self.workbooks = 0
+        self.profiled_workbooks = 0
+        # Whether the current Workbook (and its children's work) is profiled
+        self.active = True
+        self.sampler = StackSampler(interval=sample_interval)
+
+    def _profiled(self, stream_name, get_records):
+        profile = self.profiles[stream_name] = cProfile.Profile()
+
+        def wrapper(*args, **kwargs):
+            generator = get_records(*args, **kwargs)
+            while True:
+                if stream_name == WORKBOOK_STREAM:
+                    self.active = self.workbooks % self.every_n_workbooks == 0
+                active = self.active
+                if active:
+                    self.sampler.sample(threading.get_ident(), stream_name)
+                    start = self.clock()
+                    profile.enable()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    if active:
+                        profile.disable()
+                        self.sampler.pause()
+                        self.seconds[stream_name] += self.clock() - start
+                if stream_name == WORKBOOK_STREAM:
+                    if active:
+                        self.profiled_workbooks += 1
+                    self.workbooks += 1
+                yield item
+
+        self.sampler.root_code = wrapper.__code__
+        return wrapper
+
+    def instrument(self, streams):
+        """ Profile the `get_records` of each of a Tap's streams.
+        """
+        for name, stream in streams.items():
+            stream.get_records = self._profiled(name, stream.get_records)
+        self.sampler.start()
+
+    def write(self):
+        self.sampler.stop()
+        os.makedirs(self.output_dir, exist_ok=True)
+        for name, profile in self.profiles.items():
+            if not self.seconds[name]:
+                continue
+            profile.dump_stats(os.path.join(self.output_dir, f"{name}.prof"))
+            with open(os.path.join(self.output_dir, f"{name}.txt"), 'w') as f:
+                stats = pstats.Stats(profile, stream=f)
+                stats.sort_stats('cumulative').print_stats(40)
+        with open(os.path.join(self.output_dir, 'stacks.collapsed'), 'w') as f:
+            for stack, count in sorted(self.sampler.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        logger.info(
+            f"Profiled {self.profiled_workbooks} of {self.workbooks} Workbooks, "
+            f"written to {self.output_dir}. Time in get_records per stream: "
+            + ", ".join(
+                f"{name} {seconds:.2f}s" for name, seconds in self.seconds.most_common()
+            )
+        )
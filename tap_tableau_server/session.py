@@ -0,0 +1,160 @@
+import time
+import logging
+import threading
+from collections import namedtuple
+import xml.etree.ElementTree as ET
+
+import requests
+import tableauserverclient as tsc
+from tableauserverclient.server.endpoint.exceptions import (
+    ServerResponseError, InternalServerError
+)
+
+from .throttling import Throttle, raise_for_throttling
+
+
+logger = logging.getLogger('tap_tableau_server.session')
+
+# Tableau Server sessions expire after 240 minutes by default,
+# so sign in again a little before that.
+DEFAULT_SESSION_MAX_AGE = 230 * 60
+NAMESPACE = {'t': 'http://tableau.com/api'}
+# Enough of a response for tableauserverclient's InternalServerError
+_Response = namedtuple('_Response', ['status_code', 'content'])
+
+
+def check_status(status, content):
+    """ Raise the same exceptions as tableauserverclient for error responses.
+    """
+    if status >= 500:
+        raise InternalServerError(_Response(status, content))
+    if status >= 400:
+        try:
+            raise ServerResponseError.from_response(content, NAMESPACE)
+        except (ET.ParseError, AttributeError):
+            raise ServerResponseError(str(status), 'HTTP error', content)
+
+
+def is_unauthorized(error):
+    """ True if `error` is a 401 response from Tableau Server.
+    """
+    return (
+        isinstance(error, ServerResponseError)
+        and str(error.code).startswith('401')
+    )
+
+
+def is_not_found(error):
+    """ True if `error` is a 404 response from Tableau Server.
+    """
+    return (
+        isinstance(error, ServerResponseError)
+        and str(error.code).startswith('404')
+    )
+
+
+class TableauServerSession:
+    """ A single signed-in `tsc.Server`, shared for the whole sync.
+
+    The auth token and HTTP connection pool are shared by every call made
+    through the session. Sign in happens lazily on first use, and again once
+    the token is older than `max_age` seconds or is rejected with a 401,
+    signing the previous session out on a best-effort basis.
+    Every call is rate limited and retried by the session's `Throttle`.
+    """
+
+    def __init__(
+        self, host, authentication, api_version='3.2',
+        max_age=DEFAULT_SESSION_MAX_AGE, pool_size=10, throttle=None
+    ):
+        self._host = host
+        self._authentication = authentication
+        self._api_version = api_version
+        self._max_age = max_age
+        self._pool_size = pool_size
+        self.throttle = throttle or Throttle()
+        self._server = None
+        self._signed_in_at = None
+        self._generation = 0
+        self._lock = threading.RLock()
+
+    def _new_server(self):
+        server = tsc.Server(self._host)
+        server.version = self._api_version
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self._pool_size, pool_maxsize=self._pool_size
+        )
+        server.session.mount('https://', adapter)
+        server.session.mount('http://', adapter)
+        server.session.hooks['response'].append(raise_for_throttling)
+        return server
+
+    def _sign_in(self):
+        server = self._new_server()
+        server.auth.sign_in(self._authentication)
+        previous, self._server = self._server, server
+        self._signed_in_at = time.monotonic()
+        self._generation += 1
+        logger.info(f"Signed in to {self._host} (session {self._generation}).")
+        if previous is not None:
+            # Free the old session on the server, if it is still valid
+            self._sign_out(previous)
+
+    def _sign_out(self, server):
+        try:
+            server.auth.sign_out()
+            logger.info(f"Signed out of {self._host}.")
+        except Exception as e:
+            logger.warning(f"Failed to sign out of {self._host}: {e}")
+
+    def _expired(self):
+        return (time.monotonic() - self._signed_in_at) >= self._max_age
+
+    def _current(self):
+        with self._lock:
+            if self._server is None or self._expired():
+                self._sign_in()
+            return self._server, self._generation
+
+    def _refresh(self, generation):
+        with self._lock:
+            # Another thread may already have signed in again
+            if generation == self._generation:
+                self._sign_in()
+            return self._server
+
+    @property
+    def server(self):
+        """ The signed-in `tsc.Server`.
+        """
+        server, _ = self._current()
+        return server
+
+    def call(self, func, *args, **kwargs):
+        """ Call `func(server, *args, **kwargs)` with the signed-in server.
+
+        If the server rejects the session token, sign in again and retry once.
+        Throttled and failed requests are retried according to the Throttle.
+        """
+        return self.throttle.call(self._call, func, *args, **kwargs)
+
+    def _call(self, func, *args, **kwargs):
+        server, generation = self._current()
+        try:
+            return func(server, *args, **kwargs)
+        except ServerResponseError as e:
+            if not is_unauthorized(e):
+                raise
+            logger.info("Session token rejected. Signing in again.")
+            server = self._refresh(generation)
+            return func(server, *args, **kwargs)
+
+    def close(self):
+        """ Sign out, if signed in.
+        """
+        with self._lock:
+            if self._server is None:
+                return
+            server, self._server = self._server, None
+            self._signed_in_at = None
+            self._sign_out(server)
@@ -0,0 +1,115 @@
+"""Fetching Workbooks in background threads, to sync several sites (or
+partitions of the Workbook stream) in parallel.
+
+Each producer thread iterates one client's Workbooks and hands them to the
+syncing thread one at a time through a queue, so records of different sites
+can be interleaved while only the syncing thread ever writes records or
+state.
+"""
+
+import queue
+import logging
+import threading
+from contextlib import closing
+
+
+logger = logging.getLogger('tap_tableau_server.sites')
+# Marks the end of one producer's Workbooks
+_DONE = object()
+
+
+class WorkbookProducer(threading.Thread):
+    """ Iterates `get_workbooks()` in a background thread, putting
+    `(key, LocalWorkbook, consumed)` on `handoff` and waiting for the
+    `consumed` event before fetching the next Workbook.
+
+    Waiting keeps each client's own bounds on in-flight downloads and its
+    clean-up of downloaded files intact.
+    """
+
+    def __init__(self, key, get_workbooks, handoff=None):
+        super().__init__(name=f"tableau-workbooks-{key or 'default'}", daemon=True)
+        self.key = key
+        self.get_workbooks = get_workbooks
+        self.handoff = handoff or queue.Queue()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            with closing(self.get_workbooks()) as workbooks:
+                for lwb in workbooks:
+                    consumed = threading.Event()
+                    self.handoff.put((self.key, lwb, consumed))
+                    while not (consumed.wait(0.1) or self._stop_event.is_set()):
+                        pass
+                    if self._stop_event.is_set():
+                        return
+        except Exception as e:
+            self.handoff.put((self.key, e, None))
+        else:
+            self.handoff.put((self.key, _DONE, None))
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def consume_workbooks(producers, handoff):
+    """ Start `producers` (all putting onto `handoff`) and yield
+    `(key, LocalWorkbook)` in the order they become ready.
+
+    If any producer fails, every producer is stopped and the error is raised.
+    """
+    for producer in producers:
+        # Producers may have been started ahead of time, to prefetch
+        if producer.ident is None:
+            producer.start()
+    remaining = len(producers)
+    try:
+        while remaining:
+            key, item, consumed = handoff.get()
+            if item is _DONE:
+                logger.info(f"Finished fetching Workbooks of '{key}'.")
+                remaining -= 1
+                continue
+            if isinstance(item, Exception):
+                logger.error(f"Failed to fetch Workbooks of '{key}'. Stopping.")
+                raise item
+            try:
+                yield key, item
+            finally:
+                consumed.set()
+    finally:
+        for producer in producers:
+            producer.stop()
+
+
+def interleave_site_workbooks(clients, checkpoints, limit=None, skip_ids=None):
+    """ Yield `(site_id, LocalWorkbook)` from every client in `clients` (a dict
+    of site ID to client), in the order they become ready.
+
+    Each site's Workbooks are listed from its own checkpoint in `checkpoints`
+    (skipping that site's `skip_ids`, if any), up to `limit` Workbooks per
+    site, and are yielded in that site's listing order. If any site fails,
+    the other sites are stopped and the error is raised.
+    """
+    skip_ids = skip_ids or {}
+
+    def site_workbooks(site_id, client):
+        return lambda: client.get_workbooks(
+            checkpoint=checkpoints.get(site_id), limit=limit,
+            skip_ids=skip_ids.get(site_id)
+        )
+
+    if len(clients) == 1:
+        (site_id, client), = clients.items()
+        for lwb in site_workbooks(site_id, client)():
+            yield site_id, lwb
+        return
+
+    handoff = queue.Queue()
+    producers = [
+        WorkbookProducer(site_id, site_workbooks(site_id, client), handoff)
+        for site_id, client in clients.items()
+    ]
+    yield from consume_workbooks(producers, handoff)
@@ -0,0 +1,76 @@
+import logging
+import multiprocessing
+from typing import Any, List, Tuple
+
+
+logger = logging.getLogger('tap_tableau_server.sql_parser_pool')
+
+
+class SQLParserPool:
+    """ Parses custom SQL statements in a pool of worker processes.
+
+    `parse` must be a picklable, module-level function taking
+    `(sql, dialect)` and returning its result for the statement. Each
+    statement gets `timeout` seconds; a statement that takes longer is
+    abandoned (its result is None) and the pool is restarted, so one
+    pathological query cannot stall the run.
+
+    Workers are started with the 'spawn' method, as forking a process that
+    runs other threads (such as download workers) can copy a held lock into
+    the child and deadlock it.
+    """
+
+    def __init__(self, parse, processes=None, timeout=60):
+        self.parse = parse
+        self.processes = processes or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.timeouts = 0
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.get_context('spawn').Pool(
+                processes=self.processes
+            )
+        return self._pool
+
+    def _restart(self):
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+
+    def parse_many(self, statements: List[Tuple[str, str]]) -> List[Any]:
+        """ Parse a batch of `(sql, dialect)` statements, returning their
+        results in the same order as `statements`, or None for those that
+        timed out.
+        """
+        results = [None] * len(statements)
+        remaining = list(range(len(statements)))
+        while remaining:
+            pending = [
+                (i, self.pool.apply_async(self.parse, statements[i]))
+                for i in remaining
+            ]
+            remaining = []
+            for n, (i, result) in enumerate(pending):
+                try:
+                    results[i] = result.get(timeout=self.timeout)
+                except multiprocessing.TimeoutError:
+                    self.timeouts += 1
+                    logger.error(
+                        f"Timed out after {self.timeout}s parsing table refs "
+                        f"from SQL: {statements[i][0][:200]!r}"
+                    )
+                    results[i] = None
+                    # Terminate the stuck worker and resubmit the rest
+                    self._restart()
+                    remaining = [j for j, _ in pending[n + 1:]]
+                    break
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
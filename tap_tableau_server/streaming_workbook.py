@@ -0,0 +1,112 @@
+"""Incremental (iterparse) extraction of Workbook files.
+
+Builds a `CompactWorkbook` from a .twb or .twbx file without holding the whole
+XML tree in memory. Each top-level datasource is converted to compact records
+as soon as its element is complete, and every finished element is freed.
+"""
+
+import zipfile
+import xml.etree.ElementTree as ET
+
+from .compact_workbook import (
+    CONNECTION_XML_ATTRS, CompactWorkbook, CompactDatasource,
+    CompactConnection, CompactRelation
+)
+
+DATASOURCE_PATH = ('workbook', 'datasources', 'datasource')
+WORKSHEET_PATH = ('workbook', 'worksheets', 'worksheet')
+
+
+def _connection_attrs(elem):
+    return {
+        attr: elem.get(xml_attr)
+        for xml_attr, attr in CONNECTION_XML_ATTRS.items()
+    }
+
+
+def _named_connection(elem):
+    inner = elem.find('connection')
+    attrs = _connection_attrs(inner) if inner is not None else {}
+    return CompactConnection(
+        name=elem.get('name'), caption=elem.get('caption'), **attrs
+    )
+
+
+def _relation(elem):
+    return CompactRelation(
+        type=elem.get('type'),
+        name=elem.get('name'),
+        connection=elem.get('connection'),
+        table=elem.get('table'),
+        text=elem.text,
+        relation=[_relation(child) for child in elem.findall('relation')]
+    )
+
+
+def _connection(elem):
+    named_connections = {}
+    for nc in elem.findall('named-connections/named-connection'):
+        named_connections[nc.get('name')] = _named_connection(nc)
+    return CompactConnection(
+        named_connections=named_connections,
+        relation=[_relation(child) for child in elem.findall('relation')],
+        **_connection_attrs(elem)
+    )
+
+
+def _datasource(elem):
+    return CompactDatasource(
+        name=elem.get('name'),
+        caption=elem.get('caption'),
+        version=elem.get('version'),
+        connections=[_connection(child) for child in elem.findall('connection')]
+    )
+
+
+def _open_twb(source):
+    """ Return a binary file object for the .twb XML in `source`, which may
+    be a path or file object of a .twb or .twbx file.
+    """
+    if zipfile.is_zipfile(source):
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        archive = zipfile.ZipFile(source)
+        for name in archive.namelist():
+            if name.endswith('.twb') and '/' not in name:
+                return archive.open(name)
+        raise ValueError(f"No .twb file found in workbook archive {source}")
+    if hasattr(source, 'seek'):
+        source.seek(0)
+        return source
+    return open(source, 'rb')
+
+
+def parse_workbook(source, filename=None):
+    """ Parse a .twb or .twbx file incrementally into a CompactWorkbook.
+    """
+    workbook = CompactWorkbook(
+        filename=filename or (source if isinstance(source, str) else None)
+    )
+    stack = []
+    with _open_twb(source) as twb:
+        for event, elem in ET.iterparse(twb, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                if len(stack) == 1:
+                    workbook.source_platform = elem.get('source-platform')
+                    workbook.source_build = elem.get('source-build')
+                continue
+            path = tuple(e.tag for e in stack)
+            if path == DATASOURCE_PATH:
+                datasource = _datasource(elem)
+                workbook.datasources[datasource.name] = datasource
+            elif path == WORKSHEET_PATH:
+                workbook.worksheets.append(elem.get('name'))
+            stack.pop()
+            # Free finished elements, except those inside a top-level
+            # datasource that is still being read
+            in_datasource = len(path) > 3 and path[:3] == DATASOURCE_PATH
+            if stack and not in_datasource:
+                elem.clear()
+                stack[-1].remove(elem)
+    return workbook
@@ -1,5 +1,7 @@
 """Stream type classes for tap-tableau-server."""
 
+import sys
+import logging
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, Optional, Tuple, Union, List, Iterable
@@ -7,22 +9,116 @@ from typing import Any, Dict, Optional, Tuple, Union, List, Iterable
 from singer_sdk.streams import Stream
 from singer_sdk import typing as th  # JSON Schema typing helpers
 
+from tap_tableau_server.workbook_ids import ids_digest, diff_ids
+from tap_tableau_server.sites import (
+    WorkbookProducer, consume_workbooks, interleave_site_workbooks
+)
 
+
+logger = logging.getLogger('tap_tableau_server.streams')
 SCHEMAS_DIR = Path(__file__).parent / Path("./schemas")
+WORKBOOK_IDS_MODES = ['snapshot', 'incremental']
+
+
+def advance_boundary(boundary, updated_at, workbook_id):
+    """ Add a synced Workbook to the boundary of a bookmark: the IDs of every
+    synced Workbook updated at the bookmark itself, which the
+    `updated_at >= bookmark` filter would otherwise sync again.
+    """
+    if boundary is None or boundary['updated_at'] != updated_at:
+        boundary = {'updated_at': updated_at, 'ids': []}
+    boundary['ids'].append(workbook_id)
+    return boundary
+
+
+def boundary_ids(boundary, checkpoint):
+    """ IDs to skip when resuming from `checkpoint`.
+    """
+    if boundary is None or checkpoint is None or boundary['updated_at'] != checkpoint:
+        return None
+    return list(boundary['ids'])
 
 
 class WorkbookIds(Stream):
     """ All workbook id's.
     """
     name = 'workbook_ids'
-    primary_keys = ['observed_at']
+    primary_keys = ['observed_at', 'site_id']
     schema_filepath = SCHEMAS_DIR / 'workbook_ids.json'
 
+    def get_previous_ids(self, site_id, state) -> Optional[List[str]]:
+        """ The IDs of the previous run, from the Workbook IDs cache by the
+        digest kept in state, or None if they are not known.
+        """
+        cache = self._tap.workbook_ids_cache
+        if cache is None or state.get('digest') is None:
+            return None
+        return cache.get(site_id, state['digest'])
+
+    def get_incremental_ids(self, site_id, ids, observed_at) -> Dict[str, Any]:
+        """ The IDs added and removed since the previous run, or a full
+        snapshot every `workbook_ids_snapshot_every_n_runs` runs (or if the
+        previous run's IDs are not known).
+
+        State only keeps the digest of each site's IDs and when its last
+        snapshot was observed; the IDs themselves are kept in the Workbook
+        IDs cache, by digest.
+        """
+        fingerprints = self.stream_state.setdefault('site_fingerprints', {})
+        state = fingerprints.setdefault(site_id, {})
+        digest = ids_digest(ids)
+        snapshot_every = self.config.get('workbook_ids_snapshot_every_n_runs', 10)
+        runs_since_snapshot = state.get('runs_since_snapshot', 0) + 1
+        if state.get('digest') == digest:
+            # Unchanged, whether or not the IDs are still cached
+            previous = ids
+        else:
+            previous = self.get_previous_ids(site_id, state)
+        if previous is None or (
+            snapshot_every and runs_since_snapshot >= snapshot_every
+        ):
+            changes = {'is_snapshot': True, 'workbook_ids': ids}
+            runs_since_snapshot = 0
+            state['snapshot_observed_at'] = observed_at
+        else:
+            added, removed = diff_ids(previous, ids)
+            changes = {
+                'is_snapshot': False,
+                'workbook_ids': None,
+                'added_ids': added,
+                'removed_ids': removed
+            }
+        cache = self._tap.workbook_ids_cache
+        if cache is not None and (
+            state.get('digest') != digest or cache.get(site_id, digest) is None
+        ):
+            cache.put(site_id, digest, ids)
+        state['digest'] = digest
+        state['runs_since_snapshot'] = runs_since_snapshot
+        changes['snapshot_observed_at'] = state.get('snapshot_observed_at')
+        return changes
+
     def get_records(self, partition: Optional[dict]) -> Iterable[Dict[str, Any]]:
-        yield {
-            'observed_at': datetime.now().isoformat(),
-            'workbook_ids': self._tap.client.list_all_workbook_ids()
-        }
+        mode = self.config.get('workbook_ids_mode', 'snapshot')
+        if mode not in WORKBOOK_IDS_MODES:
+            raise ValueError(
+                f"Unknown workbook_ids_mode '{mode}'. "
+                f"Expected one of {WORKBOOK_IDS_MODES}."
+            )
+        incremental = mode == 'incremental'
+        for site_id, client in self._tap.clients.items():
+            ids = client.list_all_workbook_ids()
+            observed_at = datetime.now().isoformat()
+            record = {
+                'observed_at': observed_at,
+                'site_id': site_id,
+                'workbook_count': len(ids)
+            }
+            if incremental:
+                record.update(self.get_incremental_ids(site_id, ids, observed_at))
+            else:
+                record.update({'is_snapshot': True, 'workbook_ids': ids})
+            yield record
 
 
 class Workbook(Stream):
@@ -32,20 +128,294 @@ class Workbook(Stream):
     primary_keys = ['id']
     replication_key = 'updated_at'
     schema_filepath = SCHEMAS_DIR / 'workbook.json'
+    # Partition bookmarks are kept by project ID, which survives a rename
+    state_partitioning_keys = ['site_id', 'project_id']
 
-    def get_records(self, context) -> Iterable[Tuple]:
-        # Get checkpoint
-        checkpoint = self.stream_state.get('replication_key_value')
+    # Projects of each site, when partitioned by project
+    _partitions = None
+    # Producers of upcoming partitions' Workbooks, by partition
+    _prefetched = None
+    # Workbooks synced this run, to apply `limit` across partitions
+    _workbooks_synced = 0
+    # IDs of Workbooks that failed in earlier runs, by site, until synced
+    _retrying = None
+    # Number of each site's client's failed Workbooks already kept in state
+    _failures_seen = None
+    # Whether the Workbooks being synced are retried ones
+    _in_retries = False
+
+    @property
+    def STATE_MSG_FREQUENCY(self) -> int:
+        """ The SDK emits a state message every `checkpoint_every_n_workbooks`
+        Workbooks, each of which moves the bookmark on once it and all its
+        children have been synced.
+        """
+        return self.config.get('checkpoint_every_n_workbooks', 50) or sys.maxsize
+
+    @property
+    def partitions(self) -> Optional[List[dict]]:
+        """ One partition per project of each site, if `partition_by_project`
+        is set. The SDK keeps a bookmark per partition.
+        """
+        if not self.config.get('partition_by_project'):
+            return None
+        if self._partitions is None:
+            self._partitions = [
+                {
+                    'site_id': site_id,
+                    'project_id': project.id,
+                    'project_name': project.name
+                }
+                for site_id, client in self._tap.clients.items()
+                for project in client.list_projects()
+            ]
+        return self._partitions
+
+    def get_site_checkpoints(self) -> Dict[str, Optional[str]]:
+        """ Each site's bookmark, kept in `site_bookmarks` in the stream's state.
+
+        State written before sites were tracked only has the stream-wide
+        bookmark, which applies to the single site that was then configured.
+        """
+        bookmarks = self.stream_state.setdefault('site_bookmarks', {})
+        legacy_checkpoint = self.stream_state.get('replication_key_value')
+        legacy_site_id = self.config.get('site_id') or ''
+        return {
+            site_id: bookmarks.get(
+                site_id, legacy_checkpoint if site_id == legacy_site_id else None
+            )
+            for site_id in self._tap.clients
+        }
+
+    @property
+    def is_sorted(self) -> bool:
+        """ Each site (or partition) is listed in `updated_at` order, but
+        several sites' Workbooks are interleaved.
+        """
+        if self._in_retries:
+            return False
+        return (
+            bool(self.config.get('partition_by_project'))
+            or len(self._tap.site_ids) == 1
+        )
+
+    def get_site_workbooks(self) -> Iterable[Tuple]:
+        """ `(site_id, LocalWorkbook)` of every site, interleaved.
+        """
+        checkpoints = self.get_site_checkpoints()
+        boundaries = self.stream_state.setdefault('site_boundaries', {})
+        skip_ids = {
+            site_id: boundary_ids(boundaries.get(site_id), checkpoint)
+            for site_id, checkpoint in checkpoints.items()
+        }
+        return interleave_site_workbooks(
+            self._tap.clients, checkpoints, limit=self.config.get('limit'),
+            skip_ids=skip_ids
+        )
+
+    def _remaining_limit(self) -> Optional[int]:
+        """ Workbooks left to sync under `limit`, which applies to the whole
+        run when partitioned by project, or None if there is no limit.
+        """
         limit = self.config.get('limit')
-        # Get workbooks from server
-        for lwb in self._tap.client.get_workbooks(checkpoint=checkpoint, limit=limit):
-            record, datasources = self._tap.wbx.extract_workbook(workbook=lwb)
-            child_context = {
-                'workbook_id': lwb.id,
-                'updated_at': lwb.wbi.updated_at.isoformat(),
-                'datasources': datasources
+        if not limit:
+            return None
+        return max(limit - self._workbooks_synced, 0)
+
+    @staticmethod
+    def _partition_key(context):
+        return (context['site_id'], context['project_id'])
+
+    def _fetch_partition(self, context) -> WorkbookProducer:
+        """ Start fetching a partition's Workbooks in the background.
+        """
+        client = self._tap.clients[context['site_id']]
+        state = self.get_context_state(context)
+        checkpoint = state.get('bookmark') or self.get_starting_replication_key_value(
+            context
+        )
+        boundary = state.get('boundary')
+        if checkpoint is None:
+            # A new partition starts from its site's bookmark, if any
+            checkpoint = self.get_site_checkpoints()[context['site_id']]
+            boundaries = self.stream_state.get('site_boundaries', {})
+            boundary = boundaries.get(context['site_id'])
+        producer = WorkbookProducer(
+            key=f"{context['site_id']}/{context['project_name']}",
+            get_workbooks=lambda: client.get_workbooks(
+                checkpoint=checkpoint,
+                limit=self._remaining_limit(),
+                project_id=context['project_id'],
+                project_name=context['project_name'],
+                skip_ids=boundary_ids(boundary, checkpoint)
+            )
+        )
+        producer.start()
+        return producer
+
+    def get_partition_workbooks(self, context) -> Iterable[Tuple]:
+        """ `(site_id, LocalWorkbook)` of one partition, while the next
+        `partition_prefetch` partitions are fetched in the background.
+        """
+        if self._remaining_limit() == 0:
+            return
+        if self._prefetched is None:
+            self._prefetched = {}
+        partitions = self.partitions
+        keys = [self._partition_key(partition) for partition in partitions]
+        index = keys.index(self._partition_key(context))
+        prefetch = self.config.get('partition_prefetch', 1)
+        for partition in partitions[index:index + 1 + prefetch]:
+            key = self._partition_key(partition)
+            if key not in self._prefetched:
+                self._prefetched[key] = self._fetch_partition(partition)
+        producer = self._prefetched.pop(keys[index])
+        try:
+            for _, lwb in consume_workbooks([producer], producer.handoff):
+                yield context['site_id'], lwb
+        except BaseException:
+            # Stop prefetching if the sync fails or is interrupted
+            for prefetching in self._prefetched.values():
+                prefetching.stop()
+            self._prefetched.clear()
+            raise
+
+    def advance_bookmark(self, context, site_id, lwb):
+        """ Move the bookmark of a Workbook's site (or partition) on, once
+        the Workbook and all its children have been synced.
+        """
+        updated_at = lwb.wbi.updated_at.isoformat()
+        if context:
+            # Kept alongside the SDK's own bookmark, which retried (older)
+            # Workbooks would move back
+            state = self.get_context_state(context)
+            state['bookmark'] = updated_at
+            state['boundary'] = advance_boundary(
+                state.get('boundary'), updated_at, lwb.id
+            )
+        else:
+            self.stream_state['site_bookmarks'][site_id] = updated_at
+            boundaries = self.stream_state['site_boundaries']
+            boundaries[site_id] = advance_boundary(
+                boundaries.get(site_id), updated_at, lwb.id
+            )
+
+    def get_failed_workbooks(self, context, site_id) -> List[str]:
+        """ IDs of a site's (or partition's) Workbooks that could not be
+        fetched, kept in state until they are.
+        """
+        if context:
+            return self.get_context_state(context).get('failed_workbooks') or []
+        return self.stream_state.get('site_failed_workbooks', {}).get(site_id) or []
+
+    def update_failed_workbooks(self, context, site_id):
+        """ Keep the Workbooks that have failed this run, and those still to be
+        retried, in state.
+        """
+        client = self._tap.clients[site_id]
+        self._failures_seen[site_id] = len(client.failed_workbooks)
+        failed = {
+            wbi.id for wbi, _ in client.failed_workbooks
+            if not context or wbi.project_id == context['project_id']
+        }
+        failed.update(self._retrying.get(site_id, ()))
+        if context:
+            self.get_context_state(context)['failed_workbooks'] = sorted(failed)
+        else:
+            failed_workbooks = self.stream_state.setdefault('site_failed_workbooks', {})
+            failed_workbooks[site_id] = sorted(failed)
+
+    def _synced(self, site_id, lwb) -> bool:
+        """ Note that a Workbook has been synced, returning whether the
+        Workbooks failed or still to be retried have changed.
+        """
+        retrying = self._retrying.get(site_id, set())
+        changed = lwb.id in retrying
+        retrying.discard(lwb.id)
+        failures = len(self._tap.clients[site_id].failed_workbooks)
+        return changed or failures != self._failures_seen.get(site_id)
+
+    def _hold_bookmark(self, context):
+        """ Start the SDK's progress markers from the stream's bookmark, so
+        that promoting them at the end of an unsorted sync cannot move the
+        bookmark back to an older Workbook.
+        """
+        state = self.get_context_state(context)
+        if state.get('replication_key_value') and 'progress_markers' not in state:
+            state['progress_markers'] = {
+                'Note': "Progress is not resumable if interrupted.",
+                'replication_key': self.replication_key,
+                'replication_key_value': state['replication_key_value']
             }
-            yield (record, child_context)
+
+    def get_retried_workbooks(self, context, site_ids) -> Iterable[Tuple]:
+        """ `(site_id, LocalWorkbook)` of the Workbooks that could not be
+        fetched in previous runs, and were not synced from the listing, fetched
+        again by ID.
+        """
+        for site_id in site_ids:
+            workbook_ids = sorted(self._retrying.get(site_id, ()))
+            if not workbook_ids:
+                continue
+            logger.info(f"Retrying {len(workbook_ids)} Workbooks that failed before.")
+            client = self._tap.clients[site_id]
+            yield from (
+                (site_id, lwb) for lwb in client.get_workbooks_by_id(
+                    workbook_ids, project_id=context and context['project_id']
+                )
+            )
+            # Any left failed again, or no longer exist
+            self._retrying[site_id] = set()
+
+    def _sync_workbook(self, context, site_id, lwb) -> Iterable[Tuple]:
+        """ Yield a Workbook's record, then, once it and its children have been
+        synced, move the bookmark on and keep any new failures in state.
+        """
+        record, datasources = self._tap.wbx.extract_workbook(workbook=lwb)
+        record['site_id'] = site_id
+        child_context = {
+            'site_id': site_id,
+            'workbook_id': lwb.id,
+            'updated_at': lwb.wbi.updated_at.isoformat(),
+            'id_scheme': lwb.id_scheme,
+            'datasources': datasources
+        }
+        yield (record, child_context)
+        if not self._in_retries:
+            self.advance_bookmark(context, site_id, lwb)
+        if self._synced(site_id, lwb):
+            self.update_failed_workbooks(context, site_id)
+        self._workbooks_synced += 1
+
+    def get_records(self, context) -> Iterable[Tuple]:
+        site_ids = [context['site_id']] if context else list(self._tap.clients)
+        # Retried once the listed Workbooks have been synced, unless listed
+        self._retrying = {
+            site_id: set(self.get_failed_workbooks(context, site_id))
+            for site_id in site_ids
+        }
+        self._failures_seen = {}
+        if not self.is_sorted:
+            self._hold_bookmark(context)
+        if context:
+            workbooks = self.get_partition_workbooks(context)
+        else:
+            workbooks = self.get_site_workbooks()
+        for site_id, lwb in workbooks:
+            yield from self._sync_workbook(context, site_id, lwb)
+            if context and self._remaining_limit() == 0:
+                # Also stops prefetching the next partitions
+                break
+        # Retried Workbooks are older than the bookmark
+        self._in_retries = True
+        self._hold_bookmark(context)
+        try:
+            for site_id, lwb in self.get_retried_workbooks(context, site_ids):
+                yield from self._sync_workbook(context, site_id, lwb)
+        finally:
+            self._in_retries = False
+        for site_id in site_ids:
+            self.update_failed_workbooks(context, site_id)
 
 
 class WorkbookDatasource(Stream):
@@ -67,10 +437,14 @@ class WorkbookDatasource(Stream):
                 updated_at=context['updated_at'],
                 datasource=ds
             )
+            record['site_id'] = context['site_id']
+            record['id_scheme'] = context['id_scheme']
             child_context = {
+                'site_id': context['site_id'],
                 'workbook_id': context['workbook_id'],
                 'datasource_id': record['id'],
                 'updated_at': context['updated_at'],
+                'id_scheme': context['id_scheme'],
                 'connections': connections
             }
             yield (record, child_context)
@@ -98,11 +472,15 @@ class WorkbookConnection(Stream):
             )
             # One Connection can contain many 'named connection' records
             for record, relation in connections:
+                record['site_id'] = context['site_id']
+                record['id_scheme'] = context['id_scheme']
                 child_context = {
+                    'site_id': context['site_id'],
                     'workbook_id': context['workbook_id'],
                     'datasource_id': context['datasource_id'],
                     'connection_id': record['id'],
                     'updated_at': context['updated_at'],
+                    'id_scheme': context['id_scheme'],
                     'relation': relation
                 }
                 yield (record, child_context)
@@ -130,6 +508,8 @@ class WorkbookRelation(Stream):
         # One Relation block can contain many Relations
         if relations:
             for record in relations:
+                record['site_id'] = context['site_id']
+                record['id_scheme'] = context['id_scheme']
                 yield (record, record)
 
 
@@ -150,4 +530,6 @@ class WorkbookTableReference(Stream):
             relation=context
         )
         for table_ref in table_references:
+            table_ref['site_id'] = context['site_id']
+            table_ref['id_scheme'] = context['id_scheme']
             yield table_ref
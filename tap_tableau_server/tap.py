@@ -2,11 +2,23 @@
 
 from typing import List
 
+import sqlfluff
 from singer_sdk import Tap, Stream
 from singer_sdk import typing as th  # JSON schema typing helpers
 
+from tap_tableau_server.cache import (
+    DefinitionCache, TableReferenceCache, WorkbookCache, WorkbookIdsCache
+)
 from tap_tableau_server.client import TableauServerClient
+from tap_tableau_server.async_client import (
+    AIOHTTP_RETRYABLE_EXCEPTIONS, AsyncTableauServerClient
+)
 from tap_tableau_server.local_workbook_extractor import LocalWorkbookExtractor
+from tap_tableau_server.metrics import metrics
+from tap_tableau_server.profiling import SyncProfiler
+from tap_tableau_server.throttling import (
+    RETRYABLE_EXCEPTIONS, Throttle, TokenBucket, RetryPolicy, CircuitBreaker
+)
 from tap_tableau_server.streams import (
     WorkbookIds, Workbook, WorkbookDatasource, WorkbookConnection,
     WorkbookRelation, WorkbookTableReference
@@ -28,37 +40,246 @@ class TapTableauServer(Tap):
         th.Property("username", th.StringType, required=True),
         th.Property("password", th.StringType, required=True),
         th.Property("site_id", th.StringType, default=None),
+        th.Property("sites", th.ArrayType(th.StringType)),
+        th.Property("partition_by_project", th.BooleanType, default=False),
+        th.Property("partition_prefetch", th.IntegerType, default=1),
+        th.Property("checkpoint_every_n_workbooks", th.IntegerType, default=50),
         th.Property("limit", th.IntegerType),
+        th.Property("workbook_ids_mode", th.StringType, default="snapshot"),
+        th.Property("workbook_ids_snapshot_every_n_runs", th.IntegerType, default=10),
+        th.Property("workbook_ids_cache_dir", th.StringType),
+        th.Property("client_backend", th.StringType, default="tsc"),
+        th.Property("max_concurrent_downloads", th.IntegerType, default=1),
+        th.Property("max_connections", th.IntegerType, default=100),
+        th.Property("max_requests_per_second", th.NumberType),
+        th.Property("max_retries", th.IntegerType, default=3),
+        th.Property("retry_budget", th.IntegerType, default=100),
+        th.Property("circuit_breaker_threshold", th.IntegerType, default=5),
+        th.Property("circuit_breaker_reset_seconds", th.NumberType, default=30),
+        th.Property("extraction_backend", th.StringType, default="download"),
+        th.Property("metadata_batch_size", th.IntegerType, default=100),
+        th.Property("metadata_download_fallback", th.BooleanType, default=False),
+        th.Property("extraction_engine", th.StringType, default="documentapi"),
+        th.Property("download_mode", th.StringType, default="disk"),
+        th.Property("download_spill_mb", th.IntegerType, default=64),
+        th.Property("max_download_mb", th.IntegerType),
+        th.Property("workbook_cache_dir", th.StringType),
+        th.Property("workbook_cache_max_mb", th.IntegerType, default=1024),
+        th.Property("workbook_cache_warm_dir", th.StringType),
+        th.Property("metrics_prometheus_file", th.StringType),
+        th.Property("slow_workbook_log_size", th.IntegerType, default=10),
+        th.Property("profile_output_dir", th.StringType),
+        th.Property("profile_every_n_workbooks", th.IntegerType, default=1),
+        th.Property("profile_sample_interval_ms", th.NumberType, default=5),
         th.Property("relation_types_include", th.ArrayType(th.StringType)),
         th.Property("relation_types_exclude", th.ArrayType(th.StringType)),
+        th.Property("definition_cache_size", th.IntegerType, default=4096),
+        th.Property("sql_cache_size", th.IntegerType, default=4096),
+        th.Property("sql_cache_dir", th.StringType),
+        th.Property("sql_cache_max_mb", th.IntegerType, default=100),
+        th.Property("sql_parse_processes", th.IntegerType, default=0),
+        th.Property("sql_parse_timeout", th.IntegerType, default=60),
+        th.Property("table_reference_parser", th.StringType, default="sqlfluff_only"),
     ).to_dict()
     # Private Attrs
-    _tableau_server_client = None
+    _tableau_server_clients = None
+    _throttle = None
+    _workbook_cache = None
+    _workbook_ids_cache = None
     _wbx = None
 
     def discover_streams(self) -> List[Stream]:
         """Return a list of discovered streams."""
         return [stream_class(tap=self) for stream_class in STREAM_TYPES]
 
+    def sync_all(self):
+        """ Sync all streams, then sign out of Tableau Server and report
+        metrics for the run.
+        """
+        metrics.reset()
+        metrics.slow_log_size = self.config.get('slow_workbook_log_size', 10)
+        profiler = None
+        if self.config.get('profile_output_dir'):
+            profiler = SyncProfiler(
+                output_dir=self.config['profile_output_dir'],
+                every_n_workbooks=self.config.get('profile_every_n_workbooks', 1),
+                sample_interval=self.config.get('profile_sample_interval_ms', 5) / 1000
+            )
+            profiler.instrument(self.streams)
+        try:
+            super().sync_all()
+        finally:
+            if profiler is not None:
+                profiler.write()
+            for client in (self._tableau_server_clients or {}).values():
+                client.log_summary()
+                client.close()
+            if self._throttle is not None:
+                self._throttle.log_stats()
+            if self._workbook_cache is not None:
+                self._workbook_cache.log_stats()
+                self._workbook_cache.close()
+            if self._workbook_ids_cache is not None:
+                self._workbook_ids_cache.close()
+            if self._wbx is not None:
+                self._wbx.log_stats()
+                self._wbx.close()
+            metrics.log()
+            if self.config.get('metrics_prometheus_file'):
+                metrics.write_prometheus(self.config['metrics_prometheus_file'])
+
     @property
-    def client(self):
-        """ Tableau Server Client
+    def site_ids(self) -> List[str]:
+        """ Content URLs of the sites to sync ('' is the Default site).
+        """
+        return self.config.get('sites') or [self.config.get('site_id') or '']
+
+    @property
+    def throttle(self):
+        """ Rate limits and retries, shared by every site's client
+        """
+        if self._throttle is None:
+            self._throttle = Throttle(
+                bucket=TokenBucket(rate=self.config.get('max_requests_per_second')),
+                policy=RetryPolicy(
+                    max_retries=self.config.get('max_retries', 3),
+                    retry_budget=self.config.get('retry_budget', 100),
+                    # Whichever client_backend the sites' clients use
+                    retry_on=RETRYABLE_EXCEPTIONS + AIOHTTP_RETRYABLE_EXCEPTIONS
+                ),
+                breaker=CircuitBreaker(
+                    failure_threshold=self.config.get('circuit_breaker_threshold', 5),
+                    reset_timeout=self.config.get('circuit_breaker_reset_seconds', 30)
+                )
+            )
+        return self._throttle
+
+    @property
+    def workbook_cache(self):
+        """ Workbook cache, shared by every site's client
+        """
+        if self._workbook_cache is None and self.config.get('workbook_cache_dir'):
+            self._workbook_cache = WorkbookCache(
+                cache_dir=self.config['workbook_cache_dir'],
+                max_bytes=self.config.get('workbook_cache_max_mb', 1024) * 1024 * 1024
+            )
+        return self._workbook_cache
+
+    @property
+    def workbook_ids_cache(self):
+        """ Cache of each site's Workbook IDs, for the incremental
+        `workbook_ids` stream
+        """
+        cache_dir = (
+            self.config.get('workbook_ids_cache_dir')
+            or self.config.get('workbook_cache_dir')
+        )
+        if self._workbook_ids_cache is None and cache_dir:
+            self._workbook_ids_cache = WorkbookIdsCache(cache_dir=cache_dir)
+        return self._workbook_ids_cache
+
+    @property
+    def max_download_bytes(self):
+        """ Largest Workbook download allowed, if any
+        """
+        max_download_mb = self.config.get('max_download_mb')
+        return max_download_mb * 1024 * 1024 if max_download_mb else None
+
+    @property
+    def download_spill_bytes(self):
+        """ Size of in-memory download over which it spills to a temporary file
         """
-        if self._tableau_server_client is None:
-            self._tableau_server_client = TableauServerClient(
+        return self.config.get('download_spill_mb', 64) * 1024 * 1024
+
+    def create_client(self, site_id):
+        """ Create a client signed in to one site.
+        """
+        client_backend = self.config.get('client_backend', 'tsc')
+        if client_backend == 'async':
+            return AsyncTableauServerClient(
+                host=self.config['host'],
+                username=self.config['username'],
+                password=self.config['password'],
+                site_id=site_id,
+                max_concurrent_downloads=self.config.get('max_concurrent_downloads', 1),
+                max_connections=self.config.get('max_connections', 100),
+                download_spill_bytes=self.download_spill_bytes,
+                max_download_bytes=self.max_download_bytes,
+                workbook_cache=self.workbook_cache,
+                workbook_cache_warm_dir=self.config.get('workbook_cache_warm_dir'),
+                throttle=self.throttle,
+                extraction_backend=self.config.get('extraction_backend', 'download'),
+                metadata_batch_size=self.config.get('metadata_batch_size', 100),
+                metadata_download_fallback=self.config.get(
+                    'metadata_download_fallback', False
+                )
+            )
+        elif client_backend == 'tsc':
+            return TableauServerClient(
                 host=self.config['host'],
                 username=self.config['username'],
-                password=self.config['password']
+                password=self.config['password'],
+                site_id=site_id,
+                max_concurrent_downloads=self.config.get('max_concurrent_downloads', 1),
+                extraction_engine=self.config.get('extraction_engine', 'documentapi'),
+                download_mode=self.config.get('download_mode', 'disk'),
+                download_spill_bytes=self.download_spill_bytes,
+                max_download_bytes=self.max_download_bytes,
+                workbook_cache=self.workbook_cache,
+                workbook_cache_warm_dir=self.config.get('workbook_cache_warm_dir'),
+                throttle=self.throttle,
+                extraction_backend=self.config.get('extraction_backend', 'download'),
+                metadata_batch_size=self.config.get('metadata_batch_size', 100),
+                metadata_download_fallback=self.config.get(
+                    'metadata_download_fallback', False
+                )
+            )
+        else:
+            raise ValueError(
+                f"Unknown client_backend '{client_backend}'. "
+                "Expected one of ['tsc', 'async']."
             )
-        return self._tableau_server_client
+
+    @property
+    def clients(self):
+        """ Tableau Server Clients, by site ID
+        """
+        if self._tableau_server_clients is None:
+            self._tableau_server_clients = {
+                site_id: self.create_client(site_id) for site_id in self.site_ids
+            }
+        return self._tableau_server_clients
+
+    @property
+    def client(self):
+        """ Tableau Server Client of the first site
+        """
+        return next(iter(self.clients.values()))
 
     @property
     def wbx(self):
         """ Workbook Extractor
         """
         if self._wbx is None:
+            table_reference_parser = self.config.get(
+                'table_reference_parser', 'sqlfluff_only'
+            )
+            definition_cache_size = self.config.get('definition_cache_size', 4096)
             self._wbx = LocalWorkbookExtractor(
                 relation_types_exclude=self.config.get('relation_types_exclude', []),
-                relation_types_include=self.config.get('relation_types_include', [])
+                relation_types_include=self.config.get('relation_types_include', []),
+                sql_cache=TableReferenceCache(
+                    maxsize=self.config.get('sql_cache_size', 4096),
+                    cache_dir=self.config.get('sql_cache_dir'),
+                    max_bytes=self.config.get('sql_cache_max_mb', 100) * 1024 * 1024,
+                    version=f"{sqlfluff.__version__}/{table_reference_parser}"
+                ),
+                table_reference_parser=table_reference_parser,
+                sql_parse_processes=self.config.get('sql_parse_processes', 0),
+                sql_parse_timeout=self.config.get('sql_parse_timeout', 60),
+                definition_cache=(
+                    DefinitionCache(maxsize=definition_cache_size)
+                    if definition_cache_size else None
+                )
             )
         return self._wbx
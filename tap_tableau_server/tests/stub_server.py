@@ -0,0 +1,388 @@
+"""A stub Tableau Server speaking the REST endpoints the tap uses.
+
+Serves sign in/out, paged project listings, paged Workbook listings (sorted
+by `updatedAt`, filtered by `updatedAt` and `projectName`), single Workbooks
+and Workbook downloads from an in-memory list of Workbooks, with optional
+latency and error injection. Metadata API queries for Workbooks and custom
+SQL tables are answered from in-memory results.
+"""
+
+import re
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+from datetime import timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import quoteattr
+
+NAMESPACE = 'http://tableau.com/api'
+SITE_LUID = 'a1b2c3d4-0000-0000-0000-000000000001'
+PROJECT_ID = 'a1b2c3d4-0000-0000-0000-0000000000aa'
+
+SIGNIN_RE = re.compile(r'^/api/[\d.]+/auth/signin$')
+SIGNOUT_RE = re.compile(r'^/api/[\d.]+/auth/signout$')
+WORKBOOKS_RE = re.compile(r'^/api/[\d.]+/sites/(?P<site>[^/]+)/workbooks$')
+WORKBOOK_RE = re.compile(r'^/api/[\d.]+/sites/(?P<site>[^/]+)/workbooks/(?P<id>[^/]+)$')
+PROJECTS_RE = re.compile(r'^/api/[\d.]+/sites/(?P<site>[^/]+)/projects$')
+METADATA_PATH = '/api/metadata/graphql'
+CONTENT_RE = re.compile(
+    r'^/api/[\d.]+/sites/(?P<site>[^/]+)/workbooks/(?P<id>[^/]+)/content$'
+)
+# (method, path pattern, handler method) of each endpoint
+ROUTES = [
+    ('POST', SIGNIN_RE, 'sign_in'),
+    ('POST', SIGNOUT_RE, 'sign_out'),
+    ('POST', re.compile(f'^{re.escape(METADATA_PATH)}$'), 'query_metadata'),
+    ('GET', PROJECTS_RE, 'list_projects'),
+    ('GET', WORKBOOKS_RE, 'list_workbooks'),
+    ('GET', WORKBOOK_RE, 'get_workbook'),
+    ('GET', CONTENT_RE, 'download_workbook'),
+]
+
+
+class StubWorkbook:
+    __slots__ = (
+        'id', 'name', 'updated_at', 'content', 'filename', 'project_id', 'project_name'
+    )
+
+    def __init__(
+        self, id, name, updated_at, content, filename=None,
+        project_id=PROJECT_ID, project_name='Default'
+    ):
+        self.id = id
+        self.name = name
+        self.updated_at = updated_at
+        self.content = content
+        self.filename = filename or f"{name}.twbx"
+        self.project_id = project_id
+        self.project_name = project_name
+
+
+def _timestamp(dt):
+    return dt.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _workbook_xml(wb):
+    return (
+        f"<workbook id={quoteattr(wb.id)} name={quoteattr(wb.name)} "
+        f"contentUrl={quoteattr(wb.name)} webpageUrl='http://stub/{wb.id}' "
+        "showTabs='false' size='1' createdAt='2020-01-01T00:00:00Z' "
+        f"updatedAt={quoteattr(_timestamp(wb.updated_at))}>"
+        f"<project id={quoteattr(wb.project_id)} name={quoteattr(wb.project_name)} />"
+        "<owner id='u-1' /><tags /></workbook>"
+    )
+
+
+def _error(code, summary, detail=''):
+    return (
+        f"<tsResponse xmlns={quoteattr(NAMESPACE)}>"
+        f"<error code={quoteattr(code)}><summary>{summary}</summary>"
+        f"<detail>{detail}</detail></error></tsResponse>"
+    ).encode('utf-8')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ Routes requests to one method per endpoint of the StubTableauServer.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def stub(self):
+        return self.server.stub
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        if self.stub._is_signed_in(self.headers.get('x-tableau-auth')):
+            return True
+        self._send(401, _error('401002', 'Unauthorized Access'))
+        return False
+
+    def _failed(self, error_rate, resource_id=None):
+        if not (
+            resource_id in self.stub.failing_ids or self.stub._should_fail(error_rate)
+        ):
+            return False
+        self.stub._count('error')
+        headers = {}
+        if self.stub.retry_after is not None:
+            headers['Retry-After'] = str(self.stub.retry_after)
+        self._send(503, b'Service Unavailable', headers=headers)
+        return True
+
+    def _route(self, method, body=b''):
+        time.sleep(self.stub.latency)
+        url = urlparse(self.path)
+        for route_method, pattern, handler in ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                getattr(self, handler)(match, parse_qs(url.query), body)
+                return
+        self._send(404, _error('404000', 'Not Found'))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self._route('POST', self.rfile.read(length))
+
+    def do_GET(self):
+        self._route('GET')
+
+    def sign_in(self, match, query, body):
+        self.stub._count('signin')
+        self._send(200, self.stub._sign_in())
+
+    def sign_out(self, match, query, body):
+        self.stub._count('signout')
+        if not self._authorized():
+            return
+        self.stub._sign_out(self.headers.get('x-tableau-auth'))
+        self._send(204)
+
+    def query_metadata(self, match, query, body):
+        if not self._authorized():
+            return
+        self.stub._count('metadata')
+        response = self.stub._query_metadata(json.loads(body))
+        self._send(200, json.dumps(response).encode('utf-8'), headers={
+            'Content-Type': 'application/json'
+        })
+
+    def list_projects(self, match, query, body):
+        if not self._authorized():
+            return
+        self.stub._count('projects')
+        self._send(200, self.stub._list_projects(query))
+
+    def list_workbooks(self, match, query, body):
+        if not self._authorized() or self._failed(self.stub.list_error_rate):
+            return
+        self.stub._count('list')
+        self._send(200, self.stub._list_workbooks(query))
+
+    def get_workbook(self, match, query, body):
+        if not self._authorized():
+            return
+        self.stub._count('get')
+        workbook = self.stub._find_workbook(match.group('id'))
+        if workbook is None:
+            self._send(404, _error('404006', 'Resource Not Found'))
+            return
+        self._send(200, (
+            f"<tsResponse xmlns={quoteattr(NAMESPACE)}>"
+            f"{_workbook_xml(workbook)}</tsResponse>"
+        ).encode('utf-8'))
+
+    def download_workbook(self, match, query, body):
+        if not self._authorized() or self._failed(
+            self.stub.error_rate, match.group('id')
+        ):
+            return
+        self.stub._count('download')
+        if query.get('includeExtract') != ['False']:
+            self.stub._count('download_with_extract')
+        workbook = self.stub._find_workbook(match.group('id'))
+        if workbook is None:
+            self._send(404, _error('404006', 'Resource Not Found'))
+            return
+        with self.stub._in_flight('download'):
+            time.sleep(self.stub.download_latency)
+            self._send(200, workbook.content, headers={
+                'Content-Type': 'application/octet-stream',
+                'Content-Disposition': f'attachment; filename="{workbook.filename}"'
+            })
+
+
+class StubTableauServer:
+    """ Run with `with StubTableauServer(workbooks) as server:`, and point a
+    client at `server.url`.
+
+    `latency` seconds are added to every response, and `download_latency`
+    more to downloads, whose most concurrent number is kept in
+    `max_in_flight['download']`. The `(pageNumber, pageSize)` of every
+    Workbook listing is kept in `workbook_pages`. A fraction `error_rate`
+    of downloads and `list_error_rate` of listings fail with a 503 (with a
+    `Retry-After` header, if `retry_after` is set), as do all downloads of
+    the Workbooks in `failing_ids`.
+
+    `metadata` is a dict of Metadata API `workbooks` (a list of Workbook
+    results) and `custom_sql_tables` (a list of custom SQL table nodes). If
+    it is not set, Metadata API queries are answered with an error.
+    """
+
+    def __init__(
+        self, workbooks, latency=0.0, error_rate=0.0, list_error_rate=0.0,
+        retry_after=None, seed=0, metadata=None, download_latency=0.0
+    ):
+        self.workbooks = sorted(workbooks, key=lambda wb: wb.updated_at)
+        self.metadata = metadata
+        self.latency = latency
+        self.download_latency = download_latency
+        self.error_rate = error_rate
+        self.list_error_rate = list_error_rate
+        self.retry_after = retry_after
+        self.failing_ids = set()
+        self.requests = {}
+        self.in_flight = {}
+        self.workbook_pages = []
+        self.max_in_flight = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = set()
+        self._httpd = _ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._httpd.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def sessions(self):
+        """ Number of sessions signed in and not yet signed out or expired.
+        """
+        with self._lock:
+            return len(self._tokens)
+
+    def expire_tokens(self):
+        """ Invalidate every session, as if they had timed out.
+        """
+        with self._lock:
+            self._tokens.clear()
+
+    def _count(self, kind):
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    @contextmanager
+    def _in_flight(self, kind):
+        with self._lock:
+            self.in_flight[kind] = self.in_flight.get(kind, 0) + 1
+            self.max_in_flight[kind] = max(
+                self.max_in_flight.get(kind, 0), self.in_flight[kind]
+            )
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight[kind] -= 1
+
+    def _should_fail(self, error_rate):
+        with self._lock:
+            return self._random.random() < error_rate
+
+    def _sign_in(self):
+        with self._lock:
+            token = f"token-{len(self._tokens)}-{self._random.random():.12f}"
+            self._tokens.add(token)
+        return (
+            f"<tsResponse xmlns={quoteattr(NAMESPACE)}>"
+            f"<credentials token={quoteattr(token)}>"
+            f"<site id={quoteattr(SITE_LUID)} contentUrl='' />"
+            "<user id='u-1' /></credentials></tsResponse>"
+        ).encode('utf-8')
+
+    def _sign_out(self, token):
+        with self._lock:
+            self._tokens.discard(token)
+
+    def _is_signed_in(self, token):
+        with self._lock:
+            return token in self._tokens
+
+    def _find_workbook(self, workbook_id):
+        return next((wb for wb in self.workbooks if wb.id == workbook_id), None)
+
+    def _list_workbooks(self, query):
+        page_size = int(query.get('pageSize', ['100'])[0])
+        page_number = int(query.get('pageNumber', ['1'])[0])
+        with self._lock:
+            self.workbook_pages.append((page_number, page_size))
+        workbooks = self.workbooks
+        filters = [f for value in query.get('filter', []) for f in value.split(',')]
+        for f in filters:
+            field, operator, value = f.split(':', 2)
+            if field == 'updatedAt' and operator == 'gte':
+                workbooks = [
+                    wb for wb in workbooks if _timestamp(wb.updated_at) >= value
+                ]
+            elif field == 'projectName' and operator == 'eq':
+                workbooks = [wb for wb in workbooks if wb.project_name == value]
+        page = workbooks[(page_number - 1) * page_size:page_number * page_size]
+        items = "".join(_workbook_xml(wb) for wb in page)
+        return (
+            f"<tsResponse xmlns={quoteattr(NAMESPACE)}>"
+            f"<pagination pageNumber='{page_number}' pageSize='{page_size}' "
+            f"totalAvailable='{len(workbooks)}' />"
+            f"<workbooks>{items}</workbooks></tsResponse>"
+        ).encode('utf-8')
+
+    def _list_projects(self, query):
+        page_size = int(query.get('pageSize', ['100'])[0])
+        page_number = int(query.get('pageNumber', ['1'])[0])
+        projects = sorted({(wb.project_id, wb.project_name) for wb in self.workbooks})
+        page = projects[(page_number - 1) * page_size:page_number * page_size]
+        items = "".join(
+            f"<project id={quoteattr(id)} name={quoteattr(name)} "
+            "contentPermissions='ManagedByOwner'><owner id='u-1' /></project>"
+            for id, name in page
+        )
+        return (
+            f"<tsResponse xmlns={quoteattr(NAMESPACE)}>"
+            f"<pagination pageNumber='{page_number}' pageSize='{page_size}' "
+            f"totalAvailable='{len(projects)}' />"
+            f"<projects>{items}</projects></tsResponse>"
+        ).encode('utf-8')
+
+    def _query_metadata(self, request):
+        if self.metadata is None:
+            return {'data': None, 'errors': [{'message': 'Metadata API is disabled'}]}
+        query, variables = request['query'], request.get('variables') or {}
+        if 'customSQLTablesConnection' in query:
+            tables = self.metadata.get('custom_sql_tables', [])
+            start = int(variables.get('afterToken') or 0)
+            end = start + int(variables.get('first') or 100)
+            return {'data': {'customSQLTablesConnection': {
+                'nodes': tables[start:end],
+                'pageInfo': {'hasNextPage': end < len(tables), 'endCursor': str(end)},
+            }}}
+        if 'workbooks' in query:
+            luids = set(variables.get('luids') or [])
+            return {'data': {'workbooks': [
+                wb for wb in self.metadata.get('workbooks', []) if wb['luid'] in luids
+            ]}}
+        return {'data': None, 'errors': [{'message': 'Unsupported query'}]}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
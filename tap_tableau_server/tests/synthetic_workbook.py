@@ -0,0 +1,166 @@
+"""Generate synthetic Tableau workbook (.twb/.twbx) files for tests and benchmarks.
+
+Also builds the WorkbookItems and stub server Workbooks tests share.
+"""
+
+import io
+import datetime
+import zipfile
+from types import SimpleNamespace
+from xml.sax.saxutils import escape, quoteattr
+
+from tap_tableau_server.local_workbook import WORKBOOKITEM_EXTRACT_ATTRS
+from tap_tableau_server.tests.stub_server import StubWorkbook
+
+START = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+CONNECTION_CLASSES = ['snowflake', 'postgres', 'sqlserver', 'redshift']
+COLUMN_ATTRS = "datatype='integer' role='measure' type='quantitative'"
+
+
+def _custom_sql(ds, size):
+    tables = [f"schema_{ds}.table_{i}" for i in range(max(size, 1))]
+    sql = f"SELECT t0.id, t0.value FROM {tables[0]} t0"
+    for i, table in enumerate(tables[1:], start=1):
+        sql += f"\nLEFT JOIN {table} t{i} ON t{i}.id = t0.id"
+    return sql + "\nWHERE t0.value >> 0"
+
+
+def _join_relation(conn_name, ds, depth, leaf=0):
+    if depth <= 0:
+        return (
+            f"<relation connection={quoteattr(conn_name)} name='table_{ds}_{leaf}' "
+            f"table='[schema_{ds}].[table_{leaf}]' type='table' />"
+        )
+    left = _join_relation(conn_name, ds, depth - 1, leaf * 2)
+    right = _join_relation(conn_name, ds, depth - 1, leaf * 2 + 1)
+    return (
+        "<relation join='inner' type='join'>"
+        "<clause type='join'><expression op='='/></clause>"
+        f"{left}{right}</relation>"
+    )
+
+
+def _datasource(ds, named_connections, join_depth, custom_sql_size):
+    conns = []
+    for nc in range(named_connections):
+        conn_class = CONNECTION_CLASSES[(ds + nc) % len(CONNECTION_CLASSES)]
+        conns.append((f"{conn_class}.{ds:04x}{nc:04x}", conn_class))
+    named = "".join(
+        f"<named-connection caption='host-{i}.example.com' name={quoteattr(name)}>"
+        f"<connection authentication='Username Password' class={quoteattr(conn_class)} "
+        f"dbname='DB_{ds}' port='443' server='host-{i}.example.com' "
+        f"username='user_{ds}' one-time-sql='' />"
+        "</named-connection>"
+        for i, (name, conn_class) in enumerate(conns)
+    )
+    if custom_sql_size:
+        relation = (
+            f"<relation connection={quoteattr(conns[0][0])} name='Custom SQL Query' "
+            f"type='text'>{escape(_custom_sql(ds, custom_sql_size))}</relation>"
+        )
+    else:
+        relation = _join_relation(conns[0][0], ds, join_depth)
+    return (
+        f"<datasource caption='Datasource {ds}' inline='true' "
+        f"name='federated.{ds:08x}' version='18.1'>"
+        f"<connection class='federated'><named-connections>{named}</named-connections>"
+        f"{relation}</connection>"
+        + "".join(
+            f"<column name='[col_{c}]' {COLUMN_ATTRS} />" for c in range(10)
+        )
+        + "</datasource>"
+    )
+
+
+def _datasource_dependencies(ds):
+    columns = "".join(
+        f"<column name='[col_{c}]' {COLUMN_ATTRS} />"
+        f"<column-instance column='[col_{c}]' derivation='Sum' "
+        f"name='[sum:col_{c}:qk]' />"
+        for c in range(10)
+    )
+    return (
+        f"<datasource-dependencies datasource='federated.{ds:08x}'>"
+        f"{columns}</datasource-dependencies>"
+    )
+
+
+def _worksheet(ws, datasources):
+    return (
+        f"<worksheet name='Sheet {ws}'><table><view><datasources>"
+        + "".join(
+            f"<datasource caption='Datasource {ds}' name='federated.{ds:08x}' />"
+            for ds in range(datasources)
+        )
+        + "</datasources>"
+        + "".join(_datasource_dependencies(ds) for ds in range(datasources))
+        + "</view></table></worksheet>"
+    )
+
+
+def synthetic_workbook_xml(
+    datasources=2, named_connections=2, join_depth=1, custom_sql_size=0,
+    custom_sql_every=2, worksheets=5
+):
+    """ Return the XML of a synthetic .twb file.
+
+    Every `custom_sql_every`-th datasource uses a Custom SQL relation joining
+    `custom_sql_size` tables (if `custom_sql_size` is non-zero); the others
+    use a tree of joins `join_depth` levels deep.
+    """
+    parts = [
+        "<?xml version='1.0' encoding='utf-8' ?>"
+        "<workbook source-build='2020.4.0 (20204.20.1116.1810)' "
+        "source-platform='mac' version='18.1'>"
+        "<datasources>"
+        "<datasource hasconnection='false' inline='true' name='Parameters' "
+        "version='18.1'>"
+        "<aliases enabled='yes' /></datasource>"
+    ]
+    for ds in range(datasources):
+        sql_size = (
+            custom_sql_size
+            if custom_sql_every and (ds % custom_sql_every == 0) else 0
+        )
+        parts.append(_datasource(ds, named_connections, join_depth, sql_size))
+    parts.append("</datasources><worksheets>")
+    parts.extend(_worksheet(ws, datasources) for ws in range(worksheets))
+    parts.append("</worksheets></workbook>")
+    return "".join(parts)
+
+
+def synthetic_twbx_bytes(twb_xml, name='Workbook', extract_bytes=0):
+    """ Package .twb XML as a .twbx archive, optionally with a dummy extract.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(f"{name}.twb", twb_xml)
+        if extract_bytes:
+            archive.writestr('Data/Extracts/extract.hyper', b'\0' * extract_bytes)
+    return buffer.getvalue()
+
+
+def make_workbook_item(workbook_id='wb-1'):
+    """ A stand-in for a WorkbookItem, with the attributes the extractor reads.
+    """
+    item = SimpleNamespace(**{attr: None for attr in WORKBOOKITEM_EXTRACT_ATTRS})
+    item.id = workbook_id
+    item.name = 'Synthetic Workbook'
+    item.updated_at = START
+    return item
+
+
+def stub_workbooks(n=25):
+    """ `n` .twbx Workbooks for a StubTableauServer, updated in shuffled order.
+    """
+    return [
+        StubWorkbook(
+            id=f"wb-{i:03d}", name=f"Workbook{i}",
+            updated_at=START + datetime.timedelta(hours=(i * 7) % n),
+            content=synthetic_twbx_bytes(
+                synthetic_workbook_xml(datasources=i % 3 + 1, custom_sql_size=2),
+                name=f"Workbook{i}"
+            )
+        )
+        for i in range(n)
+    ]
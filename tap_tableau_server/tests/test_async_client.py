@@ -0,0 +1,72 @@
+"""Tests the async client against a stub Tableau Server."""
+
+import datetime
+
+import pytest
+
+from tap_tableau_server.client import TableauServerClient
+from tap_tableau_server.local_workbook_extractor import LocalWorkbookExtractor
+from tap_tableau_server.tests.stub_server import StubTableauServer
+from tap_tableau_server.tests.synthetic_workbook import START, stub_workbooks
+
+pytest.importorskip('aiohttp')
+from tap_tableau_server.async_client import AsyncTableauServerClient  # noqa: E402
+
+
+@pytest.fixture
+def stub():
+    with StubTableauServer(stub_workbooks()) as server:
+        yield server
+
+
+def make_async_client(stub):
+    return AsyncTableauServerClient(
+        stub.url, 'user', 'password', max_concurrent_downloads=8
+    )
+
+
+def test_async_client_matches_sync_client(stub):
+    """Both clients yield the same Workbooks, in the same order."""
+    wbx = LocalWorkbookExtractor(table_reference_parser='fast')
+    sync_client = TableauServerClient(
+        stub.url, 'user', 'password', extraction_engine='streaming',
+        download_mode='memory'
+    )
+    async_client = make_async_client(stub)
+    try:
+        expected = [wbx.extract_all(lwb) for lwb in sync_client.get_workbooks(None)]
+        actual = [wbx.extract_all(lwb) for lwb in async_client.get_workbooks(None)]
+    finally:
+        sync_client.close()
+        async_client.close()
+    assert len(actual) == 25
+    assert actual == expected
+    updated = [r.workbooks[0]['updated_at'] for r in actual]
+    assert updated == sorted(updated)
+
+
+def test_async_client_checkpoint_and_limit(stub):
+    client = make_async_client(stub)
+    try:
+        checkpoint = START + datetime.timedelta(hours=20)
+        ids = list(client.list_workbook_ids(checkpoint=checkpoint))
+        assert ids == [
+            wb.id for wb in stub.workbooks if wb.updated_at >= checkpoint
+        ]
+        lwbs = list(client.get_workbooks(None, limit=3))
+        assert [lwb.id for lwb in lwbs] == [wb.id for wb in stub.workbooks[:3]]
+        assert stub.requests['download'] == 3
+    finally:
+        client.close()
+    assert stub.requests['signout'] == 1
+
+
+def test_async_client_signs_in_again_on_401(stub):
+    client = make_async_client(stub)
+    try:
+        assert len(client.list_all_workbook_ids()) == 25
+        stub.expire_tokens()
+        assert len(list(client.get_workbooks(None, limit=10))) == 10
+    finally:
+        client.close()
+    assert stub.requests['signin'] == 2
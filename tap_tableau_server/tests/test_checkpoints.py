@@ -0,0 +1,75 @@
+"""Tests resuming from a bookmark without syncing Workbooks twice."""
+
+import datetime
+import importlib.util
+
+import pytest
+
+from tap_tableau_server.async_client import AsyncTableauServerClient
+from tap_tableau_server.client import TableauServerClient
+from tap_tableau_server.tests.stub_server import StubTableauServer
+from tap_tableau_server.tests.synthetic_workbook import stub_workbooks
+from tap_tableau_server.throttling import Throttle, RetryPolicy
+
+requires_aiohttp = pytest.mark.skipif(
+    importlib.util.find_spec('aiohttp') is None, reason="aiohttp is not installed"
+)
+
+
+def test_workbooks_synced_at_checkpoint_are_skipped():
+    workbooks = stub_workbooks(6)
+    checkpoint = workbooks[0].updated_at
+    # Three Workbooks share the checkpoint's second, two of which were synced
+    for wb in workbooks[1:3]:
+        wb.updated_at = checkpoint
+    with StubTableauServer(workbooks) as stub:
+        client = TableauServerClient(stub.url, 'user', 'password')
+        try:
+            listed = [
+                wbi.id for wbi in client.list_workbooks(
+                    checkpoint=checkpoint.isoformat(), limit=3,
+                    skip_ids=[workbooks[0].id, workbooks[1].id]
+                )
+            ]
+            assert workbooks[0].id not in listed
+            assert workbooks[1].id not in listed
+            assert workbooks[2].id in listed
+            # Skipped Workbooks do not count towards the limit
+            assert len(listed) == 3
+            # A skipped Workbook that has since been updated is synced again
+            workbooks[0].updated_at = checkpoint + datetime.timedelta(days=1)
+            listed = [
+                wbi.id for wbi in client.list_workbooks(
+                    checkpoint=checkpoint, skip_ids=[workbooks[0].id, workbooks[1].id]
+                )
+            ]
+            assert workbooks[0].id in listed
+            assert workbooks[1].id not in listed
+        finally:
+            client.close()
+
+
+@pytest.mark.parametrize('client_class, kwargs', [
+    (TableauServerClient, {'extraction_engine': 'streaming'}),
+    pytest.param(AsyncTableauServerClient, {}, marks=requires_aiohttp),
+])
+def test_failed_workbooks_are_retried_by_id(client_class, kwargs):
+    workbooks = stub_workbooks(4)
+    with StubTableauServer(workbooks) as stub:
+        client = client_class(
+            stub.url, 'user', 'password',
+            throttle=Throttle(policy=RetryPolicy(max_retries=0)), **kwargs
+        )
+        try:
+            stub.error_rate = 1.0
+            assert list(client.get_workbooks_by_id([workbooks[1].id])) == []
+            assert [wbi.id for wbi, _ in client.failed_workbooks] == [workbooks[1].id]
+            stub.error_rate = 0.0
+            retried = client.get_workbooks_by_id(
+                [workbooks[3].id, 'deleted', workbooks[1].id]
+            )
+            # In the order asked for, leaving out deleted Workbooks
+            assert [lwb.id for lwb in retried] == [workbooks[3].id, workbooks[1].id]
+            assert len(client.failed_workbooks) == 1
+        finally:
+            client.close()
@@ -0,0 +1,74 @@
+"""Tests the tableauserverclient-based client against a stub Tableau Server."""
+
+import os
+
+import pytest
+
+from tap_tableau_server.client import MAX_PAGE_SIZE, TableauServerClient
+from tap_tableau_server.tests.stub_server import StubTableauServer
+from tap_tableau_server.tests.synthetic_workbook import stub_workbooks
+
+
+@pytest.fixture
+def stub():
+    with StubTableauServer(stub_workbooks(12), download_latency=0.05) as server:
+        yield server
+
+
+@pytest.fixture
+def client(stub, tmp_path, monkeypatch):
+    # Downloads go to the temp directory
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path))
+    client = TableauServerClient(
+        stub.url, 'user', 'password', max_concurrent_downloads=3,
+        extraction_engine='streaming', download_mode='disk'
+    )
+    yield client
+    client.close()
+
+
+def test_downloads_are_bounded_and_ordered(stub, client, tmp_path):
+    ids = []
+    for lwb in client.get_workbooks(None):
+        # The Workbook being processed counts towards the bound
+        assert len(os.listdir(tmp_path)) <= 3
+        ids.append(lwb.id)
+    assert ids == [wb.id for wb in stub.workbooks]
+    assert stub.max_in_flight['download'] == 3
+    assert os.listdir(tmp_path) == []
+
+
+def test_early_exit_discards_pending_downloads(stub, client, tmp_path):
+    workbooks = client.get_workbooks(None)
+    assert next(workbooks).id == stub.workbooks[0].id
+    workbooks.close()
+    # Only the downloads in flight were started, and none are left on disk
+    assert stub.requests['download'] == 3
+    assert stub.in_flight['download'] == 0
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('limit, page_size', [
+    (5, 5),
+    (None, 100),
+    (MAX_PAGE_SIZE + 1, MAX_PAGE_SIZE),
+])
+def test_listing_page_size(stub, client, limit, page_size):
+    ids = [wbi.id for wbi in client.list_workbooks(limit=limit)]
+    assert ids == [wb.id for wb in stub.workbooks][:limit]
+    assert stub.workbook_pages == [(1, page_size)]
+
+
+def test_listing_stops_at_limit(stub, client):
+    first = stub.workbooks[0]
+    workbooks = client.list_workbooks(
+        checkpoint=first.updated_at, limit=4, skip_ids=[first.id]
+    )
+    # Pages are only listed as they are consumed
+    assert stub.workbook_pages == []
+    assert next(workbooks).id == stub.workbooks[1].id
+    assert stub.workbook_pages == [(1, 4)]
+    # The Workbook skipped at the checkpoint leaves the first page one short,
+    # and listing stops as soon as the limit is reached on the second
+    assert [wbi.id for wbi in workbooks] == [wb.id for wb in stub.workbooks[2:5]]
+    assert stub.workbook_pages == [(1, 4), (2, 4)]
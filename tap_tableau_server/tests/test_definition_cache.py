@@ -0,0 +1,73 @@
+"""Tests deduplication of connection and relation definitions across Workbooks."""
+
+import io
+
+from tap_tableau_server.cache import DefinitionCache
+from tap_tableau_server.local_workbook import LocalWorkbook
+from tap_tableau_server.local_workbook_extractor import LocalWorkbookExtractor
+from tap_tableau_server.streaming_workbook import parse_workbook
+from tap_tableau_server.tests.synthetic_workbook import (
+    synthetic_workbook_xml, make_workbook_item
+)
+
+
+def workbooks(n, xml):
+    for i in range(n):
+        workbook = parse_workbook(
+            io.BytesIO(xml.encode('utf-8')), filename='Workbook.twb'
+        )
+        yield LocalWorkbook(make_workbook_item(f"wb-{i}"), workbook, on_disk=False)
+
+
+def test_deduplicated_records_match():
+    xml = synthetic_workbook_xml(datasources=4, join_depth=2, custom_sql_size=3)
+    definition_cache = DefinitionCache()
+    plain = LocalWorkbookExtractor(table_reference_parser='fast')
+    deduplicated = LocalWorkbookExtractor(
+        table_reference_parser='fast', definition_cache=definition_cache
+    )
+    distinct = None
+    for expected, actual in zip(
+        (plain.extract_all(lwb) for lwb in workbooks(5, xml)),
+        (deduplicated.extract_all(lwb) for lwb in workbooks(5, xml))
+    ):
+        # Records are rebuilt with each Workbook's IDs
+        assert actual == expected
+        if distinct is None:
+            distinct = dict(definition_cache.misses)
+    # Only the first Workbook's definitions are extracted
+    assert definition_cache.misses == distinct
+    for kind in ('connection', 'relation'):
+        assert definition_cache.dedup_ratio(kind) >= 0.8
+
+
+def test_distinct_definitions_are_not_shared():
+    definition_cache = DefinitionCache()
+    wbx = LocalWorkbookExtractor(
+        table_reference_parser='fast', definition_cache=definition_cache
+    )
+    wbx.extract_all(next(workbooks(1, synthetic_workbook_xml(
+        datasources=2, custom_sql_size=2
+    ))))
+    distinct = definition_cache.misses['relation']
+    second = wbx.extract_all(next(workbooks(1, synthetic_workbook_xml(
+        datasources=2, custom_sql_size=3
+    ))))
+    # The Custom SQL differs, so its Relations are extracted again
+    assert definition_cache.misses['relation'] > distinct
+    assert any(
+        r['text'] and r['text'].count('JOIN') == 2 for r in second.relations
+    )
+
+
+def test_none_definitions_are_cached():
+    definition_cache = DefinitionCache()
+    calls = []
+    for _ in range(3):
+        value = definition_cache.get_or_extract(
+            'connection', ('unsupported',), lambda: calls.append(1)
+        )
+        assert value is None
+    assert len(calls) == 1
+    assert definition_cache.lookups['connection'] == 3
+    assert definition_cache.misses['connection'] == 1
@@ -0,0 +1,82 @@
+"""Tests choosing the SQLFluff dialect of custom SQL."""
+
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from tap_tableau_server import local_workbook_extractor
+from tap_tableau_server.local_workbook_extractor import (
+    DIALECTS, TABLEAU_CLASS_DIALECTS, build_dialect_table, get_linter,
+    infer_dialect, sqlfluff_table_references
+)
+
+
+@pytest.mark.parametrize('connection, dialect', [
+    ('redshift.0h1tdrc1g7qcdo1j0n4ip0vhfwse', 'postgres'),
+    ('Snowflake.1a2b3c', 'snowflake'),
+    ('postgres', 'postgres'),
+    # Not a class with its own dialect
+    ('textscan.0f4ubqf1aeyfxn1bk9gyo0mdx2ab', 'ansi'),
+    ('', 'ansi'),
+    (None, 'ansi'),
+])
+def test_infer_dialect(connection, dialect):
+    assert infer_dialect({'connection': connection}) == dialect
+
+
+def test_classes_map_to_installed_dialects():
+    for conn_class, dialect in TABLEAU_CLASS_DIALECTS.items():
+        expected = dialect if dialect in DIALECTS else 'ansi'
+        assert infer_dialect({'connection': f"{conn_class}.1a2b3c"}) == expected
+
+
+def test_missing_dialects_fall_back_to_ansi(monkeypatch):
+    monkeypatch.setattr(
+        'sqlfluff.dialects',
+        lambda: [SimpleNamespace(label='ansi'), SimpleNamespace(label='postgres')]
+    )
+    table = build_dialect_table()
+    assert table['redshift'] == 'postgres'
+    assert table['ansi'] == 'ansi'
+    assert 'snowflake' not in table
+    monkeypatch.setattr(local_workbook_extractor, 'DIALECTS', table)
+    assert infer_dialect({'connection': 'snowflake.1a2b3c'}) == 'ansi'
+
+
+@pytest.mark.parametrize('sql, dialect, refs', [
+    ("SELECT * FROM public.orders WHERE payload::json->>'id' IS NOT NULL",
+     'postgres', ['public.orders']),
+    ("SELECT * FROM orders o "
+     "QUALIFY ROW_NUMBER() OVER (PARTITION BY o.id ORDER BY o.ts) = 1",
+     'snowflake', ['orders']),
+])
+def test_dialect_specific_sql(sql, dialect, refs):
+    assert sqlfluff_table_references(sql, dialect) == refs
+    # Which ANSI SQL does not parse
+    assert sqlfluff_table_references(sql, 'ansi') is None
+
+
+def test_linters_are_created_once(monkeypatch):
+    created = []
+
+    class Linter:
+        def __init__(self, dialect):
+            # Widen the window for a race
+            time.sleep(0.01)
+            created.append(dialect)
+
+    monkeypatch.setattr(local_workbook_extractor, 'Linter', Linter)
+    monkeypatch.setattr(local_workbook_extractor, '_linters', {})
+    linters = []
+    threads = [
+        threading.Thread(target=lambda: linters.append(get_linter('postgres')))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert created == ['postgres']
+    assert len({id(linter) for linter in linters}) == 1
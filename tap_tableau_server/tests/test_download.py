@@ -0,0 +1,238 @@
+"""Tests extract-free, size-capped and streaming Workbook downloads."""
+
+import io
+import os
+import importlib.util
+import zipfile
+import tempfile
+
+import pytest
+import tableauserverclient as tsc
+
+from tap_tableau_server.async_client import AsyncTableauServerClient
+from tap_tableau_server.client import TableauServerClient
+from tap_tableau_server.download import (
+    DownloadTooLargeError, TwbStreamReader, UnsupportedArchiveError, copy_content,
+    download_workbook_to_buffer, download_workbook_to_file
+)
+from tap_tableau_server.local_workbook_extractor import LocalWorkbookExtractor
+from tap_tableau_server.metrics import metrics
+from tap_tableau_server.session import TableauServerSession
+from tap_tableau_server.tests.stub_server import StubTableauServer
+from tap_tableau_server.tests.synthetic_workbook import (
+    synthetic_workbook_xml, stub_workbooks
+)
+
+requires_aiohttp = pytest.mark.skipif(
+    importlib.util.find_spec('aiohttp') is None, reason="aiohttp is not installed"
+)
+
+TWB_XML = synthetic_workbook_xml(datasources=3, custom_sql_size=2).encode('utf-8')
+
+
+class Unseekable(io.RawIOBase):
+    """ A write-only stream, so zipfile writes data descriptors.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+
+def archive(
+    entries, compression=zipfile.ZIP_DEFLATED, seekable=True, force_zip64=False
+):
+    output = io.BytesIO() if seekable else Unseekable()
+    with zipfile.ZipFile(output, 'w', compression) as zf:
+        for name, data in entries:
+            with zf.open(name, 'w', force_zip64=force_zip64) as f:
+                f.write(data)
+    return bytes(output.getvalue() if seekable else output.data)
+
+
+def read_twb(content, chunk_size=7):
+    output = io.BytesIO()
+    reader = TwbStreamReader(output)
+    fed = 0
+    for i in range(0, len(content), chunk_size):
+        fed += chunk_size
+        if reader.feed(content[i:i + chunk_size]):
+            break
+    reader.close()
+    return output.getvalue(), fed
+
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED])
+@pytest.mark.parametrize('force_zip64', [False, True])
+def test_reads_twb_from_archive(compression, force_zip64):
+    extract = os.urandom(64 * 1024)
+    content = archive([
+        ('Data/Extracts/before.hyper', extract),
+        ('Workbook.twb', TWB_XML),
+        ('Data/Extracts/after.hyper', extract),
+    ], compression=compression, force_zip64=force_zip64)
+    twb, fed = read_twb(content, chunk_size=1024)
+    assert twb == TWB_XML
+    # The download is abandoned once the .twb is read, before the last extract
+    assert fed < len(content) - len(extract) // 2
+
+
+def test_reads_twb_with_data_descriptors():
+    content = archive([
+        ('Data/Extracts/before.hyper', os.urandom(1024)),
+        ('Workbook.twb', TWB_XML),
+    ], seekable=False)
+    assert read_twb(content)[0] == TWB_XML
+
+
+def test_reads_plain_twb():
+    assert read_twb(TWB_XML)[0] == TWB_XML
+
+
+def test_unsupported_and_broken_archives():
+    stored_without_sizes = archive(
+        [('Workbook.twb', TWB_XML)], compression=zipfile.ZIP_STORED, seekable=False
+    )
+    with pytest.raises(UnsupportedArchiveError):
+        read_twb(stored_without_sizes)
+    with pytest.raises(ValueError, match='No .twb'):
+        read_twb(archive([('Data/Extracts/extract.hyper', b'hyper')]))
+    with pytest.raises(zipfile.BadZipFile):
+        content = archive([('Workbook.twb', TWB_XML)])
+        read_twb(content[:len(content) // 2])
+
+
+def test_copy_content_caps_size_while_streaming():
+    chunks = iter([b'<workbook>', b'x' * 100, b'x' * 100, b'</workbook>'])
+    with pytest.raises(DownloadTooLargeError):
+        copy_content(chunks, io.BytesIO(), 'wb-1', max_bytes=150)
+    # Nothing more is read once over the limit
+    assert next(chunks) == b'</workbook>'
+
+
+@pytest.fixture
+def stub():
+    workbooks = stub_workbooks(6)
+    for i, wb in enumerate(workbooks):
+        # Extracts the server should have left out, after the .twb
+        wb.content = archive([
+            (
+                f"{wb.name}.twb",
+                synthetic_workbook_xml(datasources=i % 3 + 1).encode('utf-8')
+            ),
+            ('Data/Extracts/extract.hyper', os.urandom(256 * 1024)),
+        ])
+    with StubTableauServer(workbooks) as server:
+        yield server
+
+
+@pytest.mark.parametrize('download_mode', ['disk', 'memory'])
+def test_downloads_only_twb(stub, tmp_path, download_mode, monkeypatch):
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path))
+    monkeypatch.setattr('tap_tableau_server.download.CHUNK_SIZE', 16 * 1024)
+    metrics.reset()
+    wbx = LocalWorkbookExtractor(table_reference_parser='fast')
+    client = TableauServerClient(
+        stub.url, 'user', 'password', extraction_engine='streaming',
+        download_mode=download_mode
+    )
+    try:
+        records = [wbx.extract_all(lwb) for lwb in client.get_workbooks(None)]
+    finally:
+        client.close()
+    assert len(records) == 6
+    assert all(r.datasources for r in records)
+    assert 'download_with_extract' not in stub.requests
+    downloaded = metrics.all_histograms()['download_bytes'].sum
+    assert downloaded < sum(len(wb.content) for wb in stub.workbooks) / 2
+    # Downloaded files are cleaned up
+    assert os.listdir(str(tmp_path)) == []
+
+
+@pytest.fixture
+def session(stub):
+    session = TableauServerSession(stub.url, tsc.TableauAuth('user', 'password'))
+    yield session
+    session.close()
+
+
+@pytest.mark.parametrize('spill_bytes, rolled', [
+    (64 * 1024 * 1024, False), (1024, True)
+])
+def test_memory_downloads_spill_to_disk(stub, session, spill_bytes, rolled):
+    workbook = stub.workbooks[0]
+    filename, buffer = download_workbook_to_buffer(
+        session.server, workbook.id, spill_bytes=spill_bytes, twb_only=False
+    )
+    with buffer:
+        assert filename == workbook.filename
+        # Only spilled once over `spill_bytes`
+        assert buffer._rolled == rolled
+        assert buffer.read() == workbook.content
+
+
+def truncate_after_twb_header(stub):
+    """ Cut the first Workbook's archive off in the middle of its .twb.
+    """
+    workbook = stub.workbooks[0]
+    workbook.content = archive(
+        [(f"{workbook.name}.twb", TWB_XML)], compression=zipfile.ZIP_STORED
+    )[:len(TWB_XML) // 2]
+    return workbook
+
+
+def test_failed_disk_downloads_are_removed(stub, session, tmp_path):
+    workbook = truncate_after_twb_header(stub)
+    with pytest.raises(zipfile.BadZipFile):
+        download_workbook_to_file(session.server, workbook.id, str(tmp_path))
+    assert os.listdir(str(tmp_path)) == []
+    # Errors from the server are raised as tableauserverclient's
+    with pytest.raises(tsc.ServerResponseError):
+        download_workbook_to_file(session.server, 'missing', str(tmp_path))
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_failed_memory_downloads_are_closed(stub, session, monkeypatch):
+    workbook = truncate_after_twb_header(stub)
+    buffers = []
+
+    class Spooled(tempfile.SpooledTemporaryFile):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            buffers.append(self)
+
+    monkeypatch.setattr('tempfile.SpooledTemporaryFile', Spooled)
+    with pytest.raises(zipfile.BadZipFile):
+        download_workbook_to_buffer(session.server, workbook.id)
+    assert len(buffers) == 1 and buffers[0].closed
+
+
+@pytest.mark.parametrize('client_class, kwargs', [
+    (
+        TableauServerClient,
+        {'extraction_engine': 'streaming', 'download_mode': 'memory'}
+    ),
+    pytest.param(AsyncTableauServerClient, {}, marks=requires_aiohttp),
+])
+def test_oversized_workbooks_are_skipped(stub, client_class, kwargs):
+    stub.workbooks[2].content += os.urandom(1024 * 1024)
+    client = client_class(
+        stub.url, 'user', 'password', max_download_bytes=1024 * 1024, **kwargs
+    )
+    try:
+        workbooks = [lwb.id for lwb in client.get_workbooks(None)]
+    finally:
+        client.close()
+    assert stub.workbooks[2].id not in workbooks
+    assert len(workbooks) == 5
+    assert [(wbi.id, type(e)) for wbi, e in client.failed_workbooks] == [
+        (stub.workbooks[2].id, DownloadTooLargeError)
+    ]
+    # Not retried
+    assert stub.requests['download'] == 6
@@ -0,0 +1,71 @@
+"""Tests the fast table reference extractor against SQLFluff."""
+
+import pytest
+import sqlfluff
+
+from tap_tableau_server.fast_table_references import extract_table_references_fast
+
+# SQL the fast path must handle, and agree with SQLFluff on.
+FAST_PATH_CORPUS = [
+    "SELECT a, b FROM my_table",
+    "select * from schema1.table1 t join schema2.table2 as u on t.id = u.id",
+    "SELECT * FROM db.sch.tbl",
+    "SELECT x FROM a, b, c WHERE a.id = b.id",
+    "SELECT x FROM a LEFT OUTER JOIN b ON a.id = b.id INNER JOIN c ON c.id = b.id",
+    "WITH cte AS (SELECT id FROM base) "
+    "SELECT * FROM cte JOIN other ON cte.id = other.id",
+    "with a as (select 1 as x from t1), b as (select x from a) "
+    "select * from b join t2 on b.x = t2.x",
+    "WITH x AS (SELECT 1 FROM y) SELECT * FROM X",
+    "SELECT * FROM (SELECT id FROM inner_tbl) sub JOIN outer_tbl o ON o.id = sub.id",
+    "SELECT a FROM (SELECT a FROM (SELECT a FROM deep) d1) d2",
+    "SELECT * FROM t1 JOIN (SELECT * FROM t2) x USING (id)",
+    "SELECT id FROM t1 UNION ALL SELECT id FROM t2",
+    "SELECT a FROM t1 EXCEPT SELECT a FROM t2",
+    "SELECT id FROM t1 WHERE id IN (SELECT id FROM t2 WHERE x > 1)",
+    "SELECT a FROM t WHERE EXISTS (SELECT 1 FROM u WHERE u.id = t.id)",
+    "SELECT count(*), max(a) FROM t GROUP BY b, c ORDER BY 1",
+    "SELECT sum(a) OVER (PARTITION BY b, c ORDER BY d) FROM t",
+    'SELECT "Col" FROM "Schema"."Table"',
+    "SELECT a FROM t -- comment from x\n WHERE b = 'from y'",
+    "SELECT a /* from z */ FROM t CROSS JOIN u",
+    "SELECT CASE WHEN a > 1 THEN 'x' ELSE 'y' END AS c FROM t",
+    "SELECT CAST(a AS INT) FROM t",
+    "SELECT a FROM T1, t1",
+    "SELECT a FROM t;",
+    "SELECT a FROM t LIMIT 10",
+    "SELECT a FROM t1 NATURAL JOIN t2",
+    "SELECT a FROM t1 FULL OUTER JOIN t2 ON t1.a = t2.a",
+    "SELECT * FROM t1 JOIN t2 ON (t1.a = t2.a AND t1.b = t2.b)",
+    "SELECT a, b FROM t1 AS x, t2 AS y",
+    "select t.* from t",
+]
+
+# SQL the fast path must hand over to SQLFluff.
+FALLBACK_CORPUS = [
+    "SELECT EXTRACT(YEAR FROM d) FROM t",
+    "SELECT a FROM t WHERE a IS DISTINCT FROM b",
+    "SELECT * FROM UNNEST(x)",
+    "SELECT * FROM [dbo].[t]",
+    "SELECT * FROM <[Parameters].[Table]>",
+    "SELECT * FROM (a JOIN b ON a.id = b.id)",
+    "INSERT INTO t SELECT * FROM u",
+    "SELECT a FROM t; SELECT b FROM u",
+]
+
+
+def sqlfluff_table_references(sql):
+    parsed = sqlfluff.parse(sql)
+    return sorted({ref.lower() for ref in parsed.tree.get_table_references()})
+
+
+@pytest.mark.parametrize("sql", FAST_PATH_CORPUS)
+def test_fast_path_matches_sqlfluff(sql):
+    """Fast path results match SQLFluff for common query shapes."""
+    assert extract_table_references_fast(sql) == sqlfluff_table_references(sql)
+
+
+@pytest.mark.parametrize("sql", FALLBACK_CORPUS)
+def test_fast_path_falls_back(sql):
+    """Fast path gives up on SQL it can't handle confidently."""
+    assert extract_table_references_fast(sql) is None
@@ -0,0 +1,54 @@
+"""Tests that parsed Workbook documents are not kept alive by the sync."""
+
+import gc
+import io
+import weakref
+import tracemalloc
+
+from tap_tableau_server.compact_workbook import CompactDatasource
+from tap_tableau_server.local_workbook import LocalWorkbook, load_workbook
+from tap_tableau_server.local_workbook_extractor import LocalWorkbookExtractor
+from tap_tableau_server.streaming_workbook import parse_workbook
+from tap_tableau_server.tests.synthetic_workbook import (
+    synthetic_workbook_xml, synthetic_twbx_bytes, make_workbook_item
+)
+
+
+def test_compact_releases_documentapi_document(tmp_path):
+    path = tmp_path / 'Workbook.twb'
+    path.write_text(synthetic_workbook_xml(datasources=3, custom_sql_size=2))
+    lwb = LocalWorkbook(make_workbook_item(), load_workbook(str(path), 'documentapi'))
+    document = weakref.ref(lwb.wb)
+    lwb.compact()
+    wbx = LocalWorkbookExtractor(table_reference_parser='fast')
+    record, datasources = wbx.extract_workbook(lwb)
+    gc.collect()
+    # Child streams only see the compact records
+    assert document() is None
+    assert all(isinstance(ds, CompactDatasource) for ds in datasources)
+
+
+def test_memory_is_flat_across_workbooks():
+    content = synthetic_twbx_bytes(
+        synthetic_workbook_xml(datasources=4, custom_sql_size=3)
+    )
+    wbx = LocalWorkbookExtractor(table_reference_parser='fast')
+
+    def sync(n):
+        for i in range(n):
+            workbook = parse_workbook(io.BytesIO(content), filename='Workbook.twbx')
+            lwb = LocalWorkbook(make_workbook_item(f"wb-{i}"), workbook, on_disk=False)
+            wbx.extract_all(lwb.compact())
+
+    tracemalloc.start()
+    try:
+        # Warm up caches, then check that many more Workbooks add nothing
+        sync(50)
+        gc.collect()
+        baseline, _ = tracemalloc.get_traced_memory()
+        sync(500)
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert current - baseline < 256 * 1024
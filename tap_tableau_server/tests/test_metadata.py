@@ -0,0 +1,191 @@
+"""Tests the Metadata API extraction backend against a stub Tableau Server."""
+
+import importlib.util
+
+import pytest
+
+from tap_tableau_server.async_client import AsyncTableauServerClient
+from tap_tableau_server.client import TableauServerClient
+from tap_tableau_server.local_workbook_extractor import LocalWorkbookExtractor
+from tap_tableau_server.tests.stub_server import StubTableauServer
+from tap_tableau_server.tests.synthetic_workbook import stub_workbooks
+from tap_tableau_server.tests.test_sync import sync
+
+requires_aiohttp = pytest.mark.skipif(
+    importlib.util.find_spec('aiohttp') is None, reason="aiohttp is not installed"
+)
+
+SNOWFLAKE = {'id': 'db-1', 'name': 'ANALYTICS', 'connectionType': 'snowflake',
+             'hostName': 'acme.snowflakecomputing.com', 'port': 443}
+POSTGRES = {'id': 'db-2', 'name': 'app', 'connectionType': 'postgres',
+            'hostName': 'db.internal', 'port': None}
+
+
+def metadata_workbook(luid, datasources):
+    return {
+        'luid': luid, 'sheets': [{'name': 'Sheet 1'}],
+        'embeddedDatasources': datasources
+    }
+
+
+METADATA = {
+    'workbooks': [
+        metadata_workbook('wb-000', [{
+            'id': 'ds-1', 'name': 'Orders',
+            'upstreamDatabases': [SNOWFLAKE],
+            'upstreamTables': [
+                {'id': 't-1', 'name': 'ORDERS', 'fullName': '[PUBLIC].[ORDERS]',
+                 'database': SNOWFLAKE},
+                {'id': 't-2', 'name': 'CUSTOMERS',
+                 'fullName': '[PUBLIC].[CUSTOMERS]', 'database': SNOWFLAKE},
+            ],
+        }]),
+        metadata_workbook('wb-001', [
+            {'id': 'ds-2', 'name': 'Users', 'upstreamDatabases': [POSTGRES],
+             'upstreamTables': [{'id': 't-3', 'name': 'users',
+                                 'fullName': '[public].[users]',
+                                 'database': POSTGRES}]},
+            # Same caption as another Datasource of the Workbook
+            {'id': 'ds-3', 'name': 'Users', 'upstreamDatabases': [POSTGRES],
+             'upstreamTables': []},
+        ]),
+        # Not fully indexed yet
+        metadata_workbook('wb-002', [
+            {'id': 'ds-4', 'name': 'Pending', 'upstreamDatabases': [],
+             'upstreamTables': []},
+        ]),
+    ],
+    'custom_sql_tables': [
+        {'id': 'cst-1', 'name': 'Custom SQL Query',
+         'query': 'SELECT * FROM public.orders o',
+         'database': SNOWFLAKE, 'tables': [{'id': 't-1'}],
+         'downstreamDatasources': [{'id': 'ds-1'}]},
+    ],
+}
+
+
+@pytest.fixture
+def stub():
+    with StubTableauServer(stub_workbooks(8), metadata=METADATA) as server:
+        yield server
+
+
+def extract(client):
+    wbx = LocalWorkbookExtractor(table_reference_parser='fast')
+    try:
+        return {
+            lwb.id: wbx.extract_all(lwb)
+            for lwb in client.get_workbooks(None)
+        }
+    finally:
+        client.close()
+
+
+@pytest.mark.parametrize('client_class, kwargs', [
+    (TableauServerClient, {'extraction_engine': 'streaming'}),
+    pytest.param(AsyncTableauServerClient, {}, marks=requires_aiohttp),
+])
+def test_metadata_backend(stub, client_class, kwargs):
+    expected = extract(TableauServerClient(
+        stub.url, 'user', 'password', extraction_engine='streaming',
+        download_mode='memory'
+    ))
+    downloads = stub.requests['download']
+    client = client_class(
+        stub.url, 'user', 'password', extraction_backend='metadata',
+        metadata_batch_size=3, **kwargs
+    )
+    actual = extract(client)
+    # Only the indexed Workbooks, in listing order
+    assert list(actual) == [wid for wid in expected if wid in ('wb-000', 'wb-001')]
+
+    orders = actual['wb-000']
+    assert [ds['id'] for ds in orders.datasources] == ['wb-000:Orders']
+    assert [c['id'] for c in orders.connections] == ['wb-000:Orders:snowflake.db-1']
+    assert orders.connections[0]['server'] == 'acme.snowflakecomputing.com'
+    # Custom SQL accounts for ORDERS, so only CUSTOMERS is a table Relation
+    assert sorted(
+        (r['type'], r['id']) for r in orders.relations
+    ) == [
+        ('table', 'wb-000:Orders:snowflake.db-1:CUSTOMERS'),
+        ('text', 'wb-000:Orders:snowflake.db-1:Custom SQL Query'),
+    ]
+    assert [t['ref'] for t in orders.table_references] == ['public.orders']
+
+    users = actual['wb-001']
+    assert [ds['id'] for ds in users.datasources] == [
+        'wb-001:Users', 'wb-001:Users:ds-3'
+    ]
+
+    # Without the download fallback, Workbooks with incomplete or missing
+    # metadata are left to be retried
+    assert [wbi.id for wbi, _ in client.failed_workbooks] == [
+        wid for wid in expected if wid not in actual
+    ]
+    assert stub.requests['download'] == downloads
+
+
+def test_metadata_errors_are_not_downloaded(stub):
+    expected = extract(TableauServerClient(
+        stub.url, 'user', 'password', extraction_engine='streaming'
+    ))
+    downloads = stub.requests['download']
+    stub.metadata = None
+    client = TableauServerClient(
+        stub.url, 'user', 'password', extraction_engine='streaming',
+        extraction_backend='metadata'
+    )
+    assert extract(client) == {}
+    assert [wbi.id for wbi, _ in client.failed_workbooks] == list(expected)
+    assert stub.requests['download'] == downloads
+
+
+def test_metadata_download_fallback(stub):
+    expected = extract(TableauServerClient(
+        stub.url, 'user', 'password', extraction_engine='streaming'
+    ))
+    client = TableauServerClient(
+        stub.url, 'user', 'password', extraction_engine='streaming',
+        extraction_backend='metadata', metadata_batch_size=3,
+        metadata_download_fallback=True
+    )
+    actual = extract(client)
+    # Every Workbook, in listing order
+    assert list(actual) == list(expected)
+    # Those the Metadata API has no complete details of are downloaded
+    assert {
+        wid: actual[wid] for wid in actual if wid not in ('wb-000', 'wb-001')
+    } == {
+        wid: expected[wid] for wid in expected if wid not in ('wb-000', 'wb-001')
+    }
+    assert client.failed_workbooks == []
+
+
+@pytest.mark.parametrize('metadata, indexed', [
+    (METADATA, {'wb-000', 'wb-001'}),
+    # The Metadata API is disabled
+    (None, set()),
+])
+def test_workbooks_missing_from_the_metadata_api_are_synced(metadata, indexed):
+    with StubTableauServer(stub_workbooks(8), metadata=metadata) as stub:
+        result = sync(
+            stub, extraction_backend='metadata', metadata_download_fallback=True
+        )
+    workbook_ids = sorted(result.ids())
+    assert workbook_ids == [f"wb-{i:03d}" for i in range(8)]
+    assert result.bookmark['site_failed_workbooks'] == {'': []}
+    # Each record names the scheme its IDs follow
+    for stream in (
+        'workbook_datasource', 'workbook_connection',
+        'workbook_relation', 'workbook_table_reference'
+    ):
+        schemes = {
+            record['wb_id']: record['id_scheme'] for record in result.records(stream)
+        }
+        assert schemes == {
+            wid: 'metadata' if wid in indexed else 'download'
+            for wid in workbook_ids if wid in schemes
+        }
+    assert {
+        record['wb_id'] for record in result.records('workbook_datasource')
+    } == set(workbook_ids)
@@ -0,0 +1,86 @@
+"""Tests sync metrics."""
+
+import json
+import random
+import logging
+
+from tap_tableau_server.client import TableauServerClient
+from tap_tableau_server.local_workbook_extractor import LocalWorkbookExtractor
+from tap_tableau_server.metrics import Metrics, WorkbookTotals, metrics
+from tap_tableau_server.tests.stub_server import StubTableauServer
+from tap_tableau_server.tests.synthetic_workbook import stub_workbooks
+
+
+def test_histograms_and_slow_log():
+    m = Metrics(slow_log_size=2)
+    for workbook_id, seconds in [('a', 0.2), ('b', 3.0), ('a', 0.3), ('c', 1.0)]:
+        m.observe('parse_seconds', seconds, workbook_id)
+    m.add('relations', 'a', 4)
+    m.add('relations', 'a', 1)
+    m.add('relations', 'b', 2)
+    assert m.histograms['parse_seconds'].count == 4
+    assert m.slowest('parse_seconds') == [('b', 3.0), ('c', 1.0)]
+    relations = m.per_workbook_histograms()['relations']
+    assert (relations.count, relations.sum, relations.max) == (2, 7, 5)
+    text = m.to_prometheus()
+    assert 'tap_tableau_server_parse_seconds_bucket{le="0.25"} 1' in text
+    assert 'tap_tableau_server_parse_seconds_bucket{le="+Inf"} 4' in text
+    assert 'tap_tableau_server_relations_count 2' in text
+
+
+def test_workbook_totals_are_bounded():
+    rng = random.Random(0)
+    totals = WorkbookTotals(3, (1, 10, 100), open_workbooks=5)
+    expected = {}
+    for i in range(1000):
+        # Each Workbook's observations arrive close together
+        for _ in range(rng.randint(1, 3)):
+            value = rng.random() * 10
+            totals.add(f"wb-{i}", value)
+            expected[f"wb-{i}"] = expected.get(f"wb-{i}", 0) + value
+        assert len(totals.running) <= 5 and len(totals.top) <= 3
+    assert len(totals) == 1000
+    assert totals.largest() == sorted(
+        expected.items(), key=lambda item: item[1], reverse=True
+    )[:3]
+    histogram = totals.totals_histogram()
+    assert histogram.count == 1000
+    assert abs(histogram.sum - sum(expected.values())) < 1e-6
+
+
+def test_sync_metrics(tmp_path, caplog):
+    """Listing, download, parse and SQL parse stages are all measured."""
+    metrics.reset()
+    wbx = LocalWorkbookExtractor(table_reference_parser='fast')
+    with StubTableauServer(stub_workbooks(10)) as stub:
+        client = TableauServerClient(
+            stub.url, 'user', 'password', extraction_engine='streaming',
+            download_mode='memory'
+        )
+        try:
+            for lwb in client.get_workbooks(None):
+                wbx.extract_all(lwb)
+        finally:
+            client.close()
+    assert metrics.counters['list_pages'] == 1
+    assert metrics.counters['workbooks_listed'] == 10
+    for name in (
+        'download_seconds', 'download_bytes', 'parse_seconds', 'sql_parse_seconds'
+    ):
+        assert len(metrics.per_workbook[name]) == 10, name
+    assert metrics.histograms['download_bytes'].sum == sum(
+        len(wb.content) for wb in stub.workbooks
+    )
+    with caplog.at_level(logging.INFO, logger='tap_tableau_server.metrics'):
+        metrics.log()
+    lines = [
+        json.loads(r.message[len('METRIC: '):])
+        for r in caplog.records if r.message.startswith('METRIC: ')
+    ]
+    assert {'list_pages', 'download_seconds', 'relations'} <= {
+        line['metric'] for line in lines
+    }
+    assert any('Top 10 Workbooks by parse_seconds' in r.message for r in caplog.records)
+    path = tmp_path / 'tap.prom'
+    metrics.write_prometheus(str(path))
+    assert 'tap_tableau_server_download_seconds_count 10' in path.read_text()
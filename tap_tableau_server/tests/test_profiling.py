@@ -0,0 +1,70 @@
+"""Tests the sync profiler."""
+
+from types import SimpleNamespace
+
+from tap_tableau_server.profiling import SyncProfiler
+
+
+class FakeClock:
+    """ A clock that only moves when told to.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fake_streams(profiler, clock):
+    def busy(seconds):
+        # Take the sampler's samples here, rather than on its own schedule
+        profiler.sampler.take_sample()
+        clock.now += seconds
+
+    def workbooks(context):
+        for i in range(6):
+            busy(1)
+            yield {'id': i}
+
+    def datasources(context):
+        busy(10)
+        yield {'id': context['id']}
+
+    return {
+        'workbook': SimpleNamespace(get_records=workbooks),
+        'workbook_datasource': SimpleNamespace(get_records=datasources),
+    }
+
+
+def sync(streams):
+    """ Walk the fake stream tree the way the SDK does.
+    """
+    for record in streams['workbook'].get_records(None):
+        list(streams['workbook_datasource'].get_records(record))
+
+
+def test_profiles_every_nth_workbook(tmp_path):
+    clock = FakeClock()
+    # The sampler thread never samples by itself
+    profiler = SyncProfiler(
+        str(tmp_path), every_n_workbooks=3, sample_interval=3600, clock=clock
+    )
+    streams = fake_streams(profiler, clock)
+    profiler.instrument(streams)
+    sync(streams)
+    profiler.write()
+    assert (profiler.workbooks, profiler.profiled_workbooks) == (6, 2)
+    # Only the first and fourth Workbooks, and their Datasources, were profiled
+    assert profiler.seconds == {'workbook': 2, 'workbook_datasource': 20}
+    for name in ('workbook', 'workbook_datasource'):
+        assert (tmp_path / f"{name}.prof").exists()
+        assert 'busy' in (tmp_path / f"{name}.txt").read_text()
+    stacks = {}
+    for line in (tmp_path / 'stacks.collapsed').read_text().splitlines():
+        stack, count = line.rsplit(' ', 1)
+        frames = stack.split(';')
+        # Rooted at the stream, down to the sampled function
+        assert frames[-2].startswith('busy (test_profiling.py')
+        stacks[frames[0]] = stacks.get(frames[0], 0) + int(count)
+    assert stacks == {'workbook': 2, 'workbook_datasource': 2}
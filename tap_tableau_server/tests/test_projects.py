@@ -0,0 +1,51 @@
+"""Tests listing Workbooks by project."""
+
+import importlib.util
+
+import pytest
+
+from tap_tableau_server.async_client import AsyncTableauServerClient
+from tap_tableau_server.client import TableauServerClient
+from tap_tableau_server.tests.stub_server import StubTableauServer
+from tap_tableau_server.tests.synthetic_workbook import stub_workbooks
+
+requires_aiohttp = pytest.mark.skipif(
+    importlib.util.find_spec('aiohttp') is None, reason="aiohttp is not installed"
+)
+
+PROJECTS = [
+    ('p-1', 'Finance'),
+    ('p-2', 'Sales, EMEA'),
+    # A nested project sharing its parent's name
+    ('p-3', 'Finance'),
+]
+
+
+@pytest.fixture
+def stub():
+    workbooks = stub_workbooks(12)
+    for i, wb in enumerate(workbooks):
+        wb.project_id, wb.project_name = PROJECTS[i % len(PROJECTS)]
+    with StubTableauServer(workbooks) as server:
+        yield server
+
+
+@pytest.mark.parametrize('client_class', [
+    TableauServerClient,
+    pytest.param(AsyncTableauServerClient, marks=requires_aiohttp),
+])
+def test_list_workbooks_by_project(stub, client_class):
+    client = client_class(stub.url, 'user', 'password')
+    try:
+        projects = sorted((p.id, p.name) for p in client.list_projects())
+        assert projects == sorted(PROJECTS)
+        for project_id, project_name in PROJECTS:
+            workbooks = list(client.list_workbooks(
+                project_id=project_id, project_name=project_name
+            ))
+            expected = [
+                wb.id for wb in stub.workbooks if wb.project_id == project_id
+            ]
+            assert [wbi.id for wbi in workbooks] == expected
+    finally:
+        client.close()
@@ -0,0 +1,70 @@
+"""Tests the shared Tableau Server session against a stub Tableau Server."""
+
+import threading
+
+import pytest
+import tableauserverclient as tsc
+
+from tap_tableau_server.session import TableauServerSession
+from tap_tableau_server.tests.stub_server import StubTableauServer
+from tap_tableau_server.tests.synthetic_workbook import stub_workbooks
+
+
+@pytest.fixture
+def stub():
+    with StubTableauServer(stub_workbooks(3)) as server:
+        yield server
+
+
+def list_workbooks(server):
+    workbooks, _ = server.workbooks.get()
+    return [wbi.id for wbi in workbooks]
+
+
+def make_session(stub, **kwargs):
+    return TableauServerSession(stub.url, tsc.TableauAuth('user', 'password'), **kwargs)
+
+
+def test_signs_in_once_and_out_on_close(stub):
+    session = make_session(stub)
+    for _ in range(3):
+        assert len(session.call(list_workbooks)) == 3
+    assert stub.requests['signin'] == 1
+    session.close()
+    assert stub.requests['signout'] == 1
+    assert stub.sessions == 0
+
+
+def test_refresh_signs_out_the_old_session(stub):
+    session = make_session(stub, max_age=0)
+    for _ in range(3):
+        assert len(session.call(list_workbooks)) == 3
+    assert stub.requests['signin'] == 3
+    # Each expired session was signed out as the next one signed in
+    assert stub.sessions == 1
+    session.close()
+    assert stub.sessions == 0
+
+
+def test_rejected_token_signs_in_again_once(stub):
+    session = make_session(stub)
+    session.call(list_workbooks)
+    stub.expire_tokens()
+    barrier = threading.Barrier(8)
+
+    def call():
+        barrier.wait()
+        session.call(list_workbooks)
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Every thread saw the same rejected generation, so only one signed in
+    assert stub.requests['signin'] == 2
+    assert session._generation == 2
+    # Signing out the rejected session failed, without failing the call
+    assert stub.requests['signout'] == 1
+    assert stub.sessions == 1
+    session.close()
@@ -0,0 +1,79 @@
+"""Tests syncing several sites in parallel."""
+
+import threading
+
+import pytest
+
+from tap_tableau_server.client import TableauServerClient
+from tap_tableau_server.sites import interleave_site_workbooks
+from tap_tableau_server.tests.stub_server import StubTableauServer
+from tap_tableau_server.tests.synthetic_workbook import stub_workbooks
+from tap_tableau_server.tests.test_throttling import fast_throttle
+from tap_tableau_server.throttling import ThrottledError
+
+
+def make_client(stub, site_id, throttle=None):
+    return TableauServerClient(
+        stub.url, 'user', 'password', site_id=site_id,
+        max_concurrent_downloads=2, extraction_engine='streaming',
+        download_mode='memory', throttle=throttle
+    )
+
+
+def test_sites_are_interleaved_in_listing_order():
+    with StubTableauServer(stub_workbooks(10), latency=0.01) as a, \
+            StubTableauServer(stub_workbooks(15), latency=0.01) as b:
+        clients = {'a': make_client(a, 'a'), 'b': make_client(b, 'b')}
+        try:
+            fetched = [
+                (site_id, lwb.id, lwb.wbi.updated_at)
+                for site_id, lwb in interleave_site_workbooks(
+                    clients, checkpoints={}
+                )
+            ]
+        finally:
+            for client in clients.values():
+                client.close()
+    for site_id, count in (('a', 10), ('b', 15)):
+        site = [(id, updated_at) for s, id, updated_at in fetched if s == site_id]
+        assert len(site) == count
+        assert [updated_at for _, updated_at in site] == sorted(
+            updated_at for _, updated_at in site
+        )
+    # Sites were fetched side by side, not one after the other
+    assert {s for s, _, _ in fetched[:10]} == {'a', 'b'}
+
+
+def test_each_site_uses_its_own_checkpoint_and_limit():
+    with StubTableauServer(stub_workbooks(10)) as a, \
+            StubTableauServer(stub_workbooks(10)) as b:
+        clients = {'a': make_client(a, 'a'), 'b': make_client(b, 'b')}
+        checkpoint = sorted(wb.updated_at for wb in a.workbooks)[6]
+        try:
+            fetched = list(interleave_site_workbooks(
+                clients, checkpoints={'a': checkpoint.isoformat()}, limit=5
+            ))
+        finally:
+            for client in clients.values():
+                client.close()
+    assert len([s for s, _ in fetched if s == 'a']) == 4
+    assert len([s for s, _ in fetched if s == 'b']) == 5
+
+
+def test_failing_site_stops_every_site():
+    with StubTableauServer(stub_workbooks(10), latency=0.01) as a, \
+            StubTableauServer(stub_workbooks(10), list_error_rate=1.0) as b:
+        clients = {
+            'a': make_client(a, 'a'),
+            'b': make_client(b, 'b', throttle=fast_throttle(max_retries=0))
+        }
+        try:
+            with pytest.raises(ThrottledError):
+                for _ in interleave_site_workbooks(clients, checkpoints={}):
+                    pass
+        finally:
+            for client in clients.values():
+                client.close()
+    assert not [
+        t for t in threading.enumerate() if t.name.startswith('tableau-workbooks-')
+    ]
@@ -0,0 +1,85 @@
+"""Tests parsing custom SQL in a pool of worker processes."""
+
+import io
+import time
+
+import pytest
+
+from tap_tableau_server.cache import TableReferenceCache
+from tap_tableau_server.local_workbook import LocalWorkbook
+from tap_tableau_server.local_workbook_extractor import LocalWorkbookExtractor
+from tap_tableau_server.sql_parser_pool import SQLParserPool
+from tap_tableau_server.streaming_workbook import parse_workbook
+from tap_tableau_server.tests.synthetic_workbook import (
+    synthetic_workbook_xml, make_workbook_item
+)
+
+# Statements that take longer to parse than the pool allows
+STUCK = 'stuck'
+
+
+def parse(sql, dialect):
+    """ A stand-in parser, picklable for spawned workers.
+    """
+    if sql == STUCK:
+        time.sleep(60)
+    return [f"{dialect}:{sql}"]
+
+
+def test_timed_out_statements_restart_the_pool():
+    pool = SQLParserPool(parse, processes=2, timeout=3)
+    try:
+        # Start the workers, so the timeout only measures parsing
+        assert pool.parse_many([('warm', 'ansi')]) == [['ansi:warm']]
+        workers = pool.pool
+        results = pool.parse_many([
+            ('a', 'ansi'), (STUCK, 'ansi'), ('b', 'snowflake'), ('c', 'ansi')
+        ])
+        assert results == [['ansi:a'], None, ['snowflake:b'], ['ansi:c']]
+        assert pool.timeouts == 1
+        # The stuck worker's pool was replaced, and the new one is used after
+        assert pool.pool is not workers
+        assert pool.parse_many([('d', 'ansi')]) == [['ansi:d']]
+    finally:
+        pool.close()
+
+
+def extract(wbx):
+    xml = synthetic_workbook_xml(datasources=4, custom_sql_size=3)
+    workbook = parse_workbook(io.BytesIO(xml.encode('utf-8')), filename='Workbook.twb')
+    lwb = LocalWorkbook(make_workbook_item(), workbook, on_disk=False)
+    try:
+        return wbx.extract_all(lwb)
+    finally:
+        wbx.close()
+
+
+def test_pooled_table_references_match():
+    expected = extract(LocalWorkbookExtractor(table_reference_parser='fast'))
+    pooled = LocalWorkbookExtractor(
+        table_reference_parser='fast', sql_parse_processes=2,
+        sql_cache=TableReferenceCache()
+    )
+    actual = extract(pooled)
+    assert actual.table_references
+    assert actual == expected
+    # Prefetching leaves a single hit or miss per custom SQL lookup
+    lookups = sum(1 for r in actual.relations if r['type'] == 'text' and r['text'])
+    assert pooled.sql_cache.hits + pooled.sql_cache.misses == lookups
+
+
+@pytest.mark.parametrize('sql_cache', [
+    None,
+    TableReferenceCache(maxsize=0),
+    TableReferenceCache(maxsize=10),
+])
+def test_pooled_table_references_are_not_parsed_again(sql_cache):
+    expected = extract(LocalWorkbookExtractor(table_reference_parser='fast'))
+    pooled = LocalWorkbookExtractor(
+        table_reference_parser='fast', sql_parse_processes=2, sql_cache=sql_cache
+    )
+    in_process = []
+    parse = pooled.parse
+    pooled.parse = lambda sql, dialect: in_process.append(sql) or parse(sql, dialect)
+    assert extract(pooled) == expected
+    assert in_process == []
@@ -0,0 +1,33 @@
+"""Tests the streaming extraction engine against tableaudocumentapi."""
+
+import pytest
+
+from tap_tableau_server.local_workbook import LocalWorkbook, load_workbook
+from tap_tableau_server.local_workbook_extractor import LocalWorkbookExtractor
+from tap_tableau_server.tests.synthetic_workbook import (
+    make_workbook_item, synthetic_workbook_xml, synthetic_twbx_bytes
+)
+
+
+@pytest.mark.parametrize("packaged", [False, True])
+def test_streaming_engine_matches_documentapi(tmp_path, packaged):
+    """Streaming engine emits the same records as the documentapi engine."""
+    twb_xml = synthetic_workbook_xml(
+        datasources=4, named_connections=2, join_depth=2, custom_sql_size=3
+    )
+    if packaged:
+        path = tmp_path / 'Synthetic.twbx'
+        path.write_bytes(synthetic_twbx_bytes(twb_xml, name='Synthetic'))
+    else:
+        path = tmp_path / 'Synthetic.twb'
+        path.write_text(twb_xml)
+    wbx = LocalWorkbookExtractor()
+    expected, actual = (
+        wbx.extract_all(
+            LocalWorkbook(make_workbook_item(), load_workbook(str(path), engine))
+        )
+        for engine in ('documentapi', 'streaming')
+    )
+    assert actual == expected
+    assert actual.relations
+    assert actual.table_references
@@ -0,0 +1,193 @@
+"""Tests syncing the tap against a stub Tableau Server, and resuming from its state."""
+
+import gc
+import io
+import json
+import datetime
+import contextlib
+
+import pytest
+
+from tap_tableau_server.local_workbook_extractor import LocalWorkbookExtractor
+from tap_tableau_server.tap import TapTableauServer
+from tap_tableau_server.tests.stub_server import StubTableauServer, StubWorkbook
+from tap_tableau_server.tests.synthetic_workbook import START, stub_workbooks
+
+
+class Crash(Exception):
+    """ Stands in for the tap being killed mid-sync.
+    """
+
+
+class Sync:
+    """ The messages of one `sync_all`.
+    """
+
+    def __init__(self, messages, error=None):
+        self.messages = messages
+        self.error = error
+
+    def records(self, stream='workbook'):
+        return [
+            m['record'] for m in self.messages
+            if m['type'] == 'RECORD' and m['stream'] == stream
+        ]
+
+    def ids(self, stream='workbook'):
+        return [record['id'] for record in self.records(stream)]
+
+    @property
+    def states(self):
+        return [m['value'] for m in self.messages if m['type'] == 'STATE']
+
+    @property
+    def state(self):
+        return self.states[-1]
+
+    @property
+    def bookmark(self):
+        return self.state['bookmarks']['workbook']
+
+
+def sync(stub, state=None, crash_after=None, **config):
+    """ Run the tap against `stub`, raising Crash when extracting the
+    Workbook after the first `crash_after`.
+    """
+    tap = TapTableauServer(config={
+        'host': stub.url, 'username': 'user', 'password': 'password',
+        'extraction_engine': 'streaming', 'download_mode': 'memory',
+        'table_reference_parser': 'fast', 'max_retries': 0,
+        'checkpoint_every_n_workbooks': 1, **config
+    }, state=state or {})
+    extracted = []
+
+    def extract_workbook(workbook):
+        if crash_after is not None and len(extracted) == crash_after:
+            raise Crash()
+        extracted.append(workbook.id)
+        return LocalWorkbookExtractor.extract_workbook(tap.wbx, workbook)
+
+    tap.wbx.extract_workbook = extract_workbook
+    output = io.StringIO()
+    error = None
+    with contextlib.redirect_stdout(output):
+        try:
+            tap.sync_all()
+        except Crash as e:
+            error = e.with_traceback(None)
+        # Close the abandoned Workbook generators while their logs are captured
+        gc.collect()
+    return Sync([json.loads(line) for line in output.getvalue().splitlines()], error)
+
+
+def by_update(workbooks):
+    return [wb.id for wb in sorted(workbooks, key=lambda wb: wb.updated_at)]
+
+
+@pytest.fixture
+def workbooks():
+    workbooks = stub_workbooks(8)
+    # The three oldest Workbooks share a bookmark
+    oldest = sorted(workbooks, key=lambda wb: wb.updated_at)[:3]
+    for wb in oldest:
+        wb.updated_at = START
+    return workbooks
+
+
+@pytest.fixture
+def stub(workbooks):
+    with StubTableauServer(workbooks) as server:
+        yield server
+
+
+def test_resume_after_crash(stub, workbooks):
+    ids = by_update(workbooks)
+    crashed = sync(stub, crash_after=3)
+    assert crashed.error is not None
+    assert crashed.ids() == ids[:3]
+    # The last checkpoint was written before the third Workbook's record,
+    # with the first two synced at the shared bookmark
+    assert crashed.bookmark['site_bookmarks'] == {'': START.isoformat()}
+    assert crashed.bookmark['site_boundaries'][''] == {
+        'updated_at': START.isoformat(), 'ids': ids[:2]
+    }
+    resumed = sync(stub, state=crashed.state)
+    assert resumed.error is None
+    # Only the Workbook whose record may not have been committed is synced again
+    assert resumed.ids() == ids[2:]
+    assert resumed.bookmark['site_bookmarks'] == {
+        '': workbooks[1].updated_at.isoformat()
+    }
+    # Nothing left to sync
+    assert sync(stub, state=resumed.state).ids() == []
+
+
+def test_failed_workbooks_are_retried(stub, workbooks):
+    ids = by_update(workbooks)
+    failing = ids[4]
+    stub.failing_ids = {failing}
+    first = sync(stub)
+    assert first.ids() == [i for i in ids if i != failing]
+    assert first.bookmark['site_failed_workbooks'] == {'': [failing]}
+    bookmark = first.bookmark['replication_key_value']
+    assert first.bookmark['site_bookmarks'] == {'': bookmark}
+
+    # Still failing: kept for the next run, once
+    second = sync(stub, state=first.state)
+    assert second.ids() == []
+    assert second.bookmark['site_failed_workbooks'] == {'': [failing]}
+
+    stub.failing_ids = set()
+    third = sync(stub, state=second.state)
+    assert third.ids() == [failing]
+    assert third.bookmark['site_failed_workbooks'] == {'': []}
+    # The older, retried Workbook moves neither bookmark back
+    assert third.bookmark['site_bookmarks'] == {'': bookmark}
+    assert all(
+        state['bookmarks']['workbook']['replication_key_value'] == bookmark
+        for state in third.states
+    )
+
+
+def test_failed_workbooks_updated_since_are_synced_once(stub, workbooks):
+    ids = by_update(workbooks)
+    failing = next(wb for wb in workbooks if wb.id == ids[4])
+    stub.failing_ids = {failing.id}
+    first = sync(stub)
+    stub.failing_ids = set()
+    failing.updated_at += datetime.timedelta(days=1)
+    stub.workbooks.sort(key=lambda wb: wb.updated_at)
+    second = sync(stub, state=first.state)
+    # Listed after the bookmark, so not retried as well
+    assert second.ids() == [failing.id]
+    assert second.bookmark['site_failed_workbooks'] == {'': []}
+    assert second.bookmark['replication_key_value'] == failing.updated_at.isoformat()
+
+
+def test_partitions_resume_from_their_bookmarks(stub, workbooks):
+    for wb in workbooks[::2]:
+        wb.project_id, wb.project_name = 'p-sales', 'Sales'
+    first = sync(stub, partition_by_project=True)
+    assert sorted(first.ids()) == sorted(wb.id for wb in workbooks)
+    partitions = first.bookmark['partitions']
+    assert sorted(p['context']['project_id'] for p in partitions) == sorted(
+        {wb.project_id for wb in workbooks}
+    )
+
+    latest = max(wb.updated_at for wb in workbooks)
+    new = [
+        StubWorkbook(
+            id=f"wb-new-{project_id}", name=f"New{project_id}",
+            updated_at=latest + datetime.timedelta(hours=1),
+            content=workbooks[0].content,
+            project_id=project_id, project_name=project_name
+        )
+        for project_id, project_name in {
+            (wb.project_id, wb.project_name) for wb in workbooks
+        }
+    ]
+    stub.workbooks.extend(new)
+    second = sync(stub, state=first.state, partition_by_project=True)
+    assert sorted(second.ids()) == sorted(wb.id for wb in new)
+    # Only the Workbooks updated since each partition's bookmark were listed
+    assert sync(stub, state=second.state, partition_by_project=True).ids() == []
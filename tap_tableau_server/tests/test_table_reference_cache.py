@@ -0,0 +1,70 @@
+"""Tests the cache of table references parsed from custom SQL."""
+
+from tap_tableau_server.cache import TableReferenceCache
+from tap_tableau_server.local_workbook_extractor import parse_table_references
+
+SQL = "SELECT * FROM public.orders o JOIN public.users u ON o.user_id = u.id"
+
+
+class Parser:
+    """ Counts calls, returning `refs` for every statement.
+    """
+
+    def __init__(self, refs):
+        self.refs = refs
+        self.calls = 0
+
+    def __call__(self, sql, dialect):
+        self.calls += 1
+        return self.refs
+
+
+def test_references_persist_between_runs(tmp_path):
+    parse = Parser(['public.orders', 'public.users'])
+    cache = TableReferenceCache(cache_dir=str(tmp_path), version='1')
+    assert cache.get_or_parse(SQL, 'ansi', parse) == parse.refs
+    assert cache.get_or_parse(SQL, 'ansi', parse) == parse.refs
+    cache.close()
+
+    cache = TableReferenceCache(cache_dir=str(tmp_path), version='1')
+    assert cache.get_or_parse(SQL, 'ansi', parse) == parse.refs
+    assert parse.calls == 1
+    assert (cache.hits, cache.misses) == (1, 0)
+    # Another dialect or parser version is parsed again
+    assert cache.get_or_parse(SQL, 'snowflake', parse) == parse.refs
+    assert TableReferenceCache(cache_dir=str(tmp_path), version='2').get(
+        SQL, 'ansi'
+    ) is None
+    assert parse.calls == 2
+    cache.close()
+
+
+def test_failed_parses_are_not_persisted(tmp_path):
+    parse = Parser(None)
+    cache = TableReferenceCache(cache_dir=str(tmp_path))
+    assert cache.get_or_parse(SQL, 'ansi', parse) == []
+    # Not parsed again this run...
+    assert cache.get_or_parse(SQL, 'ansi', parse) == []
+    assert parse.calls == 1
+    cache.close()
+
+    # ...but by the next one
+    cache = TableReferenceCache(cache_dir=str(tmp_path))
+    assert cache.get(SQL, 'ansi') is None
+    cache.close()
+
+
+def test_references_are_distinct_and_sorted():
+    sql = (
+        "SELECT * FROM public.users u "
+        "JOIN public.orders o ON o.user_id = u.id "
+        "JOIN PUBLIC.USERS m ON m.id = u.manager_id"
+    )
+    for parser in ('fast', 'sqlfluff_only'):
+        assert parse_table_references(sql, 'ansi', parser=parser) == [
+            'public.orders', 'public.users'
+        ]
+
+
+def test_unparseable_sql_is_a_failure():
+    assert parse_table_references("SELECT FROM WHERE (", 'ansi') is None
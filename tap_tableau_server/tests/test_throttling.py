@@ -0,0 +1,134 @@
+"""Tests rate limiting, retries and circuit breaking."""
+
+import time
+import asyncio
+import importlib.util
+
+import pytest
+
+from tap_tableau_server.async_client import AsyncTableauServerClient
+from tap_tableau_server.client import TableauServerClient
+from tap_tableau_server.tests.stub_server import StubTableauServer
+from tap_tableau_server.tests.synthetic_workbook import stub_workbooks
+from tap_tableau_server.throttling import (
+    Throttle, TokenBucket, RetryPolicy, CircuitBreaker, ThrottledError,
+    parse_retry_after
+)
+
+
+requires_aiohttp = pytest.mark.skipif(
+    importlib.util.find_spec('aiohttp') is None, reason="aiohttp is not installed"
+)
+
+
+def fast_throttle(**policy):
+    return Throttle(
+        policy=RetryPolicy(initial_wait=0.01, **policy),
+        breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.05)
+    )
+
+
+def flaky(failures, error):
+    calls = []
+
+    def func():
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise error
+        return 'ok'
+    return func, calls
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('2') == 2.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=10, burst=1)
+    waits = [bucket.reserve() for _ in range(5)]
+    assert waits[0] == 0.0
+    assert waits[-1] == pytest.approx(0.4, abs=0.05)
+
+
+def test_throttle_honours_retry_after():
+    func, calls = flaky(1, ThrottledError(429, retry_after=0.2))
+    assert fast_throttle().call(func) == 'ok'
+    assert calls[1] - calls[0] >= 0.2
+
+
+def test_throttle_gives_up_after_max_retries():
+    func, calls = flaky(10, ThrottledError(503))
+    with pytest.raises(ThrottledError):
+        fast_throttle(max_retries=2).call(func)
+    assert len(calls) == 3
+
+
+def test_throttle_does_not_retry_other_errors():
+    func, calls = flaky(1, ValueError('bad'))
+    with pytest.raises(ValueError):
+        fast_throttle().call(func)
+    assert len(calls) == 1
+
+
+@requires_aiohttp
+def test_async_client_does_not_change_a_shared_throttle():
+    throttle = fast_throttle()
+    retry_on = throttle.policy.retry_on
+    shared = AsyncTableauServerClient(
+        'http://localhost', 'user', 'password', throttle=throttle
+    )
+    # Its own throttle retries aiohttp errors
+    client = AsyncTableauServerClient('http://localhost', 'user', 'password')
+    try:
+        assert shared.throttle.policy.retry_on == retry_on
+        func, calls = flaky(1, asyncio.TimeoutError())
+        assert client.throttle.call(func) == 'ok'
+        assert len(calls) == 2
+    finally:
+        shared.close()
+        client.close()
+
+
+def test_retry_budget_is_shared():
+    throttle = fast_throttle(retry_budget=2)
+    func, calls = flaky(10, ThrottledError(503, retry_after=0))
+    with pytest.raises(ThrottledError):
+        throttle.call(func)
+    assert len(calls) == 3
+    func, calls = flaky(1, ThrottledError(503, retry_after=0))
+    with pytest.raises(ThrottledError):
+        throttle.call(func)
+    assert len(calls) == 1
+
+
+def test_circuit_breaker_backs_off_all_callers():
+    throttle = fast_throttle()
+    throttle.breaker.open(0.2)
+    start = time.monotonic()
+    assert throttle.call(lambda: 'ok') == 'ok'
+    assert time.monotonic() - start >= 0.2
+
+
+def test_failed_workbooks_are_reported():
+    """Workbooks still failing once retries are used up are reported, not lost."""
+    with StubTableauServer(
+        stub_workbooks(), error_rate=0.3, retry_after=0, seed=1
+    ) as stub:
+        client = TableauServerClient(
+            stub.url, 'user', 'password', extraction_engine='streaming',
+            download_mode='memory', max_concurrent_downloads=4,
+            throttle=fast_throttle(max_retries=1)
+        )
+        try:
+            fetched = [lwb.id for lwb in client.get_workbooks(None)]
+        finally:
+            client.close()
+    failed = [wbi.id for wbi, error in client.failed_workbooks]
+    assert failed
+    assert all(
+        isinstance(error, ThrottledError) for _, error in client.failed_workbooks
+    )
+    assert sorted(fetched + failed) == sorted(wb.id for wb in stub.workbooks)
@@ -0,0 +1,36 @@
+"""Tests the downloaded Workbook cache."""
+
+import datetime
+
+import pytest
+
+from tap_tableau_server.cache import WorkbookCache
+from tap_tableau_server.compact_workbook import compact_workbook
+from tap_tableau_server.local_workbook import LocalWorkbook, load_workbook
+from tap_tableau_server.local_workbook_extractor import LocalWorkbookExtractor
+from tap_tableau_server.tests.synthetic_workbook import (
+    synthetic_workbook_xml, make_workbook_item
+)
+
+
+@pytest.mark.parametrize("engine", ['documentapi', 'streaming'])
+def test_cached_workbook_matches_original(tmp_path, engine):
+    """Workbooks read back from the cache emit the same records."""
+    path = tmp_path / 'Synthetic.twb'
+    path.write_text(synthetic_workbook_xml(
+        datasources=3, named_connections=2, join_depth=2, custom_sql_size=2
+    ))
+    wbi = make_workbook_item()
+    workbook = load_workbook(str(path), engine)
+    cache = WorkbookCache(cache_dir=str(tmp_path / 'cache'))
+    cache.put(wbi.id, wbi.updated_at, compact_workbook(workbook))
+    cached = cache.get(wbi.id, wbi.updated_at)
+    wbx = LocalWorkbookExtractor()
+    assert (
+        wbx.extract_all(LocalWorkbook(wbi, cached, on_disk=False))
+        == wbx.extract_all(LocalWorkbook(wbi, workbook))
+    )
+    # A newer version of the Workbook is a miss
+    assert cache.get(wbi.id, wbi.updated_at + datetime.timedelta(seconds=1)) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
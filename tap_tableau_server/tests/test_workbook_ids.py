@@ -0,0 +1,47 @@
+"""Tests fingerprints of Workbook IDs."""
+
+import uuid
+
+import pytest
+
+from tap_tableau_server.cache import WorkbookIdsCache
+from tap_tableau_server.workbook_ids import (
+    encode_ids, decode_ids, ids_digest, diff_ids
+)
+
+
+@pytest.mark.parametrize("ids", [
+    [str(uuid.uuid4()) for _ in range(100)],
+    [f"wb-{i:03d}" for i in range(100)],
+    # One ID that would not survive UUID packing unchanged
+    [str(uuid.uuid4()) for _ in range(5)] + [str(uuid.uuid4()).upper()],
+    [],
+])
+def test_fingerprint_round_trip(ids):
+    assert decode_ids(encode_ids(ids)) == sorted(ids)
+
+
+def test_fingerprint_packs_uuids():
+    ids = [str(uuid.uuid4()) for _ in range(1000)]
+    assert len(encode_ids(ids)) < 25 * len(ids)
+
+
+def test_digest_and_diff():
+    previous = ['a', 'b', 'c']
+    current = ['d', 'c', 'a']
+    assert ids_digest(previous) == ids_digest(list(reversed(previous)))
+    assert ids_digest(previous) != ids_digest(current)
+    assert diff_ids(decode_ids(encode_ids(previous)), current) == (['d'], ['b'])
+
+
+def test_ids_cache_round_trip(tmp_path):
+    ids = [str(uuid.uuid4()) for _ in range(100)]
+    cache = WorkbookIdsCache(str(tmp_path))
+    cache.put('site', ids_digest(ids), ids)
+    cache.close()
+
+    cache = WorkbookIdsCache(str(tmp_path))
+    assert cache.get('site', ids_digest(ids)) == sorted(ids)
+    assert cache.get('other-site', ids_digest(ids)) is None
+    assert cache.get('site', ids_digest(ids[1:])) is None
+    cache.close()
@@ -0,0 +1,268 @@
+"""Client-side rate limiting and retries for Tableau Server requests.
+
+A `Throttle` is shared by every worker of a client. It combines a token
+bucket (capping requests per second), a retry policy (exponential backoff
+with jitter, honouring `Retry-After`, within a per-run retry budget) and a
+circuit breaker that makes every worker back off together while the server
+is throttling or failing.
+"""
+
+import time
+import random
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from tableauserverclient.server.endpoint.exceptions import InternalServerError
+
+from .metrics import metrics
+
+
+logger = logging.getLogger('tap_tableau_server.throttling')
+
+# Response statuses that mean "slow down"
+THROTTLE_STATUSES = (429, 503)
+
+
+class ThrottledError(Exception):
+    """ Raised for 429 and 503 responses, with the server's `Retry-After`
+    (in seconds), if any.
+    """
+
+    def __init__(self, status, retry_after=None):
+        self.status = status
+        self.retry_after = retry_after
+        super().__init__(
+            f"Throttled by Tableau Server (HTTP {status}"
+            + (f", retry after {retry_after:.0f}s)" if retry_after is not None else ")")
+        )
+
+
+def parse_retry_after(value):
+    """ Seconds to wait from a `Retry-After` header (seconds or HTTP date).
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def raise_for_throttling(response, *args, **kwargs):
+    """ `requests` response hook raising ThrottledError on 429/503.
+    """
+    if response.status_code in THROTTLE_STATUSES:
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        response.close()
+        raise ThrottledError(response.status_code, retry_after)
+
+
+RETRYABLE_EXCEPTIONS = (
+    ThrottledError, InternalServerError, requests.ConnectionError, requests.Timeout
+)
+
+
+class TokenBucket:
+    """ Allows `rate` requests per second on average, in bursts of up to
+    `burst` requests. A `rate` of None means no limit.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """ Take a token, returning how many seconds to wait before using it.
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class CircuitBreaker:
+    """ Opens for `reset_timeout` seconds after `failure_threshold`
+    consecutive failures, or for as long as the server asks us to slow down.
+    While open, every caller waits until it closes again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.trips = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait_time(self):
+        """ Seconds until the breaker closes (0 if it is closed).
+        """
+        with self._lock:
+            return max(0.0, self._open_until - time.monotonic())
+
+    def open(self, seconds):
+        with self._lock:
+            open_until = time.monotonic() + seconds
+            if open_until > self._open_until:
+                self._open_until = open_until
+                self.trips += 1
+                logger.warning(
+                    f"Backing off all requests to Tableau Server for {seconds:.1f}s."
+                )
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            failures = self.failures
+        if failures >= self.failure_threshold:
+            self.open(self.reset_timeout)
+
+
+class RetryPolicy:
+    """ Exponential backoff with full jitter, capped at `max_wait` seconds.
+
+    At most `max_retries` retries are made per request, and at most
+    `retry_budget` across the whole run, so a failing server cannot stall
+    the sync indefinitely.
+    """
+
+    def __init__(
+        self, max_retries=3, initial_wait=0.5, backoff_factor=2, max_wait=60.0,
+        retry_budget=100, retry_on=None
+    ):
+        self.max_retries = max_retries
+        self.initial_wait = initial_wait
+        self.backoff_factor = backoff_factor
+        self.max_wait = max_wait
+        self.retry_budget = retry_budget
+        self.retry_on = tuple(retry_on or RETRYABLE_EXCEPTIONS)
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def is_retryable(self, error):
+        return isinstance(error, self.retry_on)
+
+    def delay(self, attempt, error):
+        """ Seconds to wait before retry number `attempt` (from 1).
+        """
+        if isinstance(error, ThrottledError) and error.retry_after is not None:
+            return min(self.max_wait, error.retry_after)
+        backoff = self.initial_wait * (self.backoff_factor ** (attempt - 1))
+        return random.uniform(0, min(self.max_wait, backoff))
+
+    def spend(self):
+        """ Take one retry from the run's budget, if any is left.
+        """
+        with self._lock:
+            if self.retry_budget is not None and self.retries >= self.retry_budget:
+                return False
+            self.retries += 1
+            if self.retries == self.retry_budget:
+                logger.warning(
+                    f"Retry budget of {self.retry_budget} retries used up. "
+                    "Failing requests will no longer be retried."
+                )
+            return True
+
+
+class Throttle:
+    """ Rate limits, retries and circuit breaking for calls to Tableau Server.
+    """
+
+    def __init__(self, bucket=None, policy=None, breaker=None):
+        self.bucket = bucket or TokenBucket()
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+
+    def _wait_time(self):
+        return self.breaker.wait_time() + self.bucket.reserve()
+
+    def _retry_delay(self, error, attempt):
+        """ Record a failed attempt, returning the delay before retrying, or
+        None if the error should be raised.
+        """
+        if not self.policy.is_retryable(error):
+            return None
+        self.breaker.record_failure()
+        delay = self.policy.delay(attempt, error)
+        if isinstance(error, ThrottledError):
+            metrics.incr('throttled_responses')
+            # Slow every worker down, not just this one
+            self.breaker.open(delay)
+        if attempt > self.policy.max_retries or not self.policy.spend():
+            return None
+        metrics.incr('retries')
+        logger.warning(
+            f"Request failed ({error}). "
+            f"Retry {attempt}/{self.policy.max_retries} in {delay:.1f}s."
+        )
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        """ Call `func(*args, **kwargs)`, retrying retryable errors.
+        """
+        attempt = 1
+        while True:
+            time.sleep(self._wait_time())
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def acall(self, func, *args, **kwargs):
+        """ Await `func(*args, **kwargs)`, retrying retryable errors, without
+        blocking the event loop.
+        """
+        attempt = 1
+        while True:
+            await asyncio.sleep(self._wait_time())
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    def log_stats(self):
+        logger.info(
+            f"Throttling: {self.policy.retries} retries, "
+            f"circuit breaker opened {self.breaker.trips} times."
+        )
@@ -1,5 +1,4 @@
-import time
-from functools import wraps
+from datetime import date, datetime
 
 
 def json_serial(obj):
@@ -9,55 +8,3 @@ def json_serial(obj):
     if isinstance(obj, set):
         return list(obj)
     raise TypeError ("Type %s not serializable" % type(obj))
-
-
-def log(msg, logger=None):
-    if logger:
-        logger.warning(msg)
-    else:
-        print(msg)
-
-
-# Based on https://gist.github.com/FBosler/be10229aba491a8c912e3a1543bbc74e
-def retry(
-    exceptions, total_tries=4, initial_wait=0.5,
-    backoff_factor=2, logger=None, finally_raise=True
-):
-    """
-    calling the decorated function applying an exponential backoff.
-    Args:
-        exceptions: Exeption(s) that trigger a retry, can be a tuble
-        total_tries: Total tries
-        initial_wait: Time to first retry
-        backoff_factor: Backoff multiplier (e.g. value of 2 will double the delay each retry).
-        logger: logger to be used, if none specified print
-    """
-    def retry_decorator(f):
-        @wraps(f)
-        def func_with_retries(*args, **kwargs):
-            _tries, _delay = total_tries + 1, initial_wait
-            while _tries > 1:
-                try:
-                    log(f'{total_tries + 2 - _tries}. try:', logger)
-                    return f(*args, **kwargs)
-                except exceptions as e:
-                    _tries -= 1
-                    print_args = args if args else 'no args'
-                    if _tries == 1:
-                        msg = str(f'Function: {f.__name__}\n'
-                                  f'Failed despite best efforts after {total_tries} tries.\n'
-                                  f'args: {print_args}, kwargs: {kwargs}')
-                        log(msg, logger)
-                        if finally_raise:
-                            raise
-                        else:
-                            return
-                    msg = str(f'Function: {f.__name__}\n'
-                              f'Exception: {e}\n'
-                              f'Retrying in {_delay} seconds!, args: {print_args}, kwargs: {kwargs}\n')
-                    log(msg, logger)
-                    time.sleep(_delay)
-                    _delay *= backoff_factor
-
-        return func_with_retries
-    return retry_decorator
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""Compact fingerprints of a site's Workbook IDs.
+
+A fingerprint is the sorted set of IDs, packed as 16-byte UUIDs where every
+ID is one (as Tableau's LUIDs are) or newline-separated text otherwise, then
+zlib-compressed and base64-encoded. Fingerprints are kept in the Workbook IDs
+cache, by digest, so each run can emit only the IDs added and removed since
+the previous run while the tap's state only keeps the digest.
+"""
+
+import zlib
+import uuid
+import base64
+import hashlib
+from typing import Iterable, List, Tuple
+
+UUID_FORMAT = b'u'
+TEXT_FORMAT = b't'
+
+
+def _pack_uuids(ids):
+    packed = []
+    for workbook_id in ids:
+        try:
+            luid = uuid.UUID(workbook_id)
+        except ValueError:
+            return None
+        # Only if the ID can be restored exactly
+        if str(luid) != workbook_id:
+            return None
+        packed.append(luid.bytes)
+    return b''.join(packed)
+
+
+def encode_ids(ids: Iterable[str]) -> str:
+    """ Fingerprint a set of IDs.
+    """
+    ids = sorted(set(ids))
+    packed = _pack_uuids(ids)
+    if packed is not None:
+        payload = UUID_FORMAT + packed
+    else:
+        payload = TEXT_FORMAT + '\n'.join(ids).encode('utf-8')
+    return base64.b64encode(zlib.compress(payload, 9)).decode('ascii')
+
+
+def decode_ids(fingerprint: str) -> List[str]:
+    """ The sorted IDs of a fingerprint.
+    """
+    payload = zlib.decompress(base64.b64decode(fingerprint))
+    data = payload[1:]
+    if payload[:1] == UUID_FORMAT:
+        return [str(uuid.UUID(bytes=data[i:i + 16])) for i in range(0, len(data), 16)]
+    if payload[:1] == TEXT_FORMAT:
+        return data.decode('utf-8').split('\n') if data else []
+    raise ValueError("Unknown Workbook ID fingerprint format.")
+
+
+def ids_digest(ids: Iterable[str]) -> str:
+    """ SHA-256 of the sorted set of IDs, to tell whether it has changed.
+    """
+    return hashlib.sha256('\n'.join(sorted(set(ids))).encode('utf-8')).hexdigest()
+
+
+def diff_ids(
+    previous: Iterable[str], current: Iterable[str]
+) -> Tuple[List[str], List[str]]:
+    """ Sorted `(added, removed)` IDs.
+    """
+    previous, current = set(previous), set(current)
+    return sorted(current - previous), sorted(previous - current)